@@ -2,7 +2,7 @@
 import os
 import re
 
-from topics import ConfigFile, SubCommandWithThread, \
+from topics import ConfigFile, ProcessingError, SubCommandWithThread, \
     RaiseExceptionIfOptionMissed
 from options import Values
 
@@ -94,10 +94,13 @@ The format of the plain-text configuration file can refer to the topic
 
             # ensure to construct thread logger
             self.get_logger(project.name, level=2)  # pylint: disable=E1101
-            self._run(project.schema,  # pylint: disable=E1101
-                      project,
-                      largs,
-                      ignore_except=ignore_error)
+            ret = self._run(project.schema,  # pylint: disable=E1101
+                            project,
+                            largs,
+                            ignore_except=ignore_error)
+            # fail the batch like the exceptions of the project
+            if ret != 0 and not ignore_error:
+                raise ProcessingError('failed to run %s' % project.name)
 
         def _batch(batch):
             conf = ConfigFile(batch)
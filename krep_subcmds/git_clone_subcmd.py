@@ -1,8 +1,9 @@
 
 import urlparse
 
-from topics import FileUtils, GitProject, SubCommand, DownloadError, \
-    Gerrit, Pattern, ProcessingError, RaiseExceptionIfOptionMissed
+from topics import BundleIndex, CloneCache, FileUtils, GitProject, \
+    ObjectPool, SubCommand, DownloadError, Gerrit, Pattern, \
+    ProcessingError, RaiseExceptionIfOptionMissed, TransferProfile
 
 
 class GitCloneSubcmd(SubCommand):
@@ -77,14 +78,23 @@ replaced by GIT_URL."""
 
         logger = self.get_logger()  # pylint: disable=E1101
         if ulp.scheme:
-            remote = ulp.hostname
+            servers = [(options.remote, ulp.hostname)]
             projectname = ulp.path.strip('/')
         else:
-            remote = options.remote
+            # the same project could be pushed to several servers
+            servers = [(server.strip(), server.strip())
+                       for server in options.remote.split(',')
+                       if server.strip()]
             projectname = self.get_name(options)  # pylint: disable=E1101
 
-        remote = FileUtils.ensure_path(
-            remote, prefix='git://', subdir=projectname, exists=False)
+        if not servers:
+            raise ProcessingError('remote (--remote) is not set')
+
+        remotes = [
+            FileUtils.ensure_path(
+                server, prefix='git://', subdir=projectname, exists=False)
+            for _, server in servers]
+        remote = remotes[0]
 
         working_dir = self.get_absolute_working_dir(options)  # pylint: disable=E1101
         project = GitProject(
@@ -98,29 +108,60 @@ replaced by GIT_URL."""
             pattern=Pattern(options.pattern))
 
         ret = 0
-        if not options.offsite:
+        if options.bundle_import:
+            ret = BundleIndex.load(options.bundle_import).apply(
+                project, projectname, tryrun=options.tryrun)
+            if ret != 0:
+                raise DownloadError('%s: failed to import bundle' % project)
+        elif not options.offsite:
+            pool, cache = None, None
+            if options.object_pool:
+                pool = ObjectPool(
+                    options.object_pool, options.object_pool_repack)
+            if options.clone_cache:
+                cache = CloneCache(
+                    options.clone_cache, options.clone_cache_size)
+
+            TransferProfile.apply(options, project, projectname)
             ret = project.download(
-                options.git, options.mirror, options.bare)
+                options.git, options.mirror, options.bare,
+                filter_spec=options.filter, pool=pool,
+                force_fetch=options.force_fetch, cache=cache)
             if ret != 0:
                 raise DownloadError('%s: failed to fetch project' % project)
 
-        ulp = urlparse.urlparse(remote)
-        # creat the project in the remote
-        if ulp.scheme in ('ssh', 'git'):
-            if not options.tryrun and options.remote and options.repo_create:
-                gerrit = Gerrit(options.remote)
-                gerrit.create_project(
-                    ulp.path.strip('/'),
-                    description=options.description,
-                    source=options.git,
-                    options=options)
-        else:
-            raise ProcessingError(
-                '%s: unknown scheme for remote "%s"' % (project, remote))
+        if options.bundle_export:
+            index = BundleIndex.load(options.bundle_export)
+            try:
+                ret = index.export(
+                    project, projectname, tryrun=options.tryrun)
+                index.save()
+            finally:
+                project.close()
+
+            return ret
+
+        for (server, _), remote in zip(servers, remotes):
+            ulp = urlparse.urlparse(remote)
+            # creat the project in the remote
+            if ulp.scheme in ('ssh', 'git'):
+                if not options.tryrun and server and options.repo_create:
+                    gerrit = Gerrit(server)
+                    gerrit.create_project(
+                        ulp.path.strip('/'),
+                        description=options.description,
+                        source=options.git,
+                        options=options)
+            else:
+                raise ProcessingError(
+                    '%s: unknown scheme for remote "%s"' % (project, remote))
 
         self.do_hook(  # pylint: disable=E1101
             'pre-push', options, tryrun=options.tryrun)
 
+        # select again with the size of the downloaded objects
+        TransferProfile.apply(options, project, projectname)
+
         # push the branches
         if self.override_value(  # pylint: disable=E1101
                 options.all, options.branches):
@@ -131,6 +172,12 @@ replaced by GIT_URL."""
                 push_all=options.all,
                 fullname=options.keep_name,
                 force=options.force,
+                atomic=options.atomic,
+                chunk=options.push_chunk,
+                verify=options.verify_remote,
+                steps=options.push_steps,
+                step_size=options.push_step_size,
+                remotes=remotes,
                 tryrun=options.tryrun)
 
             ret |= res
@@ -146,12 +193,21 @@ replaced by GIT_URL."""
                     options.refs, options.tag_refs),
                 fullname=options.keep_name,
                 force=options.force,
+                chunk=options.push_chunk,
+                jobs=options.push_jobs,
+                verify=options.verify_remote,
+                remotes=remotes,
                 tryrun=options.tryrun)
 
             ret |= res
             if res:
                 logger.error('Failed to push tags')
 
+        if len(remotes) > 1:
+            for line in project.push_summary():
+                logger.info(line)
+
+        project.close()
         self.do_hook(  # pylint: disable=E1101
             'post-push', options, tryrun=options.tryrun)
 
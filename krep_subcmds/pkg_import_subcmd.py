@@ -7,8 +7,9 @@ import shutil
 import tempfile
 import time
 
-from topics import FileDiff, FileUtils, FileWasher, GitProject, Gerrit, \
-    Logger, SubCommand, RaiseExceptionIfOptionMissed
+from topics import FileDiff, FileUtils, FileWasher, GitMaintenance, \
+    GitProject, Gerrit, Logger, ProcessingError, SubCommand, \
+    TransferProfile, RaiseExceptionIfOptionMissed
 
 
 def _hash_digest(filename, mode):
@@ -247,11 +248,19 @@ The escaped variants are supported for the imported files including:
     def get_name(self, options):
         return options.name or '[-]'
 
-    def execute(self, options, *args, **kws):  # pylint: disable=R0915
+    def execute(self, options, *args, **kws):
         SubCommand.execute(self, options, option_import=True, *args, **kws)
 
+        with GitMaintenance.deferred_gc(options.maintenance):
+            return self.import_packages(options, *args)
+
+    def import_packages(self, options, *args):  # pylint: disable=R0915
         logger = Logger.get_logger()  # pylint: disable=E1101
 
+        if options.remote and ',' in options.remote:
+            raise ProcessingError(
+                'only one remote (--remote) is supported to import')
+
         pkgs, name = list(), None
         for pkg in args:
             pkgname, revision = _split_name(
@@ -315,6 +324,7 @@ The escaped variants are supported for the imported files including:
             revision=branch,
             remote=remote)
 
+        TransferProfile.apply(options, project)
         ret = project.init_or_download(
             branch, single_branch=True, offsite=options.offsite)
         if ret != 0:
@@ -430,22 +440,34 @@ The escaped variants are supported for the imported files including:
                 except OSError, e:
                     logger.exception(e)
 
+        if not ret and options.maintenance:
+            ret = GitMaintenance(
+                options.maintenance_jobs,
+                tryrun=options.tryrun).run([project])
+
         # push the branches
         if not ret and not options.local:
+            TransferProfile.apply(options, project)
             if self.override_value(  # pylint: disable=E1101
                     options.branches, options.all):
                 ret = project.push_heads(
                     branch,
                     self.override_value(  # pylint: disable=E1101
                         options.refs, options.head_refs),
-                    force=options.force, tryrun=options.tryrun)
+                    force=options.force, atomic=options.atomic,
+                    chunk=options.push_chunk,
+                    steps=options.push_steps,
+                    step_size=options.push_step_size,
+                    verify=options.verify_remote, tryrun=options.tryrun)
             # push the tags
             if tags and self.override_value(  # pylint: disable=E1101
                     options.tags, options.all):
                 ret = project.push_tags(
                     tags, self.override_value(  # pylint: disable=E1101
                         options.refs, options.tag_refs),
-                    fullname=True, force=options.force, tryrun=options.tryrun)
+                    fullname=True, force=options.force,
+                    chunk=options.push_chunk, jobs=options.push_jobs,
+                    verify=options.verify_remote, tryrun=options.tryrun)
 
         return ret == 0
 
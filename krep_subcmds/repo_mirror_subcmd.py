@@ -2,7 +2,8 @@
 import os
 
 from repo_subcmd import RepoSubcmd
-from topics import GitProject, Pattern
+from topics import BundleIndex, CloneBundles, DownloadError, GitProject, \
+    Pattern
 
 
 class RepoMirrorSubcmd(RepoSubcmd):
@@ -23,13 +24,74 @@ All projects inside .repo/default.xml will be managed and imported. Exactly,
 the manifest git will be detected and converted to the actual location to
 import either. (For example, the android manifest git in .repo/manifests is
 acutally in platform/manifest.git within a mirror.)
+
+With the option "--bundle-export", the projects are exported as incremental
+git bundles into the directory instead of pushing. And the directory could be
+carried to the other side and imported with the option "--bundle-import",
+which needn't the manifest or the network access to the upstream.
+
+With the option "--clone-bundle", the clone.bundle of each project is written
+into the directory once its references changed, which could be served over
+HTTP to the initial sync of git-repo with the index file "index.json".
 """
 
     def options(self, optparse):
         RepoSubcmd.options(self, optparse)
+        BundleIndex.options(optparse)
+        CloneBundles.options(optparse)
         optparse.suppress_opt('--mirror', True)
 
+    def execute(self, options, *args, **kws):
+        try:
+            return RepoSubcmd.execute(self, options, *args, **kws)
+        finally:
+            # the indexes are written once for all the projects
+            if options.bundle_export:
+                BundleIndex.load(options.bundle_export).save()
+            if options.clone_bundle:
+                CloneBundles.load(options.clone_bundle).save()
+
+    def init_and_sync(self, options):
+        # the projects are created from the bundles
+        if not options.bundle_import:
+            RepoSubcmd.init_and_sync(self, options)
+
+    def fetch_projects_in_bundles(self, options):
+        index = BundleIndex.load(options.bundle_import)
+
+        projects = list()
+        logger = self.get_logger()  # pylint: disable=E1101
+        pattern = Pattern(options.pattern)
+
+        for name in index.names():
+            entry = index.get(name)
+            if not entry.get('source'):
+                logger.warning('%s: no source in the index, ignored', name)
+                continue
+            elif not pattern.match('p,project', entry['source']):
+                logger.debug('%s ignored by the pattern', entry['source'])
+                continue
+
+            path = os.path.join(
+                self.get_absolute_working_dir(options),  # pylint: disable=E1101
+                '%s.git' % entry['source'])
+            projects.append(
+                GitProject(
+                    name,
+                    worktree=path,
+                    gitdir=path,
+                    revision=entry['revision'],
+                    remote='%s/%s' % (options.remote, name),
+                    bare=True,
+                    pattern=pattern,
+                    source=entry['source']))
+
+        return projects
+
     def fetch_projects_in_manifest(self, options):
+        if options.bundle_import:
+            return self.fetch_projects_in_bundles(options)
+
         manifest = self.get_manifest(options)
 
         projects = list()
@@ -64,3 +126,29 @@ acutally in platform/manifest.git within a mirror.)
                     linkfiles=node.linkfiles))
 
         return projects
+
+    @staticmethod
+    def push(project, options, remote):
+        if options.bundle_import:
+            ret = BundleIndex.load(options.bundle_import).apply(
+                project, project.uri, tryrun=options.tryrun)
+            if ret != 0:
+                raise DownloadError('%s: failed to import bundle' % project)
+
+        if options.clone_bundle:
+            ret = CloneBundles.load(options.clone_bundle).refresh(
+                project, project.uri, tryrun=options.tryrun)
+            if ret != 0:
+                RepoMirrorSubcmd.get_logger(name=str(project)).error(
+                    'failed to refresh clone.bundle')
+
+        if options.bundle_export:
+            ret = BundleIndex.load(options.bundle_export).export(
+                project, project.uri, tryrun=options.tryrun)
+            if ret != 0:
+                RepoMirrorSubcmd.get_logger(name=str(project)).error(
+                    'failed to export bundle')
+            project.close()
+            return
+
+        RepoSubcmd.push(project, options, remote)
@@ -2,9 +2,9 @@
 import os
 import urlparse
 
-from topics import Command, FileUtils, GitProject, Gerrit, Manifest, \
-    ManifestBuilder, Pattern, SubCommandWithThread, DownloadError, \
-    RaiseExceptionIfOptionMissed
+from topics import Command, FileUtils, GitMaintenance, GitProject, Gerrit, \
+    Manifest, ManifestBuilder, Pattern, SubCommandWithThread, DownloadError, \
+    ProcessingError, RaiseExceptionIfOptionMissed, TransferProfile
 
 
 class RepoCommand(Command):
@@ -179,6 +179,9 @@ this command.
             else:
                 project.revision = '%s/%s' % (node.remote, node.revision)
 
+            # not to keep the co-processes of all projects before pushing
+            project.close()
+
             projects.append(project)
 
         return projects
@@ -197,6 +200,9 @@ this command.
             repo.add_args(options.manifest_branch, before='-b')
             repo.add_args(options.manifest_name, before='-m')
             repo.add_args('--mirror', condition=options.mirror)
+            repo.add_args(
+                options.filter, before=['--partial-clone', '--clone-filter'],
+                condition=not options.mirror)
             # pylint: enable=E1101
 
             opti = options.extra_values(options.extra_option, 'repo-init')
@@ -265,13 +271,22 @@ this command.
             name=project_name)
 
         logger.info('Start processing ...')
-        if not options.tryrun and remote:
-            gerrit = Gerrit(remote)
-            gerrit.create_project(project.uri, options=options)
+        targets = options.remote_targets or [(remote, project.remote)]
+        if not options.tryrun:
+            for server, _ in targets:
+                if server:
+                    gerrit = Gerrit(server)
+                    gerrit.create_project(project.uri, options=options)
+
+        remotes = [project.remote]
+        remotes.extend(['%s/%s' % (url, project.uri)
+                        for _, url in targets[1:]])
 
         RepoSubcmd.do_hook(  # pylint: disable=E1101
             'pre-push', options, tryrun=options.tryrun)
 
+        TransferProfile.apply(options, project)
+
         # push the branches
         if RepoSubcmd.override_value(  # pylint: disable=E1101
                 options.branches, options.all):
@@ -283,6 +298,12 @@ this command.
                 fullname=options.keep_name,
                 force=options.force,
                 sha1tag=options.sha1_tag,
+                atomic=options.atomic,
+                chunk=options.push_chunk,
+                verify=options.verify_remote,
+                steps=options.push_steps,
+                step_size=options.push_step_size,
+                remotes=remotes,
                 tryrun=options.tryrun)
             if res != 0:
                 logger.error('failed to push heads')
@@ -295,10 +316,19 @@ this command.
                     options.refs, options.tag_refs),
                 fullname=options.keep_name,
                 force=options.force,
+                chunk=options.push_chunk,
+                jobs=options.push_jobs,
+                verify=options.verify_remote,
+                remotes=remotes,
                 tryrun=options.tryrun)
             if res != 0:
                 logger.error('failed to push tags')
 
+        if len(remotes) > 1:
+            for line in project.push_summary():
+                logger.info(line)
+
+        project.close()
         RepoSubcmd.do_hook(  # pylint: disable=E1101
             'post-push', options, tryrun=options.tryrun)
 
@@ -395,23 +425,37 @@ this command.
     def execute(self, options, *args, **kws):
         SubCommandWithThread.execute(self, options, *args, **kws)
 
+        with GitMaintenance.deferred_gc(options.maintenance):
+            return self.import_projects(options)
+
+    def import_projects(self, options):
         RaiseExceptionIfOptionMissed(
             options.remote, 'remote (--remote) is not set')
 
         if options.prefix and not options.endswith('/'):
             options.prefix += '/'
 
+        # handle the schema of the remotes, the first one is the primary
+        targets = list()
+        for server in options.remote.split(','):
+            server = server.strip()
+            ulp = urlparse.urlparse(server)
+            if not server:
+                continue
+            elif not ulp.scheme:
+                targets.append((server, 'git://%s' % server))
+            else:
+                targets.append((ulp.netloc.strip('/'), server))
+
+        if not targets:
+            raise ProcessingError('remote (--remote) is not set')
+
+        remote, options.remote = targets[0]
+        options.remote_targets = targets
+
         if not options.offsite:
             self.init_and_sync(options)
 
-        # handle the schema of the remote
-        ulp = urlparse.urlparse(options.remote)
-        if not ulp.scheme:
-            remote = options.remote
-            options.remote = 'git://%s' % options.remote
-        else:
-            remote = ulp.netloc.strip('/')
-
         projects = self.fetch_projects_in_manifest(options)
 
         if options.print_new_projects or options.dump_projects or \
@@ -433,5 +477,12 @@ this command.
             RepoSubcmd.build_xml_file(options, projects, True)
             return
 
+        # maintain the downloaded projects before the pushes like pkg-import
+        # so that the pushes pack the objects from the repacked repositories
+        if options.maintenance and GitMaintenance(
+                options.maintenance_jobs,
+                tryrun=options.tryrun).run(projects) != 0:
+            return False
+
         return self.run_with_thread(  # pylint: disable=E1101
-            options.job, projects, RepoSubcmd.push, options, remote)
+            options.job, projects, self.push, options, remote)
@@ -0,0 +1,341 @@
+import json
+import os
+import threading
+import urlparse
+
+from repo_subcmd import RepoSubcmd
+from topics import CommandExecutor, ConfigFile, FileUtils, GitProject, \
+    Pattern, ProcessingError, RefStore, SubCommandWithThread
+
+
+class VerifySubcmd(SubCommandWithThread):
+    COMMAND = 'verify'
+
+    help_summary = 'Verify the references of the mirrored projects'
+    help_usage = """\
+%prog [options] ...
+
+Compare the references of the upstreams, the local mirrors and the remote
+server without changing any of them.
+
+The projects are read from the git-repo mirror in the working directory, or
+from the config files like the sub-command "batch" with the option "--file",
+whose projects provide "git" as the upstream, "name" and "working-dir".
+
+The heads and tags of each upstream are listed in parallel and checked with
+the local and the remote references. The remote references are mapped with
+the options "--refs", "--head-refs", "--tag-refs", "--keep-name" and the
+patterns of the revisions and the tags like the pushes, and the references
+discarded by the patterns aren't verified. The mismatched references are
+reported as:
+
+ missing  - the reference doesn't exist
+ stale    - the reference falls behind the upstream
+ diverged - the reference isn't an ancestor of the upstream one
+
+The sub-command exits with non-zero if any reference is mismatched or any
+project fails to be verified.
+"""
+
+    MISSING = 'missing'
+    STALE = 'stale'
+    DIVERGED = 'diverged'
+
+    def options(self, optparse):
+        # only the pattern is read besides the remote options, not the ones
+        # of the pushes and the fetches
+        SubCommandWithThread.options(self, optparse, option_remote=True,
+                                     modules={'Pattern': Pattern})
+
+        options = optparse.get_option_group('--refs') or \
+            optparse.add_option_group('Remote options')
+        options.add_option(
+            '--remote', '--server',
+            dest='remote', action='store',
+            help='Set the remote server to verify with the upstreams')
+        options.add_option(
+            '--prefix',
+            dest='prefix', action='store', metavar='PREFIX',
+            help='prefix on the remote location')
+
+        options = optparse.add_option_group('Verify options')
+        options.add_option(
+            '-f', '--file',
+            dest='file', action='append', metavar='FILE',
+            help='Read the projects from the config file instead of the '
+                 'git-repo mirror')
+        options.add_option(
+            '--format',
+            dest='format', action='store', default='text',
+            type='choice', choices=('text', 'json'),
+            help='Set the format of the report, "text" or "json", '
+                 'default: %default')
+        options.add_option(
+            '-o', '--output',
+            dest='output', action='store', metavar='FILE',
+            help='Write the report into the file instead of the console')
+
+        # nothing is changed or fetched to run the hooks or be forced
+        for opt in ('--offsite', '--hook-dir', '--tryrun', '--force'):
+            optparse.suppress_opt(opt)
+
+    @staticmethod
+    def _remote_url(server):
+        ulp = urlparse.urlparse(server)
+        if not ulp.scheme and not os.path.isabs(server):
+            return 'git://%s' % server
+
+        return server
+
+    def fetch_projects_in_manifest(self, options):
+        manifest = RepoSubcmd.get_manifest(options, mirror=True)
+
+        projects = list()
+        logger = self.get_logger()  # pylint: disable=E1101
+        pattern = Pattern(options.pattern)
+
+        for node in manifest.get_projects():
+            path = os.path.join(
+                self.get_absolute_working_dir(options),  # pylint: disable=E1101
+                '%s.git' % node.name)
+            if not os.path.exists(path):
+                logger.warning('%s not existed, ignored', path)
+                continue
+            elif not pattern.match('p,project', node.name):
+                logger.debug('%s ignored by the pattern', node.name)
+                continue
+
+            project = GitProject(
+                '%s%s' % (options.prefix or '', pattern.replace(
+                    'p,project', node.name, name=node.name)),
+                worktree=path, gitdir=path, bare=True, pattern=pattern,
+                source=node.name)
+            ret, upstream = project.ls_remote('--get-url', node.remote)
+            projects.append((project, upstream.strip() if ret == 0 else None))
+
+        return projects
+
+    def fetch_projects_in_files(self, options):
+        projects = list()
+        pattern = Pattern(options.pattern)
+
+        for filename in options.file:
+            conf = ConfigFile(filename)
+            for name in conf.get_names('project') or list():
+                for vals in conf.get_values(name):
+                    pname = vals.name or conf.get_subsection_name(name)
+                    if not vals.git or not pattern.match('p,project', pname):
+                        continue
+
+                    path = os.path.join(
+                        self.get_absolute_working_dir(options),  # pylint: disable=E1101
+                        vals.working_dir or pname)
+                    bare = str(vals.bare).lower() in ('true', 'yes', '1')
+                    projects.append((GitProject(
+                        '%s%s' % (options.prefix or '', pname),
+                        worktree=path,
+                        gitdir=FileUtils.ensure_path(
+                            path, subdir=None if bare else '.git'),
+                        bare=bare, pattern=pattern, source=pname), vals.git))
+
+        return projects
+
+    @staticmethod
+    def _compare(project, expected, actual, side, result):
+        """Records the mismatched references of the side into the result."""
+        absent, changed = RefStore(expected).diff(actual)
+        for ref in absent:
+            result['mismatched'].append((VerifySubcmd.MISSING, side, ref,
+                                         expected[ref], None))
+
+        for ref in changed:
+            sha1 = actual.get(ref)
+            # a reference falls behind if the upstream SHA-1 is absent
+            # locally or descends from it
+            if not project.rev_existed(expected[ref]):
+                state = VerifySubcmd.STALE
+            elif not project.rev_existed(sha1):
+                state = VerifySubcmd.DIVERGED
+            else:
+                ret, _ = project.merge_base(
+                    '--is-ancestor', sha1, expected[ref])
+                if ret == 0:
+                    state = VerifySubcmd.STALE
+                elif ret == 1:
+                    state = VerifySubcmd.DIVERGED
+                else:
+                    result['errors'].append(
+                        'failed to compare %s %s' % (side, ref))
+                    continue
+
+            result['mismatched'].append(
+                (state, side, ref, expected[ref], sha1))
+
+    def verify(self, project, upstream, options):
+        """Returns the mismatched references of the project."""
+        result = {'project': project.uri, 'upstream': upstream,
+                  'references': 0, 'errors': list(), 'mismatched': list()}
+        if not upstream:
+            result['errors'].append('no upstream')
+            return result
+
+        ret, refs = project.get_remote_refs(upstream)
+        if ret != 0:
+            result['errors'].append('failed to list %s' % upstream)
+            return result
+
+        heads = self.override_value(  # pylint: disable=E1101
+            options.refs, options.head_refs)
+        tags = self.override_value(  # pylint: disable=E1101
+            options.refs, options.tag_refs)
+
+        # the remote references are named like the pushes, and the ones
+        # discarded by the patterns are neither fetched nor pushed
+        local, remote = dict(), dict()
+        for ref, sha1 in refs.items():
+            if ref.endswith('^{}'):
+                continue
+            elif ref.startswith('refs/heads/'):
+                name = ref[len('refs/heads/'):]
+                local_ref = ref if project.bare else \
+                    'refs/remotes/origin/%s' % name
+                remote_ref = project.map_head(
+                    name, heads, options.keep_name, local_ref)
+            elif ref.startswith('refs/tags/'):
+                local_ref = ref
+                remote_ref = project.map_tag(
+                    ref[len('refs/tags/'):], tags, options.keep_name)
+            else:
+                continue
+
+            if remote_ref:
+                local[local_ref] = sha1
+                remote[remote_ref] = sha1
+
+        result['references'] = len(local)
+
+        ret, lrefs = project.get_local_refs()
+        if ret != 0:
+            result['errors'].append('failed to read the local references')
+        else:
+            self._compare(project, local, lrefs.refs, 'local', result)
+
+        if options.remote:
+            url = '%s/%s' % (self._remote_url(options.remote), project.uri)
+            ret, rrefs = project.get_remote_refs(url)
+            if ret != 0:
+                result['errors'].append('failed to list %s' % url)
+            else:
+                self._compare(project, remote, rrefs, 'remote', result)
+
+        project.close()
+        return result
+
+    @staticmethod
+    def _report_text(results):
+        lines = list()
+
+        total = dict()
+        for result in results:
+            counts = dict()
+            for item in result['mismatched']:
+                counts[item[0]] = counts.get(item[0], 0) + 1
+                total[item[0]] = total.get(item[0], 0) + 1
+
+            if not counts and not result['errors']:
+                continue
+
+            lines.append('%s: %s' % (result['project'], ', '.join(
+                ['%d %s' % (counts.get(state, 0), state) for state in (
+                    VerifySubcmd.MISSING, VerifySubcmd.STALE,
+                    VerifySubcmd.DIVERGED)])))
+            for error in result['errors']:
+                lines.append('  error     %s' % error)
+            for state, side, ref, _, _ in sorted(result['mismatched']):
+                lines.append('  %-9s %-7s %s' % (state, side, ref))
+
+        lines.append(
+            '%d project(s) verified, %d missing, %d stale, %d diverged, '
+            '%d error(s)' % (
+                len(results), total.get(VerifySubcmd.MISSING, 0),
+                total.get(VerifySubcmd.STALE, 0),
+                total.get(VerifySubcmd.DIVERGED, 0),
+                len([r for r in results if r['errors']])))
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _report_json(results):
+        projects = list()
+        for result in results:
+            items = dict([(state, list()) for state in (
+                VerifySubcmd.MISSING, VerifySubcmd.STALE,
+                VerifySubcmd.DIVERGED)])
+            for state, side, ref, expected, actual in sorted(
+                    result['mismatched']):
+                items[state].append({
+                    'side': side, 'ref': ref,
+                    'expected': expected, 'actual': actual})
+
+            items.update({
+                'project': result['project'],
+                'upstream': result['upstream'],
+                'references': result['references'],
+                'errors': result['errors']})
+            projects.append(items)
+
+        return json.dumps({'projects': projects}, indent=2, sort_keys=True)
+
+    def execute(self, options, *args, **kws):
+        SubCommandWithThread.execute(self, options, *args, **kws)
+
+        if options.file:
+            projects = self.fetch_projects_in_files(options)
+        else:
+            projects = self.fetch_projects_in_manifest(options)
+
+        # list the upstreams and the remotes in the loop of an executor
+        # instead of a thread per command, and the references are shared
+        # with the verification later
+        executor = CommandExecutor(options.job)
+        pendings = list()
+        for project, upstream in projects:
+            urls = [upstream] if upstream else list()
+            if options.remote:
+                urls.append('%s/%s' % (
+                    self._remote_url(options.remote), project.uri))
+
+            for url in urls:
+                pendings.append(project.get_remote_refs_async(executor, url))
+
+        executor.wait([pending for pending in pendings if pending])
+
+        lock = threading.Lock()
+        results = list()
+
+        def _verify(task, options):
+            result = self.verify(task[0], task[1], options)
+            with lock:
+                results.append(result)
+
+        self.run_with_thread(  # pylint: disable=E1101
+            options.job, projects, _verify, options)
+
+        results.sort(key=lambda result: result['project'])
+        if options.format == 'json':
+            report = VerifySubcmd._report_json(results)
+        else:
+            report = VerifySubcmd._report_text(results)
+
+        if options.output:
+            with open(options.output, 'w') as fp:
+                fp.write(report)
+        else:
+            print report.rstrip()
+
+        # exit with non-zero to gate the scripts with the report
+        failed = [result for result in results
+                  if result['errors'] or result['mismatched']]
+        if failed:
+            raise ProcessingError(
+                '%d project(s) failed the verification' % len(failed))
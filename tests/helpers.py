@@ -0,0 +1,56 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+
+def git(*args):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(('git',) + args, stdout=devnull, stderr=devnull)
+
+
+def output(*args):
+    return subprocess.check_output(('git',) + args)
+
+
+def refs(gitdir):
+    """Returns the references of the repository with their object names."""
+    results = dict()
+    for line in output(
+            '-C', gitdir, 'for-each-ref',
+            '--format=%(refname) %(objectname)').splitlines():
+        ref, sha1 = line.split()
+        results[ref] = sha1
+
+    return results
+
+
+def commit(worktree, message, filename='file'):
+    with open(os.path.join(worktree, filename), 'w') as fp:
+        fp.write('%s\n' % message)
+
+    git('-C', worktree, 'add', filename)
+    git('-C', worktree, '-c', 'user.name=krep',
+        '-c', 'user.email=krep@localhost', 'commit', '-q', '-m', message)
+
+
+def make_repo(path, commits=1):
+    """Creates the repository with the commits on the branch "master"."""
+    git('init', '-q', path)
+    for k in range(commits):
+        commit(path, 'commit %d' % k)
+
+    if commits:
+        git('-C', path, 'branch', '-M', 'master')
+
+    return path
+
+
+class GitTestCase(unittest.TestCase):
+    """Runs the test in a temporary directory removed at the end."""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
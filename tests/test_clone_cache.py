@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import CloneCache, GitProject  # noqa: E402
+from helpers import GitTestCase, make_repo, output  # noqa: E402
+
+
+class CloneCacheTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.upstream = make_repo(os.path.join(self.tmpdir, 'upstream'), 3)
+        self.cache = CloneCache(os.path.join(self.tmpdir, 'cache'))
+
+    def _download(self, name, upstream=None, **kws):
+        upstream = upstream or self.upstream
+        path = os.path.join(self.tmpdir, name)
+        project = GitProject(
+            name, worktree=path, gitdir=os.path.join(path, '.git'),
+            remote=upstream, revision='master')
+        ret = project.download(upstream, cache=self.cache, **kws)
+        project.close()
+
+        return ret, path
+
+    def _missing(self, path):
+        return [line for line in output(
+            '-C', path, 'rev-list', '--objects', '--missing=print',
+            '--all').splitlines() if line.startswith('?')]
+
+    def test_download(self):
+        ret, path = self._download('full')
+        self.assertEqual(ret, 0)
+        self.assertEqual(output(
+            '-C', path, 'config', 'remote.origin.url').strip(), self.upstream)
+        self.assertFalse(self._missing(path))
+
+    def test_download_filtered(self):
+        ret, path = self._download('partial', filter_spec='blob:none')
+        self.assertEqual(ret, 0)
+        self.assertEqual(output(
+            '-C', path, 'config', 'remote.origin.url').strip(), self.upstream)
+        self.assertEqual(output(
+            '-C', path, 'config', 'remote.origin.promisor').strip(), 'true')
+        # the blobs of the history aren't cloned but the checked-out one
+        self.assertEqual(len(self._missing(path)), 2)
+
+    def test_evict(self):
+        other = make_repo(os.path.join(self.tmpdir, 'other'), 2)
+
+        # pylint: disable=W0212
+        entries = list()
+        for k, upstream in enumerate((self.upstream, other)):
+            self.assertEqual(self._download('p%d' % k, upstream)[0], 0)
+            entry = self.cache._entry(upstream)
+            stamp = os.path.join(entry, CloneCache.STAMP)
+            # the first mirror is the least recently used one
+            os.utime(stamp, (k + 1, k + 1))
+            entries.append((entry, CloneCache._stamp_size(stamp)))
+
+        self.assertTrue(entries[0][1] > 0 and entries[1][1] > 0)
+
+        # the total size fits once the oldest mirror is evicted
+        size = max(entries[0][1], entries[1][1])
+        self.cache.size = size
+        self.cache.evict()
+        self.assertFalse(os.path.exists(entries[0][0]))
+        self.assertTrue(os.path.exists(entries[1][0]))
+
+        # but the mirror in use is kept and the next one is evicted
+        self.cache.size = None
+        self.assertEqual(self._download('p2')[0], 0)
+        self.assertTrue(os.path.exists(entries[1][0]))
+
+        self.cache.size = size
+        os.utime(os.path.join(entries[0][0], CloneCache.STAMP), (1, 1))
+        with self.cache._locked(entries[0][0]) as locked:
+            self.assertTrue(locked)
+            self.cache.evict()
+        # pylint: enable=W0212
+
+        self.assertTrue(os.path.exists(entries[0][0]))
+        self.assertFalse(os.path.exists(entries[1][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
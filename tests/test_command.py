@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import unittest
+
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import Command  # noqa: E402
+
+
+class CommandStreamTest(unittest.TestCase):
+    def _stream(self, script, **kws):
+        cmd = Command()
+        cmd.new_args(['sh', '-c', script])
+
+        return cmd.stream(**kws)
+
+    def test_lines(self):
+        output = self._stream(
+            'seq 3; printf tail; echo error >&2; exit 3')
+
+        self.assertEqual(list(output), ['1', '2', '3', 'tail'])
+        self.assertEqual(output.returncode, 3)
+        self.assertEqual(output.get_error(), 'error')
+        self.assertEqual(output.close(), 3)
+
+    def test_long_line(self):
+        output = self._stream(
+            'head -c %d /dev/zero | tr "\\0" x; echo' % (
+                Command.MAX_LINE + 10))
+
+        self.assertEqual([len(line) for line in output],
+                         [Command.MAX_LINE, 10])
+        self.assertEqual(output.returncode, 0)
+
+    def test_error_lines(self):
+        output = self._stream('seq %d >&2' % (Command.ERROR_LINES * 2))
+
+        self.assertEqual(list(output), list())
+        errors = output.get_error().split('\n')
+        self.assertEqual(len(errors), Command.ERROR_LINES)
+        self.assertEqual(errors[-1], str(Command.ERROR_LINES * 2))
+
+    def test_close_early(self):
+        started = time.time()
+        output = self._stream('echo first; exec sleep 30')
+
+        for line in output:
+            self.assertEqual(line, 'first')
+            break
+
+        # the command is terminated once the reading stops
+        self.assertTrue(output.returncode < 0)
+        self.assertTrue(time.time() - started < 10)
+
+    def test_context(self):
+        events = list()
+
+        @contextmanager
+        def _context():
+            events.append('enter')
+            yield
+            events.append('exit')
+
+        output = self._stream('echo line', context=_context())
+        self.assertEqual(events, ['enter'])
+        self.assertEqual(list(output), ['line'])
+        self.assertEqual(events, ['enter', 'exit'])
+
+        output.close()
+        self.assertEqual(events, ['enter', 'exit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
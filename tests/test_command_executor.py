@@ -0,0 +1,157 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import CommandExecutor, CommandPolicy, PendingCommand, \
+    ProcessingError  # noqa: E402
+
+
+class CommandExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _count(self):
+        return len(os.listdir(self.tmpdir))
+
+    def test_job_limit(self):
+        # each command records the commands running with it
+        script = 'd=$(mktemp -d -p %s); ls %s | wc -l; sleep 0.3; ' \
+                 'rmdir $d' % (self.tmpdir, self.tmpdir)
+
+        executor = CommandExecutor(2)
+        pendings = [executor.submit(PendingCommand(['sh', '-c', script]))
+                    for _ in range(6)]
+
+        self.assertEqual(executor.wait(pendings), 0)
+        self.assertEqual(
+            max([int(pending.stdout) for pending in pendings]), 2)
+
+    def test_stall(self):
+        started = time.time()
+        executor = CommandExecutor()
+        pending = executor.submit(PendingCommand(
+            ['sh', '-c', 'exec sleep 30'], stall=1))
+
+        self.assertTrue(pending.wait() < 0)
+        self.assertTrue(pending.reason.startswith('stalled'))
+        self.assertTrue(time.time() - started < 10)
+
+    def _run(self, script):
+        policy = CommandPolicy._parse(  # pylint: disable=W0212
+            'fetch:retries=2,backoff=0.01')
+        executor = CommandExecutor()
+        pending = executor.submit(PendingCommand(
+            ['sh', '-c', 'mktemp -d -p %s; %s' % (self.tmpdir, script)],
+            policy=policy))
+
+        return pending.wait()
+
+    def test_retry_network(self):
+        self.assertEqual(
+            self._run('echo "fatal: early EOF" >&2; exit 128'), 128)
+        self.assertEqual(self._count(), 3)
+
+    def test_retry_fatal(self):
+        self.assertEqual(
+            self._run('echo "fatal: Authentication failed" >&2; exit 128'),
+            128)
+        self.assertEqual(self._count(), 1)
+
+    def test_retry_interrupt(self):
+        self.assertTrue(self._run('kill -INT $$') < 0)
+        self.assertEqual(self._count(), 1)
+
+    def test_stdin(self):
+        payload = ''.join(['%d\n' % k for k in range(100000)])
+
+        executor = CommandExecutor()
+        pending = executor.submit(PendingCommand(['cat'], stdin=payload))
+        empty = executor.submit(PendingCommand(['cat'], stdin=''))
+
+        self.assertEqual(pending.result(), (0, payload))
+        self.assertEqual(empty.result(), (0, ''))
+
+
+class CommandPolicyTest(unittest.TestCase):
+    def test_parse(self):
+        policy = CommandPolicy._parse(  # pylint: disable=W0212
+            'push: timeout=60, stall=30,retries=2,max-backoff=10,jitter=0')
+
+        self.assertEqual(policy.kind, 'push')
+        self.assertEqual(policy.timeout, 60)
+        self.assertEqual(policy.stall, 30)
+        self.assertEqual(policy.retries, 2)
+        self.assertEqual(policy.max_backoff, 10)
+        self.assertEqual(policy.delay(5), 10)
+
+    def test_parse_errors(self):
+        for value in ('clone:retries=1', 'fetch:retry=1', 'fetch:retries=x'):
+            self.assertRaises(
+                ProcessingError,
+                CommandPolicy._parse, value)  # pylint: disable=W0212
+
+    def test_retryable(self):
+        policy = CommandPolicy('ls-remote', retries=1)
+
+        self.assertTrue(policy.retryable(-15, '', 'timed out after 1s'))
+        self.assertFalse(policy.retryable(-15))
+        self.assertFalse(policy.retryable(128, 'fatal: not found'))
+        self.assertTrue(policy.retryable(
+            128, 'ssh: connect to host h port 22: Connection refused'))
+        self.assertFalse(CommandPolicy('gerrit').retryable(
+            128, 'Connection reset'))
+        self.assertTrue(CommandPolicy('gerrit').retryable(
+            255, 'ssh: Could not resolve host: h'))
+        self.assertFalse(policy.retryable(1, 'error: early EOF'))
+        self.assertFalse(policy.retryable(128, None))
+
+    def test_run(self):
+        results = [(128, 'fatal: early EOF', None),
+                   (-15, '', 'stalled without output for 1s'),
+                   (0, '', None)]
+        calls = list()
+
+        def _func():
+            calls.append(len(calls))
+            return results[len(calls) - 1]
+
+        policy = CommandPolicy('fetch', retries=2, backoff=0.01)
+        self.assertEqual(policy.run(_func), 0)
+        self.assertEqual(len(calls), 3)
+
+        # the retries are bounded and the fatal errors never retried
+        del calls[:]
+        policy.retries = 1
+        self.assertEqual(policy.run(_func), -15)
+        self.assertEqual(len(calls), 2)
+
+        del calls[:]
+        results[0] = (128, 'fatal: Authentication failed', None)
+        self.assertEqual(policy.run(_func), 128)
+        self.assertEqual(len(calls), 1)
+
+    def test_configure(self):
+        try:
+            CommandPolicy.configure(['fetch:retries=3', 'push:stall=10'])
+            self.assertEqual(CommandPolicy.get('fetch').retries, 3)
+            self.assertEqual(CommandPolicy.get('push').stall, 10)
+            self.assertEqual(CommandPolicy.get('gerrit').retries, 0)
+
+            self.assertEqual(CommandPolicy.get('push').progress(
+                ['push', 'origin']), ['push', '--progress', 'origin'])
+            self.assertEqual(CommandPolicy.get('fetch').progress(
+                ['fetch', 'origin']), ['fetch', 'origin'])
+        finally:
+            CommandPolicy.configure(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
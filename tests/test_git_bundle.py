@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import BundleIndex, CloneBundles, GitProject  # noqa: E402
+from helpers import GitTestCase, commit, git, make_repo, refs  # noqa: E402
+
+
+class _BundleTestCase(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = make_repo(os.path.join(self.tmpdir, 'work'))
+        git('-C', self.worktree, 'tag', 'v1')
+
+        self.source = os.path.join(self.tmpdir, 'source.git')
+        git('clone', '-q', '--bare', self.worktree, self.source)
+
+        self.dirname = os.path.join(self.tmpdir, 'bundles')
+        # the remote keys the journal of the exported references
+        self.remote = os.path.join(self.tmpdir, 'remote')
+
+    def _bare(self, path, **kws):
+        return GitProject('platform/build', worktree=path, gitdir=path,
+                          bare=True, revision='master', **kws)
+
+
+class BundleIndexTest(_BundleTestCase):
+    def test_export_and_apply(self):
+        index = BundleIndex(self.dirname)
+        project = self._bare(self.source, remote=self.remote, source='build')
+        self.assertEqual(index.export(project, 'platform/build'), 0)
+        project.close()
+
+        # the new history is exported incrementally
+        commit(self.worktree, 'c2')
+        git('-C', self.source, 'fetch', '-q', self.worktree,
+            '+refs/heads/*:refs/heads/*')
+
+        project = self._bare(self.source, remote=self.remote, source='build')
+        self.assertEqual(index.export(project, 'platform/build'), 0)
+        project.close()
+        index.save()
+
+        with open(os.path.join(self.dirname, BundleIndex.INDEX)) as fp:
+            entry = json.load(fp)['projects']['platform/build']
+
+        self.assertEqual(entry['source'], 'build')
+        self.assertEqual([bundle['bundle'] for bundle in entry['bundles']],
+                         ['platform/build.1.bundle', 'platform/build.2.bundle'])
+        self.assertFalse(entry['bundles'][0]['prerequisites'])
+        self.assertTrue(entry['bundles'][1]['prerequisites'])
+
+        target = os.path.join(self.tmpdir, 'target.git')
+        project = self._bare(target)
+        self.assertEqual(BundleIndex(self.dirname).apply(
+            project, 'platform/build'), 0)
+        project.close()
+
+        source = refs(self.source)
+        self.assertEqual(dict([(ref, sha1) for ref, sha1 in refs(
+            target).items() if ref in source]), source)
+
+    def test_import_with_remote(self):
+        index = BundleIndex(self.dirname)
+        project = self._bare(self.source, remote=self.remote)
+        self.assertEqual(index.export(project, 'platform/build'), 0)
+        project.close()
+
+        commit(self.worktree, 'c2')
+        git('-C', self.source, 'fetch', '-q', self.worktree,
+            '+refs/heads/*:refs/heads/*')
+
+        project = self._bare(self.source, remote=self.remote)
+        self.assertEqual(index.export(project, 'platform/build'), 0)
+        project.close()
+
+        # the prerequisites of the incremental bundle are fetched from the
+        # remote into the temporary references removed after the import
+        target = os.path.join(self.tmpdir, 'target.git')
+        project = self._bare(target, remote=self.source)
+        self.assertEqual(project.import_bundle(os.path.join(
+            self.dirname, 'platform/build.2.bundle')), 0)
+        project.close()
+
+        self.assertEqual(refs(target)['refs/heads/master'],
+                         refs(self.source)['refs/heads/master'])
+        self.assertFalse([ref for ref in refs(target)
+                          if ref.startswith('refs/krep/')])
+
+    def test_export_without_source(self):
+        index = BundleIndex(self.dirname)
+        project = self._bare(self.source)
+        self.assertEqual(index.export(project, 'platform/build'), 0)
+        project.close()
+
+        # the projects of git-p are imported into the names
+        self.assertEqual(index.get('platform/build')['source'],
+                         'platform/build')
+
+    def test_apply_unknown(self):
+        project = self._bare(os.path.join(self.tmpdir, 'target.git'))
+        self.assertNotEqual(
+            BundleIndex(self.dirname).apply(project, 'unknown'), 0)
+        project.close()
+
+
+class CloneBundlesTest(_BundleTestCase):
+    def test_refresh(self):
+        bundles = CloneBundles(self.dirname)
+        project = self._bare(self.source)
+        self.assertEqual(bundles.refresh(project, 'platform/build'), 0)
+
+        filename = os.path.join(
+            self.dirname, 'platform/build', CloneBundles.BUNDLE)
+        entry = bundles.get('platform/build')
+        self.assertTrue(os.path.exists(filename))
+        self.assertEqual(entry['refs'], refs(self.source))
+        self.assertEqual(entry['size'], os.path.getsize(filename))
+
+        # the bundle isn't rewritten with the unchanged references
+        os.utime(filename, (0, 0))
+        self.assertEqual(bundles.refresh(project, 'platform/build'), 0)
+        self.assertEqual(os.path.getmtime(filename), 0)
+
+        commit(self.worktree, 'c2')
+        git('-C', self.source, 'fetch', '-q', self.worktree,
+            '+refs/heads/*:refs/heads/*')
+        self.assertEqual(bundles.refresh(project, 'platform/build'), 0)
+        self.assertNotEqual(os.path.getmtime(filename), 0)
+        self.assertNotEqual(bundles.get('platform/build')['fingerprint'],
+                            entry['fingerprint'])
+        project.close()
+
+        bundles.save()
+        with open(os.path.join(self.dirname, CloneBundles.INDEX)) as fp:
+            self.assertEqual(sorted(json.load(fp)['projects']),
+                             ['platform/build'])
+
+        # the bundle is cloned by git-repo before the initial sync
+        target = os.path.join(self.tmpdir, 'target.git')
+        git('clone', '-q', '--bare', filename, target)
+        self.assertEqual(refs(target), refs(self.source))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,305 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import CommandExecutor, GitProject, Pattern  # noqa: E402
+from topics.git_cmd import GitCatFile  # noqa: E402
+from topics.git_project import _remote_refs  # noqa: E402
+from helpers import GitTestCase, commit, git, make_repo, output  # noqa: E402
+
+
+class GitProjectTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = make_repo(os.path.join(self.tmpdir, 'project'), 3)
+        self.gitdir = os.path.join(self.worktree, '.git')
+        self.head = output('-C', self.worktree, 'rev-parse', 'HEAD').strip()
+
+    def tearDown(self):
+        GitProject._disk_usage_supported = True  # pylint: disable=W0212
+        GitTestCase.tearDown(self)
+
+    def test_cat_file_closed(self):
+        cat_file = GitCatFile('git', self.gitdir)
+        self.assertEqual(
+            cat_file.resolve_many(['master', 'unknown']),
+            {'master': self.head, 'unknown': None})
+
+        # the closed instance never respawns the co-process
+        cat_file.close()
+        self.assertEqual(cat_file.resolve_many(['master']), dict())
+        self.assertIsNone(cat_file.proc)
+
+    def test_resolve_after_close(self):
+        project = GitProject('project', worktree=self.worktree)
+        self.assertEqual(project.resolve_many(['master']),
+                         {'master': self.head})
+
+        # a new co-process is started once the project closed the last one
+        cat_file = project._cat_file  # pylint: disable=W0212
+        project.close()
+        self.assertTrue(cat_file.closed)
+        self.assertEqual(project.resolve_many(['master']),
+                         {'master': self.head})
+        project.close()
+
+    def test_step_commits(self):
+        project = GitProject('project', worktree=self.worktree)
+        commits = output(
+            '-C', self.worktree, 'rev-list', '--reverse', 'HEAD').split()
+
+        # pylint: disable=W0212
+        self.assertEqual(project._step_commits(self.head, list(), 1),
+                         commits[:-1])
+        self.assertEqual(project._step_commits(self.head, list(), 2),
+                         commits[1:2])
+        self.assertEqual(
+            project._step_commits(self.head, list(), step_size=1), list())
+
+        # the steps of the commit count are kept without --disk-usage
+        project._disk_usage = lambda *args: None
+        self.assertEqual(
+            project._step_commits(self.head, list(), 1, 1), commits[:-1])
+        self.assertEqual(
+            project._step_commits(self.head, list(), step_size=1), list())
+        self.assertFalse(GitProject._disk_usage_supported)
+        # pylint: enable=W0212
+        project.close()
+
+    def test_local_heads(self):
+        git('-C', self.worktree, 'branch', 'topic', 'HEAD~')
+        topic = output('-C', self.worktree, 'rev-parse', 'topic').strip()
+
+        path = os.path.join(self.tmpdir, 'clone')
+        git('clone', '-q', self.worktree, path)
+        git('-C', path, 'branch', 'local', 'origin/topic')
+        git('-C', path, 'checkout', '-q', '-b', 'work')
+        self.assertEqual(output(
+            '-C', path, 'symbolic-ref', 'refs/remotes/origin/HEAD').strip(),
+            'refs/remotes/origin/master')
+
+        # the current branch is skipped unless asked and so is origin/HEAD
+        project = GitProject(
+            'clone', worktree=path, gitdir=os.path.join(path, '.git'))
+        self.assertEqual(project.get_local_heads(), (0, {
+            'local': topic, 'master': self.head, 'topic': topic,
+            'remotes/origin/master': self.head,
+            'remotes/origin/topic': topic}))
+        self.assertEqual(project.get_local_heads(local=True)[1]['work'],
+                         self.head)
+        project.close()
+
+        path = os.path.join(self.tmpdir, 'bare.git')
+        git('clone', '-q', '--bare', self.worktree, path)
+
+        # all the heads of the bare repository are included
+        project = GitProject('bare', worktree=path, gitdir=path, bare=True)
+        self.assertEqual(project.get_local_heads(), (0, {
+            'master': self.head, 'topic': topic}))
+        project.close()
+
+    def test_local_tags(self):
+        git('-C', self.worktree, 'tag', 'v1', 'HEAD~')
+        git('-C', self.worktree, '-c', 'user.name=krep',
+            '-c', 'user.email=krep@localhost', 'tag', '-a', '-m', 'v2', 'v2')
+
+        project = GitProject('project', worktree=self.worktree)
+        self.assertEqual(project.get_local_tags(), (0, ['v1', 'v2']))
+
+        _, refs = project.get_local_refs()
+        self.assertEqual(refs.get('refs/tags/v2', peeled=True), self.head)
+        self.assertNotEqual(refs.get('refs/tags/v2'), self.head)
+
+        # the snapshot is kept with the read-only commands only
+        project.rev_parse('HEAD')
+        self.assertTrue(project.get_local_refs()[1] is refs)
+        project.tag('v3')
+        self.assertFalse(project.get_local_refs()[1] is refs)
+        self.assertEqual(project.get_local_tags(), (0, ['v1', 'v2', 'v3']))
+        project.close()
+
+    def test_download_again(self):
+        path = os.path.join(self.tmpdir, 'clone')
+        project = GitProject(
+            'clone', worktree=path, gitdir=os.path.join(path, '.git'),
+            remote=self.worktree)
+        self.assertEqual(project.download(self.worktree), 0)
+
+        commit(self.worktree, 'new')
+        head = output('-C', self.worktree, 'rev-parse', 'HEAD').strip()
+
+        # the heads are fetched into the same namespace as the clone
+        self.assertEqual(project.download(self.worktree), 0)
+        self.assertEqual(output(
+            '-C', path, 'rev-parse', 'refs/remotes/origin/master').strip(),
+            head)
+        self.assertEqual(
+            output('-C', path, 'rev-parse', 'refs/heads/master').strip(),
+            self.head)
+        project.close()
+
+    def test_download_unchanged(self):
+        path = os.path.join(self.tmpdir, 'clone')
+
+        def _download():
+            fetches = list()
+            project = GitProject(
+                'clone', worktree=path, gitdir=os.path.join(path, '.git'),
+                remote=self.worktree)
+            fetch = project.fetch
+
+            def _fetch(*args, **kws):
+                fetches.append(args)
+                return fetch(*args, **kws)
+
+            project.fetch = _fetch
+            self.assertEqual(project.download(self.worktree), 0)
+            project.close()
+
+            # the upstream is listed again by a later run
+            _remote_refs.invalidate(self.worktree)
+            return len(fetches)
+
+        self.assertEqual(_download(), 0)
+        self.assertEqual(_download(), 1)
+        # skipped without any change of the upstream
+        self.assertEqual(_download(), 0)
+
+        git('-C', self.worktree, 'tag', 'v1')
+        self.assertEqual(_download(), 1)
+        self.assertEqual(_download(), 0)
+        self.assertEqual(output(
+            '-C', path, 'rev-parse', 'v1').strip(), self.head)
+
+    def test_download_narrowed(self):
+        git('-C', self.worktree, 'branch', 'topic', 'HEAD~')
+        git('-C', self.worktree, 'tag', 'v1', 'HEAD~')
+        git('-C', self.worktree, 'tag', 'v2')
+        path = os.path.join(self.tmpdir, 'clone')
+
+        def _download(pattern=None):
+            fetches = list()
+            project = GitProject(
+                'clone', worktree=path, gitdir=os.path.join(path, '.git'),
+                remote=self.worktree, pattern=pattern)
+            fetch = project.fetch
+
+            def _fetch(*args, **kws):
+                fetches.append(
+                    [arg for arg in args if arg.startswith('+')] +
+                    kws.get('stdin', '').split())
+                return fetch(*args, **kws)
+
+            project.fetch = _fetch
+            self.assertEqual(project.download(self.worktree), 0)
+            project.close()
+
+            _remote_refs.invalidate(self.worktree)
+            return fetches
+
+        def _refs():
+            return output(
+                '-C', path, 'for-each-ref', '--format=%(refname)').split()
+
+        refspecs = ['+refs/heads/master:refs/remotes/origin/master',
+                    '+refs/tags/v1:refs/tags/v1']
+        pattern = Pattern(['rev:^master$', 'tag:^v1$'])
+        # the matched references are fetched after cloning the initial one
+        self.assertEqual(_download(pattern), [refspecs])
+        self.assertEqual(_refs(), [
+            'refs/heads/master', 'refs/remotes/origin/HEAD',
+            'refs/remotes/origin/master', 'refs/tags/v1'])
+
+        # and so is the existing repository
+        commit(self.worktree, 'new')
+        self.assertEqual(_download(pattern), [refspecs])
+        self.assertFalse('refs/tags/v2' in _refs())
+
+        # the heads are fetched like git-clone without the patterns
+        commit(self.worktree, 'next')
+        self.assertEqual(_download(), [
+            ['+refs/heads/*:refs/remotes/origin/*']])
+        self.assertEqual(output(
+            '-C', path, 'rev-parse', 'refs/remotes/origin/topic').strip(),
+            output('-C', self.worktree, 'rev-parse', 'topic').strip())
+
+    def _missing(self, path):
+        return [line for line in output(
+            '-C', path, 'rev-list', '--objects', '--missing=print',
+            '--all').splitlines() if line.startswith('?')]
+
+    def test_partial_clone(self):
+        git('-C', self.worktree, 'config', 'uploadpack.allowFilter', 'true')
+
+        path = os.path.join(self.tmpdir, 'clone')
+        project = GitProject(
+            'clone', worktree=path, gitdir=os.path.join(path, '.git'),
+            remote=self.worktree, revision='master')
+        self.assertIsNone(project.get_promisor())
+
+        self.assertEqual(project.download(
+            'file://%s' % self.worktree, filter_spec='blob:none'), 0)
+        self.assertEqual(project.get_promisor(), 'origin')
+        self.assertEqual(len(self._missing(path)), 2)
+
+        # the missing objects are fetched before pushing the history
+        remote = os.path.join(self.tmpdir, 'remote.git')
+        git('init', '-q', '--bare', remote)
+        self.assertEqual(project.push_heads('master', remotes=[remote]), 0)
+        self.assertFalse(self._missing(path))
+        self.assertEqual(output(
+            '-C', remote, 'rev-parse', 'refs/heads/master').strip(),
+            self.head)
+        project.close()
+
+    def test_remote_refs_v2(self):
+        git('-C', self.worktree, '-c', 'user.name=krep',
+            '-c', 'user.email=krep@localhost', 'tag', '-a', '-m', 'v1', 'v1')
+        git('-C', self.worktree, 'update-ref', 'refs/changes/01/1/1', 'HEAD')
+        url = 'file://%s' % self.worktree
+        trace = os.path.join(self.tmpdir, 'trace')
+
+        project = GitProject('project', worktree=self.worktree)
+        project.set_env({'GIT_TRACE_PACKET': trace})
+        ret, refs = project.get_remote_refs(url)
+        self.assertEqual(ret, 0)
+        self.assertEqual(sorted(refs), [
+            'refs/heads/master', 'refs/tags/v1', 'refs/tags/v1^{}'])
+        self.assertEqual(refs['refs/tags/v1^{}'], self.head)
+
+        # only the prefixes are requested from the server
+        with open(trace) as fp:
+            packets = fp.read()
+
+        self.assertTrue('ref-prefix refs/heads/' in packets)
+        self.assertTrue('ref-prefix refs/tags/' in packets)
+        self.assertFalse('refs/changes/' in packets)
+
+        # still over protocol v2 with the configs of the caller even if
+        # the global config sets another version
+        gitconfig = os.path.join(self.tmpdir, 'gitconfig')
+        with open(gitconfig, 'w') as fp:
+            fp.write('[protocol]\n\tversion = 0\n')
+
+        os.remove(trace)
+        project.set_env({'GIT_CONFIG_GLOBAL': gitconfig})
+        ret, _ = project.ls_remote(
+            '--heads', url, configs=['core.quotepath=false'])
+        self.assertEqual(ret, 0)
+        with open(trace) as fp:
+            self.assertTrue('ref-prefix refs/heads/' in fp.read())
+
+        # listed once for the process unless forced or listed again
+        executor = CommandExecutor()
+        self.assertIsNone(project.get_remote_refs_async(executor, url))
+        pending = project.get_remote_refs_async(executor, url, force=True)
+        self.assertEqual(executor.wait([pending]), 0)
+        self.assertEqual(project.get_remote_refs(url)[1].items(), refs.items())
+        project.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import GitProject, PushJournal  # noqa: E402
+from topics.git_project import _RemoteRefs, _remote_refs, \
+    _split_refspecs  # noqa: E402
+from helpers import GitTestCase, commit, git, make_repo, output, \
+    refs  # noqa: E402
+
+
+class GitPushTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = make_repo(os.path.join(self.tmpdir, 'project'))
+        for k in range(4):
+            git('-C', self.worktree, 'branch', 'branch%d' % k)
+
+        self.remote = os.path.join(self.tmpdir, 'remote.git')
+        git('init', '-q', '--bare', self.remote)
+
+        self.pushes = list()
+        # the executors of the pushes submitted concurrently
+        self.executors = list()
+
+    def _project(self, remote=None):
+        project = GitProject(
+            'project', worktree=self.worktree,
+            gitdir=os.path.join(self.worktree, '.git'),
+            remote=remote or self.remote, revision='master')
+
+        # record the arguments of the pushes
+        new_command = project._new_command  # pylint: disable=W0212
+
+        def _new_command():
+            cmd = new_command()
+            push, push_async = cmd.push, cmd.push_async
+
+            def _push(*args, **kws):
+                self.pushes.append(args)
+                return push(*args, **kws)
+
+            def _push_async(executor, *args, **kws):
+                self.pushes.append(args)
+                self.executors.append(executor)
+                return push_async(executor, *args, **kws)
+
+            cmd.push, cmd.push_async = _push, _push_async
+            return cmd
+
+        project._new_command = _new_command  # pylint: disable=W0212
+        return project
+
+    def _delete_remote_ref(self, ref):
+        # changed out of the process, which lists the remote once
+        git('-C', self.remote, 'update-ref', '-d', ref)
+        _remote_refs.invalidate(self.remote)
+
+    def _remote_refs(self, remote=None):
+        return refs(remote or self.remote)
+
+    def test_split_refspecs(self):
+        refspecs = ['refs/heads/%d:refs/heads/%d' % (k, k) for k in range(5)]
+
+        self.assertEqual(list(_split_refspecs(list())), list())
+        self.assertEqual(list(_split_refspecs(refspecs)), [refspecs])
+        self.assertEqual(list(_split_refspecs(refspecs, 2)), [
+            refspecs[:2], refspecs[2:4], refspecs[4:]])
+        # each refspec is counted with a separator in the length
+        self.assertEqual(
+            list(_split_refspecs(refspecs, limit=len(refspecs[0]) * 2 + 1)),
+            [refspecs[:2], refspecs[2:4], refspecs[4:]])
+        # a longer refspec than the limitation is still pushed alone
+        self.assertEqual(list(_split_refspecs(refspecs, limit=1)),
+                         [[refspec] for refspec in refspecs])
+
+    def test_remote_refs_shared(self):
+        cache = _RemoteRefs()
+        loads = list()
+
+        def _loader(url):
+            loads.append(url)
+            # the other threads wait for the listing in progress
+            time.sleep(0.1)
+            return 0, {'refs/heads/master': '1' * 40}
+
+        results = list()
+
+        def _get():
+            results.append(cache.get('remote', _loader))
+
+        threads = [threading.Thread(target=_get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(loads, ['remote'])
+        self.assertEqual(len(results), 4)
+        for ret, cached in results:
+            self.assertEqual(ret, 0)
+            self.assertTrue(cached is results[0][1])
+
+        # listed again only once forced
+        self.assertEqual(cache.get('remote', _loader, force=True)[0], 0)
+        self.assertEqual(len(loads), 2)
+
+    def test_remote_refs_width(self):
+        cache = _RemoteRefs()
+        cache.put('remote', {'refs/heads/master': '1' * 40})
+        self.assertTrue(cache.has('remote'))
+
+        cache.update('remote', {'refs/heads/next': '2' * 40,
+                                'refs/heads/master': None})
+        self.assertEqual(cache.get('remote', None)[1].items(),
+                         [('refs/heads/next', '2' * 40)])
+
+        # the values of another hash algorithm discard the cache
+        cache.update('remote', {'refs/heads/sha256': '3' * 64})
+        self.assertFalse(cache.has('remote'))
+        cache.put('remote', {'refs/heads/master': '1' * 40,
+                             'refs/heads/sha256': '3' * 64})
+        self.assertFalse(cache.has('remote'))
+
+    def test_push_update_remote_refs(self):
+        git('-C', self.worktree, '-c', 'user.name=krep',
+            '-c', 'user.email=krep@localhost', 'tag', '-a', '-m', 'v1', 'v1')
+        git('-C', self.worktree, 'push', '-q', self.remote, 'refs/tags/v1')
+        head = output('-C', self.worktree, 'rev-parse', 'HEAD').strip()
+
+        project = self._project()
+        _, cached = project.get_remote_refs()
+        self.assertEqual(sorted(cached), ['refs/tags/v1', 'refs/tags/v1^{}'])
+
+        self.assertEqual(project.push_refspecs([
+            'refs/heads/master:refs/heads/master',
+            '+refs/heads/master:refs/tags/v1']), 0)
+        # updated in place without listing the remote again
+        git('-C', self.remote, 'update-ref', '-d', 'refs/heads/master')
+        _, cached = project.get_remote_refs()
+        self.assertEqual(dict(cached.items()), {
+            'refs/heads/master': head, 'refs/tags/v1': head})
+
+        # but invalidated with the unknown references of the wildcards
+        self.assertEqual(project.push_refspecs(
+            ['refs/heads/*:refs/heads/*']), 0)
+        self.assertFalse(_remote_refs.has(self.remote))
+        _, cached = project.get_remote_refs()
+        self.assertEqual(dict(cached.items()), self._remote_refs())
+        project.close()
+
+    def test_push_heads(self):
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True), 0)
+        self.assertEqual(len(self.pushes), 1)
+        self.assertEqual(sorted(self._remote_refs()), [
+            'refs/heads/branch%d' % k for k in range(4)] + [
+                'refs/heads/master'])
+        project.close()
+
+    def test_push_heads_chunked(self):
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True, chunk=2), 0)
+        self.assertEqual([len(args) - 1 for args in self.pushes], [2, 2, 1])
+        self.assertEqual(len(self._remote_refs()), 5)
+        project.close()
+
+    def test_push_tags_parallel(self):
+        for k in range(5):
+            git('-C', self.worktree, 'tag', 'tag%d' % k)
+
+        project = self._project()
+        self.assertEqual(project.push_tags(chunk=2, jobs=3), 0)
+        self.assertEqual(sorted(self._remote_refs()), [
+            'refs/tags/tag%d' % k for k in range(5)])
+        # the batches are submitted to the same executor together
+        self.assertEqual([len(args) - 1 for args in self.pushes], [2, 2, 1])
+        self.assertEqual(len(self.executors), 3)
+        self.assertEqual(len(set(self.executors)), 1)
+
+        # the existed tags aren't pushed again
+        del self.pushes[:]
+        self.assertEqual(project.push_tags(chunk=2, jobs=3, verify=True), 0)
+        self.assertEqual(self.pushes, list())
+        project.close()
+
+    def test_journal(self):
+        gitdir = os.path.join(self.worktree, '.git')
+        journal = PushJournal(gitdir, self.remote)
+        self.assertIsNone(journal.fingerprint('heads'))
+
+        journal.record('heads', 'abc', {'refs/heads/master': '1' * 40})
+        journal.record('tags', 'def', {'refs/tags/v1': '2' * 40})
+
+        journal = PushJournal(gitdir, self.remote)
+        self.assertEqual(journal.fingerprint('heads'), 'abc')
+        self.assertEqual(journal.refs('heads'),
+                         {'refs/heads/master': '1' * 40})
+        self.assertEqual(len(journal.refs()), 2)
+
+        journal.discard('tags')
+        self.assertIsNone(PushJournal(gitdir, self.remote).fingerprint('tags'))
+        self.assertIsNone(PushJournal(gitdir, 'other').fingerprint('heads'))
+
+    def test_journal_skip(self):
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True), 0)
+        self.assertEqual(len(self.pushes), 1)
+
+        # the unchanged heads are skipped without comparing the remote
+        project.close()
+        self._delete_remote_ref('refs/heads/branch0')
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True), 0)
+        self.assertEqual(len(self.pushes), 1)
+        self.assertEqual(len(self._remote_refs()), 4)
+
+        # and pushed again once changed in a later run
+        project.close()
+        commit(self.worktree, 'next')
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True), 0)
+        self.assertEqual(len(self.pushes), 2)
+        self.assertEqual(len(self._remote_refs()), 5)
+        project.close()
+
+    def test_journal_verify(self):
+        project = self._project()
+        self.assertEqual(project.push_heads(push_all=True), 0)
+
+        self._delete_remote_ref('refs/heads/branch0')
+        self.assertEqual(
+            project.push_heads(push_all=True, verify=True), 0)
+        self.assertEqual(len(self.pushes), 2)
+        self.assertEqual(len(self._remote_refs()), 5)
+        project.close()
+
+    def test_push_remotes(self):
+        other = os.path.join(self.tmpdir, 'other.git')
+        git('init', '-q', '--bare', other)
+        missing = os.path.join(self.tmpdir, 'missing.git')
+
+        project = self._project()
+        self.assertEqual(project.push_heads(
+            push_all=True, remotes=[self.remote, other]), 0)
+        self.assertEqual(self._remote_refs(), self._remote_refs(other))
+        self.assertEqual(project.push_summary(), [
+            '%s: heads done' % other, '%s: heads done' % self.remote])
+
+        # a failed remote doesn't stop the others
+        project.close()
+        commit(self.worktree, 'next')
+        project = self._project()
+        self.assertNotEqual(project.push_heads(
+            push_all=True, remotes=[missing, self.remote]), 0)
+        self.assertEqual(project.push_summary(), [
+            '%s: heads failed' % missing, '%s: heads done' % self.remote])
+        self.assertNotEqual(self._remote_refs(), self._remote_refs(other))
+        project.close()
+
+    def test_push_steps(self):
+        for k in range(4):
+            commit(self.worktree, 'step %d' % k)
+
+        project = self._project()
+        self.assertEqual(project.push_heads('master', steps=2), 0)
+        # two steps before the head of the five commits
+        self.assertEqual(len(self.pushes), 4)
+        self.assertEqual(self.pushes[0][1].split(':')[1],
+                         'refs/krep/steps/heads/master')
+        self.assertEqual(self.pushes[-1][1], ':refs/krep/steps/heads/master')
+
+        # the temporary references are removed with the journal
+        self.assertEqual(self._remote_refs(), {
+            'refs/heads/master': output(
+                '-C', self.worktree, 'rev-parse', 'HEAD').strip()})
+        self.assertFalse(project.get_journal().fingerprint(
+            'step:refs/heads/master'))
+        project.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import GitProject, ObjectPool  # noqa: E402
+from helpers import GitTestCase, git, make_repo, output  # noqa: E402
+
+
+class ObjectPoolTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.upstream = make_repo(os.path.join(self.tmpdir, 'upstream'), 3)
+        self.root = output(
+            '-C', self.upstream, 'rev-list', '--max-parents=0',
+            'HEAD').strip()
+        self.pooldir = os.path.join(self.tmpdir, 'pools')
+
+    def _pool(self, name, fetch=False):
+        gitdir = os.path.join(self.pooldir, '%s.git' % name)
+        git('init', '-q', '--bare', gitdir)
+        if fetch:
+            git('-C', gitdir, 'fetch', '-q', self.upstream,
+                '+refs/heads/*:refs/krep/seed/heads/*')
+
+        return gitdir
+
+    def _alternates(self, path):
+        with open(os.path.join(
+                path, '.git', 'objects', 'info', 'alternates')) as fp:
+            return [line.strip() for line in fp if line.strip()]
+
+    def _download(self, name, pool):
+        path = os.path.join(self.tmpdir, name)
+        project = GitProject(
+            name, worktree=path, gitdir=os.path.join(path, '.git'),
+            remote=self.upstream, revision='master')
+        ret = project.download(self.upstream, pool=pool)
+        project.close()
+
+        return ret, path
+
+    def test_share_referenced_pool(self):
+        # the pool of the root commit holds nothing of the upstream
+        self._pool(self.root)
+        gitdir = self._pool('seeded', fetch=True)
+
+        pool = ObjectPool(self.pooldir)
+        ret, path = self._download('project', pool)
+        self.assertEqual(ret, 0)
+        self.assertEqual(self._alternates(path),
+                         [os.path.join(gitdir, 'objects')])
+
+    def test_share_root_pool(self):
+        pool = ObjectPool(self.pooldir)
+        ret, path = self._download('project', pool)
+        self.assertEqual(ret, 0)
+        self.assertEqual(self._alternates(path), [os.path.join(
+            self.pooldir, '%s.git' % self.root, 'objects')])
+
+        # the second clone references the pool shared by the first one
+        ret, path = self._download('fork', pool)
+        self.assertEqual(ret, 0)
+        self.assertEqual(self._alternates(path), [os.path.join(
+            self.pooldir, '%s.git' % self.root, 'objects')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import binascii
+import glob
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import GitProject, ObjectStore  # noqa: E402
+from topics.object_store import _PackIndex  # noqa: E402
+from helpers import GitTestCase, commit, git, output  # noqa: E402
+
+
+class ObjectStoreTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = os.path.join(self.tmpdir, 'project')
+        git('init', '-q', self.worktree)
+        for k in range(20):
+            commit(self.worktree, 'commit %d' % k, 'file%d' % k)
+
+        git('-C', self.worktree, 'repack', '-q', '-a', '-d')
+        self.gitdir = os.path.join(self.worktree, '.git')
+        self.objects = sorted(set([
+            line.split()[0] for line in output(
+                '-C', self.worktree, 'rev-list', '--objects',
+                '--all').splitlines()]))
+
+    def test_pack_index(self):
+        self.assertFalse(glob.glob(os.path.join(self.gitdir, 'objects', '??')))
+        filenames = glob.glob(
+            os.path.join(self.gitdir, 'objects', 'pack', 'pack-*.idx'))
+        self.assertEqual(len(filenames), 1)
+
+        index = _PackIndex(filenames[0])
+        try:
+            self.assertTrue(index.valid())
+            self.assertEqual(index.fanout[-1], len(self.objects))
+            for sha1 in self.objects:
+                self.assertTrue(index.has(binascii.unhexlify(sha1)), sha1)
+
+            # the neighbours of the objects fall in the same fanout buckets
+            for sha1 in self.objects:
+                for last in ('00', 'ff'):
+                    missing = sha1[:38] + last
+                    if missing not in self.objects:
+                        self.assertFalse(
+                            index.has(binascii.unhexlify(missing)), missing)
+
+            self.assertFalse(index.has('\0' * 20))
+            self.assertFalse(index.has('\377' * 20))
+        finally:
+            index.close()
+
+    def test_has_object(self):
+        store = ObjectStore(self.gitdir)
+        try:
+            for sha1 in self.objects:
+                self.assertTrue(store.has_object(sha1), sha1)
+
+            self.assertIsNone(store.has_object('0' * 40))
+            self.assertIsNone(store.has_object('0' * 39))
+        finally:
+            store.close()
+
+    def test_project_close(self):
+        project = GitProject('project', worktree=self.worktree)
+        store = project.get_object_store()
+        self.assertTrue(project.rev_existed(self.objects[0]))
+
+        project.close()
+        self.assertIsNot(project.get_object_store(), store)
+        project.close()
+
+    def test_sha256(self):
+        worktree = os.path.join(self.tmpdir, 'sha256')
+        git('init', '-q', '--object-format=sha256', worktree)
+        commit(worktree, 'sha256')
+        git('-C', worktree, 'repack', '-q', '-a', '-d')
+        git('-C', worktree, 'pack-refs', '--all')
+
+        objects = [line.split()[0] for line in output(
+            '-C', worktree, 'rev-list', '--objects', '--all').splitlines()]
+        head = output('-C', worktree, 'rev-parse', 'HEAD').strip()
+        self.assertEqual(len(head), 64)
+
+        store = ObjectStore(os.path.join(worktree, '.git'))
+        try:
+            for sha in objects:
+                self.assertTrue(store.has_object(sha), sha)
+
+            self.assertIsNone(store.has_object(head[:-1] + (
+                '0' if head[-1] != '0' else '1')))
+            self.assertIsNone(store.has_object(self.objects[0]))
+            self.assertEqual(store.read_ref('HEAD'), head)
+        finally:
+            store.close()
+
+        # the names of the other format are left to git
+        project = GitProject('project', worktree=self.worktree)
+        self.assertIsNone(project.get_object_store().has_object(head))
+        self.assertFalse(project.rev_existed(head))
+        project.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
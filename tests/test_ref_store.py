@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import RefStore  # noqa: E402
+
+
+class RefStoreTest(unittest.TestCase):
+    REFS = {
+        'refs/heads/master': '1' * 40,
+        'refs/heads/stable': '2' * 40,
+        'refs/tags/v1': '3' * 40,
+        'refs/tags/v1^{}': '1' * 40}
+
+    def test_mapping(self):
+        store = RefStore(RefStoreTest.REFS)
+
+        self.assertEqual(len(store), 4)
+        self.assertEqual(list(store), sorted(RefStoreTest.REFS))
+        self.assertEqual(dict(store.items()), RefStoreTest.REFS)
+        self.assertEqual(store['refs/tags/v1'], '3' * 40)
+        self.assertEqual(store.get('refs/heads/unknown', ''), '')
+        self.assertTrue('refs/heads/stable' in store)
+        self.assertFalse('refs/heads' in store)
+        self.assertRaises(KeyError, lambda: store['refs/heads/unknown'])
+        self.assertEqual(store.prefixed('refs/tags/'), [
+            ('refs/tags/v1', '3' * 40), ('refs/tags/v1^{}', '1' * 40)])
+
+        self.assertEqual(len(RefStore()), 0)
+        self.assertEqual(len(RefStore({'HEAD': 'a' * 64})), 1)
+        self.assertRaises(ValueError, RefStore, {
+            'refs/heads/master': '1' * 40, 'refs/heads/next': '2' * 64})
+
+    def test_diff(self):
+        store = RefStore(RefStoreTest.REFS)
+        other = dict(RefStoreTest.REFS)
+        del other['refs/heads/stable']
+        other['refs/tags/v1'] = '4' * 40
+        other['refs/tags/v2'] = '5' * 40
+
+        self.assertEqual(store.diff(other), (
+            ['refs/heads/stable'], ['refs/tags/v1']))
+        self.assertEqual(store.diff(RefStore(RefStoreTest.REFS)),
+                         (list(), list()))
+        self.assertEqual(RefStore().diff(other), (list(), list()))
+
+        # the names of the different hash algorithms never match
+        self.assertEqual(
+            RefStore({'refs/heads/master': '1' * 40}).diff(
+                {'refs/heads/master': '1' * 64}),
+            (list(), ['refs/heads/master']))
+
+
+if __name__ == '__main__':
+    unittest.main()
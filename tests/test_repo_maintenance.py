@@ -0,0 +1,59 @@
+import glob
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from krep_subcmds import all_commands  # noqa: E402
+from options import OptionParser  # noqa: E402
+from topics import GitProject  # noqa: E402
+from helpers import GitTestCase, git, make_repo  # noqa: E402
+
+
+class RepoMaintenanceTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = make_repo(os.path.join(self.tmpdir, 'project'), 3)
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        git('init', '-q', '--bare', os.path.join(self.remote, 'project'))
+
+    def test_maintenance_sequential(self):
+        # not to change the instance shared by the other tests
+        cmd = type(all_commands['repo'])()
+        cmd.NAME = cmd.COMMAND = 'repo'
+        options, _ = cmd.get_option_parser(OptionParser()).parse_args([
+            '--remote', 'file://%s' % self.remote, '--offsite',
+            '--branches', '--maintenance', '--maintenance-jobs', '1'])
+        self.assertFalse(options.job)
+
+        project = GitProject(
+            'project', worktree=self.worktree,
+            remote='file://%s/project' % self.remote, revision='master')
+        cmd.fetch_projects_in_manifest = lambda _: [project]
+
+        gitdir = os.path.join(self.worktree, '.git')
+        maintained = list()
+
+        def _push(project, options, remote):
+            maintained.append(os.path.exists(os.path.join(
+                gitdir, 'objects', 'info', 'commit-graph')))
+            return push(project, options, remote)
+
+        push, cmd.push = cmd.push, _push
+
+        environ = dict(os.environ)
+        cmd.execute(options)
+        self.assertEqual(dict(os.environ), environ)
+        # the project is maintained before the push
+        self.assertEqual(maintained, [True])
+        self.assertTrue(glob.glob(os.path.join(
+            gitdir, 'objects', 'pack', 'pack-*.bitmap')))
+        self.assertTrue(os.path.exists(os.path.join(
+            gitdir, 'objects', 'info', 'commit-graph')))
+        self.assertFalse(glob.glob(os.path.join(gitdir, 'objects', '??')))
+
+
+if __name__ == '__main__':
+    unittest.main()
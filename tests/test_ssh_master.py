@@ -0,0 +1,98 @@
+import os
+import pipes
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import SshMaster  # noqa: E402
+from topics.git_cmd import GitCommand  # noqa: E402
+
+
+class SshMasterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='krep-test-')
+
+    def tearDown(self):
+        SshMaster.cleanup()
+        # pylint: disable=W0212
+        SshMaster._sessions = SshMaster.SESSIONS
+        SshMaster._semaphores = dict()
+        # pylint: enable=W0212
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_hosts(self):
+        self.assertEqual(SshMaster.hosts([
+            'push', 'ssh://review.example.com:29418/platform/build',
+            'git+ssh://git.example.com/project', 'git@example.org:project',
+            'refs/heads/master:refs/heads/master', 'https://example.com/p',
+            '/path/to/project']), [
+                'example.org:22', 'git.example.com:22',
+                'review.example.com:29418'])
+
+    def test_disabled(self):
+        self.assertFalse(SshMaster.enabled())
+        self.assertEqual(SshMaster.ssh_options(), list())
+        self.assertEqual(SshMaster.ssh_command(), 'ssh')
+
+    def test_ssh_command(self):
+        SshMaster.enable()
+        self.assertTrue(SshMaster.enabled())
+
+        dirname = SshMaster._dirname  # pylint: disable=W0212
+        self.assertTrue(os.path.isdir(dirname))
+        self.assertEqual(
+            SshMaster.ssh_command("'/opt/my ssh'"),
+            "'/opt/my ssh' -o ControlMaster=auto -o %s -o "
+            "ControlPersist=%d" % (
+                pipes.quote('ControlPath=%s/%%C' % dirname),
+                SshMaster.PERSIST))
+
+        SshMaster.cleanup()
+        self.assertFalse(SshMaster.enabled())
+        self.assertFalse(os.path.exists(dirname))
+
+    def test_git_ssh_command(self):
+        SshMaster.enable()
+
+        cmd = GitCommand(worktree=self.tmpdir)
+        cmd.set_env({'GIT_SSH': '/opt/my ssh'})
+        ret, output = cmd.raw_command_with_output(
+            'krep-env', configs=['alias.krep-env=!printenv GIT_SSH_COMMAND'],
+            notdir=True)
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(output.strip(), SshMaster.ssh_command(
+            "'/opt/my ssh'"))
+
+    def test_sessions(self):
+        SshMaster.enable(sessions=2)
+
+        lock = threading.Lock()
+        counts = [0, 0]
+
+        def _session():
+            with SshMaster.sessions(['example.com:22']):
+                with lock:
+                    counts[0] += 1
+                    counts[1] = max(counts)
+
+                time.sleep(0.1)
+                with lock:
+                    counts[0] -= 1
+
+        threads = [threading.Thread(target=_session) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counts, [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
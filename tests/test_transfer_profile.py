@@ -0,0 +1,117 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from options import Values  # noqa: E402
+from topics import GitProject, ProcessingError, TransferProfile  # noqa: E402
+from helpers import GitTestCase, git  # noqa: E402
+
+
+class TransferProfileTest(GitTestCase):
+    PROFILES = """\
+[profile "huge"]
+min-size = 2048
+config = pack.threads=8
+config = core.compression=1
+
+[profile "small"]
+max-size = 64
+config = pack.depth=10
+
+[profile "prebuilts"]
+pattern = ^platform/prebuilts/
+config = pack.window=0
+"""
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.filename = os.path.join(self.tmpdir, 'profiles')
+        with open(self.filename, 'w') as fp:
+            fp.write(TransferProfileTest.PROFILES)
+
+        self.worktree = os.path.join(self.tmpdir, 'project')
+        git('init', '-q', self.worktree)
+
+    def _project(self, name):
+        return GitProject(
+            name, worktree=self.worktree,
+            gitdir=os.path.join(self.worktree, '.git'))
+
+    def test_load(self):
+        profiles = TransferProfile.load(self.filename)
+        self.assertTrue(TransferProfile.load(self.filename) is profiles)
+
+        profiles = dict([(str(profile), profile) for profile in profiles])
+        self.assertEqual(sorted(profiles), ['huge', 'prebuilts', 'small'])
+        self.assertEqual(profiles['huge'].configs,
+                         ['pack.threads=8', 'core.compression=1'])
+        self.assertEqual(profiles['huge'].min_size, 2048)
+        self.assertEqual(profiles['small'].max_size, 64)
+
+    def test_select(self):
+        profiles = TransferProfile.load(self.filename)
+
+        def _select(name, pname=None):
+            profile = TransferProfile.select(
+                profiles, self._project(name), pname)
+            return profile and str(profile)
+
+        self.assertEqual(_select('platform/prebuilts/gcc'), 'prebuilts')
+        # the empty repository falls in the smallest size
+        self.assertEqual(_select('platform/build'), 'small')
+        self.assertEqual(_select('platform/build', 'huge'), 'huge')
+        self.assertRaises(
+            ProcessingError, _select, 'platform/build', 'unknown')
+
+        # the size is unknown before the project is cloned
+        project = GitProject(
+            'platform/build', worktree=os.path.join(self.tmpdir, 'new'),
+            gitdir=os.path.join(self.tmpdir, 'new', '.git'))
+        self.assertIsNone(TransferProfile.select(profiles, project))
+
+    def test_select_in_order(self):
+        filename = os.path.join(self.tmpdir, 'overlapped')
+        with open(filename, 'w') as fp:
+            fp.write('[profile "platform"]\npattern = ^platform/\n'
+                     'config = pack.depth=50\n\n'
+                     '[profile "gcc"]\npattern = /gcc$\n'
+                     'config = pack.window=0\n')
+
+        # the first matched profile in the file wins
+        profiles = TransferProfile.load(filename)
+        self.assertEqual([str(profile) for profile in profiles],
+                         ['platform', 'gcc'])
+        self.assertEqual(str(TransferProfile.select(
+            profiles, self._project('platform/prebuilts/gcc'))), 'platform')
+        self.assertEqual(str(TransferProfile.select(
+            profiles, self._project('toolchain/gcc'))), 'gcc')
+
+        # the project name is matched instead of the url of git-p
+        project = self._project('https://example.com/platform/build')
+        self.assertIsNone(TransferProfile.select(profiles, project))
+        self.assertEqual(str(TransferProfile.select(
+            profiles, project, project_name='platform/build')), 'platform')
+
+    def test_apply(self):
+        project = self._project('platform/prebuilts/gcc')
+        options = Values()
+        options.transfer_profiles = self.filename
+        options.transfer_profile = None
+
+        self.assertEqual(str(TransferProfile.apply(options, project)),
+                         'prebuilts')
+        self.assertEqual(project.transfer_configs, ['pack.window=0'])
+
+    def test_invalid_config(self):
+        filename = os.path.join(self.tmpdir, 'invalid')
+        with open(filename, 'w') as fp:
+            fp.write('[profile "invalid"]\nconfig = pack.threads\n')
+
+        self.assertRaises(ProcessingError, TransferProfile.load, filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from krep_subcmds import all_commands  # noqa: E402
+from options import OptionParser  # noqa: E402
+from topics import GitProject, Pattern, ProcessingError  # noqa: E402
+from helpers import GitTestCase, commit, git, make_repo, output  # noqa: E402
+
+
+def _rev(gitdir, rev):
+    return output('-C', gitdir, 'rev-parse', rev).strip()
+
+
+class VerifyTest(GitTestCase):
+    def setUp(self):
+        GitTestCase.setUp(self)
+
+        self.worktree = make_repo(os.path.join(self.tmpdir, 'work'))
+        git('-C', self.worktree, 'tag', 'v1')
+        git('-C', self.worktree, 'checkout', '-q', '-b', 'side')
+        commit(self.worktree, 's1')
+        git('-C', self.worktree, 'checkout', '-q', 'master')
+        commit(self.worktree, 'c2')
+        commit(self.worktree, 'c3')
+
+        self.local = os.path.join(self.tmpdir, 'local.git')
+        self.upstream = os.path.join(self.tmpdir, 'upstream.git')
+        self.remote = os.path.join(self.tmpdir, 'remote')
+        self.output = os.path.join(self.tmpdir, 'report.json')
+
+    def _mirror(self, path):
+        git('clone', '-q', '--mirror', self.worktree, path)
+
+    def _push(self, *refspecs):
+        path = os.path.join(self.remote, 'project')
+        if not os.path.exists(path):
+            git('init', '-q', '--bare', path)
+
+        git('-C', self.worktree, 'push', '-q', path, *refspecs)
+
+    def _verify(self, *args):
+        # not to change the instance shared by the other tests
+        cmd = type(all_commands['verify'])()
+        cmd.NAME = cmd.COMMAND = 'verify'
+        options, _ = cmd.get_option_parser(OptionParser()).parse_args([
+            '--remote', self.remote, '--format', 'json',
+            '--output', self.output] + list(args))
+
+        project = GitProject(
+            'project', worktree=self.local, gitdir=self.local, bare=True,
+            pattern=Pattern(options.pattern))
+        cmd.fetch_projects_in_manifest = lambda _: [(project, self.upstream)]
+
+        try:
+            cmd.execute(options)
+            status = 0
+        except ProcessingError:
+            status = 1
+
+        with open(self.output) as fp:
+            report = json.load(fp)
+
+        return status, report['projects'][0]
+
+    def test_matched(self):
+        self._mirror(self.local)
+        self._mirror(self.upstream)
+        self._push('refs/heads/*:refs/heads/*', 'refs/tags/*:refs/tags/*')
+
+        status, report = self._verify()
+        self.assertEqual(status, 0)
+        self.assertEqual(report['references'], 3)
+        self.assertFalse(report['errors'])
+        for state in ('missing', 'stale', 'diverged'):
+            self.assertEqual(report[state], list())
+
+    def test_mapped(self):
+        git('-C', self.worktree, 'branch', 'feature/x', 'side')
+        git('-C', self.worktree, 'tag', 'rel/v2', 'side')
+        self._mirror(self.local)
+        self._mirror(self.upstream)
+
+        # pushed with the base names, the renamed head and without v1
+        self._push('refs/heads/master:refs/heads/master',
+                   'refs/heads/feature/x:refs/heads/x',
+                   'refs/heads/side:refs/heads/renamed',
+                   'refs/tags/rel/v2:refs/tags/v2')
+
+        status, report = self._verify(
+            '--pattern', 'rev:~^side$~renamed~', '--pattern', 'tag:!^v1$')
+        self.assertEqual(status, 0)
+        self.assertEqual(report['references'], 4)
+        for state in ('missing', 'stale', 'diverged'):
+            self.assertEqual(report[state], list())
+
+        # the full names are verified with --keep-name
+        status, report = self._verify(
+            '--keep-name', '--pattern', 'rev:~^side$~renamed~',
+            '--pattern', 'tag:!^v1$')
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted([item['ref'] for item in report['missing']]), [
+            'refs/heads/feature/x', 'refs/tags/rel/v2'])
+
+    def test_mismatched(self):
+        c2 = _rev(self.worktree, 'HEAD~')
+        c3 = _rev(self.worktree, 'HEAD')
+
+        self._mirror(self.local)
+        # stale with the upstream object existed and diverged locally
+        git('-C', self.local, 'update-ref', 'refs/heads/master', c2)
+        git('-C', self.local, 'update-ref', 'refs/heads/side', c3)
+
+        # a new branch whose object is absent locally
+        git('-C', self.worktree, 'checkout', '-q', '-b', 'later')
+        commit(self.worktree, 'c4')
+        git('-C', self.worktree, 'checkout', '-q', 'master')
+        self._mirror(self.upstream)
+
+        self._push('%s:refs/heads/master' % c2, '%s:refs/heads/later' % c3,
+                   '%s:refs/heads/side' % c3)
+
+        status, report = self._verify()
+        self.assertEqual(status, 1)
+        self.assertFalse(report['errors'])
+
+        def _refs(state):
+            return sorted([(item['side'], item['ref'])
+                           for item in report[state]])
+
+        self.assertEqual(_refs('missing'), [
+            ('local', 'refs/heads/later'), ('remote', 'refs/tags/v1')])
+        self.assertEqual(_refs('stale'), [
+            ('local', 'refs/heads/master'), ('remote', 'refs/heads/later'),
+            ('remote', 'refs/heads/master')])
+        self.assertEqual(_refs('diverged'), [
+            ('local', 'refs/heads/side'), ('remote', 'refs/heads/side')])
+
+
+if __name__ == '__main__':
+    unittest.main()
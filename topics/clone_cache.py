@@ -0,0 +1,229 @@
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import urlparse
+
+from contextlib import contextmanager
+
+from error import ProcessingError
+from git_cmd import GitCommand
+from logger import Logger
+
+
+def _parse_size(size):
+    if size is None or isinstance(size, (int, long)):
+        return size
+
+    mo = re.match(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', str(size).lower())
+    if not mo:
+        raise ProcessingError('unknown cache size "%s"' % size)
+
+    return int(mo.group(1)) * 1024 ** ' kmgt'.index(mo.group(2) or ' ')
+
+
+class CloneCache(object):
+    """\
+Keeps the bare mirrors of the upstreams to clone the projects locally.
+
+The mirrors are keyed by the normalized upstream url. A new clone updates the
+mirror first and then clones from it, which hardlinks the objects, and
+restores the upstream as the url of the origin. A partial clone is made from
+the mirror over file:// instead, as git only filters the objects with a
+transport. The least recently used mirrors are evicted once the total size
+exceeds the limitation, which is summed up with the sizes recorded in the
+stamps of the mirrors instead of walking the cache.
+
+The cache could be set globally in ~/.krepconfig, like:
+
+  clone-cache = /var/cache/krep
+  clone-cache-size = 50G
+"""
+
+    STAMP = 'krep-cache.stamp'
+
+    _lock = threading.Lock()
+    _locks = dict()
+
+    def __init__(self, dirname, size=None):
+        self.dirname = os.path.realpath(os.path.expanduser(dirname))
+        self.size = _parse_size(size)
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--clone-cache') or \
+            optparse.add_option_group('Clone cache options')
+        options.add_option(
+            '--clone-cache',
+            dest='clone_cache', action='store', metavar='DIR',
+            help='Set the directory of the mirrors to clone the new '
+                 'projects locally')
+        options.add_option(
+            '--clone-cache-size',
+            dest='clone_cache_size', action='store', metavar='SIZE',
+            help='Set the maximum total size of the clone cache like "50G". '
+                 'The least recently used mirrors are evicted to fit it')
+
+    @staticmethod
+    def normalize(url):
+        """Returns the url without the user, the port of the default
+        protocols, the trailing slashes and the suffix ".git"."""
+        ulp = urlparse.urlparse(url)
+        path = ulp.path.rstrip('/')
+        if path.endswith('.git'):
+            path = path[:-4]
+
+        if not ulp.scheme:
+            return os.path.realpath(path)
+
+        netloc = (ulp.hostname or '').lower()
+        if ulp.port and (ulp.scheme, ulp.port) not in (
+                ('http', 80), ('https', 443), ('ssh', 22), ('git', 9418)):
+            netloc = '%s:%d' % (netloc, ulp.port)
+
+        return '%s://%s%s' % (ulp.scheme.lower(), netloc, path)
+
+    def _entry(self, url):
+        return os.path.join(
+            self.dirname,
+            '%s.git' % hashlib.sha1(CloneCache.normalize(url)).hexdigest())
+
+    def _thread_lock(self, entry):
+        with CloneCache._lock:
+            return CloneCache._locks.setdefault(entry, threading.Lock())
+
+    @contextmanager
+    def _locked(self, entry, blocking=True):
+        lock = self._thread_lock(entry)
+        if not lock.acquire(blocking):
+            yield False
+            return
+
+        try:
+            # the lock file is beside the mirror not to be evicted with it
+            with open('%s.lock' % entry, 'a') as fp:
+                try:
+                    fcntl.flock(
+                        fp, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except IOError:
+                    yield False
+                    return
+
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+        finally:
+            lock.release()
+
+    def _update(self, entry, url):
+        if os.path.exists(os.path.join(entry, 'HEAD')):
+            return GitCommand(entry, entry).fetch(
+                'origin', '--prune', '--tags', '+refs/heads/*:refs/heads/*')
+
+        tmpname = '%s.tmp' % entry
+        if os.path.exists(tmpname):
+            shutil.rmtree(tmpname)
+
+        ret = GitCommand(tmpname, tmpname).clone(
+            '--bare', url, tmpname, notdir=True)
+        if ret == 0:
+            os.rename(tmpname, entry)
+
+        return ret
+
+    @staticmethod
+    def _stamp(entry, url):
+        # the size in bytes of both the loose objects and the packs
+        ret, output = GitCommand(entry, entry).count_objects('-v')
+
+        size = 0
+        for line in output.split('\n') if ret == 0 else list():
+            name, _, value = line.partition(':')
+            if name.strip() in ('size', 'size-pack'):
+                size += int(value.strip() or 0) * 1024
+
+        with open(os.path.join(entry, CloneCache.STAMP), 'w') as fp:
+            fp.write('%s\n%d\n' % (url, size))
+
+    @staticmethod
+    def _stamp_size(stamp):
+        with open(stamp) as fp:
+            lines = fp.read().split('\n')
+
+        try:
+            return int(lines[1])
+        except (IndexError, ValueError):
+            # unknown until the mirror is updated again
+            return 0
+
+    def download(self, project, url, **kws):
+        """Clones the project from the mirror of the url in the cache."""
+        logger = Logger.get_logger()
+
+        if not os.path.exists(self.dirname):
+            os.makedirs(self.dirname)
+
+        entry = self._entry(url)
+        with self._locked(entry):
+            ret = self._update(entry, url)
+            if ret != 0:
+                logger.error('%s: failed to update the cache of %s',
+                             project, url)
+                return ret
+
+            self._stamp(entry, url)
+
+            source = entry
+            if kws.get('filter_spec'):
+                # the filter is ignored with the local path, and upload-pack
+                # of the mirror need be allowed to filter the objects
+                ret, _ = GitCommand(entry, entry).config(
+                    'uploadpack.allowFilter', 'true')
+                if ret != 0:
+                    return ret
+
+                source = 'file://%s' % entry
+
+            ret = project.download(source, **kws)
+            if ret == 0:
+                ret, _ = project.config('remote.origin.url', url)
+
+        if ret == 0:
+            self.evict()
+
+        return ret
+
+    def evict(self):
+        """Removes the least recently used mirrors beyond the size."""
+        if not self.size or not os.path.isdir(self.dirname):
+            return
+
+        logger = Logger.get_logger()
+
+        entries, total = list(), 0
+        for name in os.listdir(self.dirname):
+            entry = os.path.join(self.dirname, name)
+            stamp = os.path.join(entry, CloneCache.STAMP)
+            if not name.endswith('.git') or not os.path.exists(stamp):
+                continue
+
+            size = CloneCache._stamp_size(stamp)
+            total += size
+            entries.append((os.path.getmtime(stamp), entry, size))
+
+        for _, entry, size in sorted(entries):
+            if total <= self.size:
+                break
+
+            # the mirrors in use are skipped
+            with self._locked(entry, blocking=False) as locked:
+                if locked:
+                    logger.info('evict %s from the clone cache', entry)
+                    shutil.rmtree(entry)
+                    total -= size
+
+
+TOPIC_ENTRY = 'CloneCache'
@@ -1,7 +1,12 @@
 
+import collections
 import os
 import subprocess
+import sys
+import threading
+import time
 
+from command_executor import PendingCommand
 from error import KrepError
 from logger import Logger
 
@@ -10,14 +15,157 @@ class CommandNotDetectedError(KrepError):
     """Indicate the sub-command of a command cannot be found."""
 
 
+class _Watchdog(object):
+    """Terminates the command running over the time or without any output
+    for a while."""
+
+    # seconds to check the command and to wait after terminating it
+    INTERVAL = 1
+    GRACE = 5
+
+    def __init__(self, proc, timeout=None, stall=None):
+        self.proc = proc
+        self.timeout = timeout
+        self.stall = stall
+        self.started = self.active = time.time()
+        self.reason = None
+
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def touch(self):
+        self.active = time.time()
+
+    def _watch(self):
+        while not self.event.wait(_Watchdog.INTERVAL):
+            now = time.time()
+            if self.timeout and now - self.started > self.timeout:
+                self.reason = 'timed out after %ds' % self.timeout
+            elif self.stall and now - self.active > self.stall:
+                self.reason = 'stalled without output for %ds' % self.stall
+            else:
+                continue
+
+            try:
+                self.proc.terminate()
+                if not self.event.wait(_Watchdog.GRACE) and \
+                        self.proc.poll() is None:
+                    self.proc.kill()
+            except OSError:
+                pass
+
+            return
+
+    def stop(self):
+        self.event.set()
+        self.thread.join()
+
+        if self.reason:
+            Logger.get_logger().error('exec: %s', self.reason)
+
+        return self.reason
+
+
+class _OutputStream(object):
+    """Yields the lines of the standard output of a running command.
+
+    The standard error is kept in a ring buffer of the last lines. The result
+    is set once all lines are read or the stream is closed."""
+    def __init__(self, proc, context=None, limit=None, error_lines=None,
+                 watchdog=None):
+        self.proc = proc
+        self.context = context
+        self.watchdog = watchdog
+        self.limit = limit or Command.MAX_LINE
+        self.errors = collections.deque(
+            maxlen=error_lines or Command.ERROR_LINES)
+        self.returncode = None
+        # set if the command is terminated by the watchdog
+        self.reason = None
+
+        self.thread = None
+        if proc.stderr is not None:
+            # drained aside not to block the command on the full pipe
+            self.thread = threading.Thread(target=self._drain)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _drain(self):
+        for line in iter(self.proc.stderr.readline, ''):
+            if self.watchdog is not None:
+                self.watchdog.touch()
+
+            self.errors.append(line.rstrip('\n'))
+
+    def __iter__(self):
+        completed = False
+        try:
+            while True:
+                # the longer line is split not to be buffered entirely
+                line = self.proc.stdout.readline(self.limit)
+                if not line:
+                    completed = True
+                    break
+
+                if self.watchdog is not None:
+                    self.watchdog.touch()
+
+                yield line[:-1] if line.endswith('\n') else line
+        finally:
+            self.close(completed)
+
+    def get_error(self):
+        return '\n'.join(self.errors).strip()
+
+    def close(self, completed=False):
+        if self.returncode is not None:
+            return self.returncode
+
+        if not completed and self.proc.poll() is None:
+            self.proc.terminate()
+
+        self.proc.stdout.close()
+        self.returncode = self.proc.wait()
+        if self.thread is not None:
+            self.thread.join()
+
+        if self.watchdog is not None:
+            self.reason = self.watchdog.stop()
+
+        if self.context is not None:
+            self.context.__exit__(None, None, None)
+
+        error = self.get_error()
+        if error:
+            logger = Logger.get_logger()
+            if self.returncode:
+                logger.error('exec: %s', error)
+            else:
+                logger.info('stderr: %s', error)
+
+        return self.returncode
+
+
 class Command(object):  # pylint: disable=R0902
     """Executes a local executable command."""
+    # bytes buffered for the streamed output and the longest line
+    BUFSIZE = 65536
+    # bytes kept of the tail of the forwarded standard error
+    ERROR_SIZE = 65536
+    MAX_LINE = 1024 * 1024
+    # lines of the standard error kept for the streamed output
+    ERROR_LINES = 100
+
     def __init__(self, cwd=None, provide_stdin=False,  # pylint: disable=R0913
                  capture_stdout=False, capture_stderr=True,
                  environ=None, tryrun=False, *args, **kws):
         self.cwd = cwd
         self.stdout = ''
         self.stderr = ''
+        # set if the command is terminated by the watchdog
+        self.reason = None
         self.env = os.environ.copy()
         if environ:
             self.env.update(environ)
@@ -65,6 +213,20 @@ class Command(object):  # pylint: disable=R0902
     def set_env(self, environ):
         self.env.update(environ)
 
+    @staticmethod
+    def _log_command(cli, cwd, tryrun=False, provide_stdin=False,
+                     capture_stdout=False, capture_stderr=False):
+        dbg = '(%s) ' % cwd
+        dbg += '[-] ' if tryrun else ''
+        if provide_stdin:
+            dbg += '0<| '
+        if capture_stdout:
+            dbg += '1>| '
+        if capture_stderr:
+            dbg += '2>| '
+
+        Logger.get_logger().info('%s%s', dbg, ' '.join(cli))
+
     def wait(self, **kws):
         if not kws and self.kws:
             kws = self.kws
@@ -78,34 +240,50 @@ class Command(object):  # pylint: disable=R0902
         tryrun = kws.get('tryrun', self.tryrun)
         # the config for the std device may be duplicated
         provide_stdin = kws.get('provide_stdin', self.provide_stdin)
+        stdin = kws.get('stdin')
+        if stdin is not None:
+            provide_stdin = True
         capture_stdout = kws.get('capture_stdout', self.capture_stdout)
         capture_stderr = kws.get('capture_stderr', self.capture_stderr)
 
         logger = Logger.get_logger()
-        dbg = '(%s) ' % cwd
-        dbg += '[-] ' if tryrun else ''
-        if provide_stdin:
-            dbg += '0<| '
-        if capture_stdout:
-            dbg += '1>| '
-        if capture_stderr:
-            dbg += '2>| '
-
-        logger.info('%s%s', dbg, ' '.join(cli))
+        Command._log_command(cli, cwd, tryrun, provide_stdin, capture_stdout,
+                             capture_stderr)
 
         # invoke 'true' instead if tryrun set
         if tryrun:
             cli = ['true']
 
+        timeout = kws.get('timeout')
+        stall = kws.get('stall_timeout')
+        # the tail of the forwarded standard error is kept for the retries
+        keep_error = kws.get('keep_error') and not capture_stderr
+        # the output is watched for the stall and forwarded if not captured
         proc = subprocess.Popen(
             cli, cwd=cwd,
-            env=self.env,
+            env=kws.get('env') or self.env,
             stdin=subprocess.PIPE if provide_stdin else None,
-            stdout=subprocess.PIPE if capture_stdout else None,
-            stderr=subprocess.PIPE if capture_stderr else None)
+            stdout=subprocess.PIPE if capture_stdout or stall else None,
+            stderr=subprocess.PIPE if capture_stderr or stall or keep_error
+            else None)
 
-        self.stdout, self.stderr = proc.communicate()
-        if self.stderr:
+        self.reason = None
+        if timeout or stall or keep_error:
+            watchdog = None
+            if timeout or stall:
+                watchdog = _Watchdog(proc, timeout, stall)
+
+            self.stdout, self.stderr = self._communicate(
+                proc, stdin, watchdog,
+                None if capture_stdout else sys.stdout,
+                None if capture_stderr else sys.stderr)
+            if watchdog is not None:
+                self.reason = watchdog.reason
+        else:
+            self.stdout, self.stderr = proc.communicate(stdin)
+
+        # the forwarded standard error has been shown already
+        if self.stderr and capture_stderr:
             if proc.returncode:
                 logger.error('exec: %s', self.get_error())
             else:
@@ -113,6 +291,145 @@ class Command(object):  # pylint: disable=R0902
 
         return proc.returncode
 
+    @staticmethod
+    def _communicate(proc, stdin, watchdog=None, stdout=None, stderr=None):
+        """Reads the outputs like communicate() and feeds the watchdog. The
+        output is written to the file instead of captured if set, and only
+        the tail of the forwarded standard error is returned."""
+        outputs = dict()
+
+        def _read(pipe, forward, chunks, bound):
+            size = 0
+            for data in iter(lambda: os.read(pipe.fileno(), 4096), ''):
+                if watchdog is not None:
+                    watchdog.touch()
+                if forward is not None:
+                    forward.write(data)
+                    forward.flush()
+                if chunks is not None:
+                    chunks.append(data)
+                    size += len(data)
+                    while bound and len(chunks) > 1 and \
+                            size - len(chunks[0]) >= bound:
+                        size -= len(chunks.pop(0))
+
+            pipe.close()
+
+        readers = list()
+        for name, forward in (('stdout', stdout), ('stderr', stderr)):
+            pipe = getattr(proc, name)
+            if pipe is not None:
+                bound = None
+                if forward is None:
+                    outputs[name] = list()
+                elif name == 'stderr':
+                    outputs[name] = list()
+                    bound = Command.ERROR_SIZE
+
+                reader = threading.Thread(
+                    target=_read,
+                    args=(pipe, forward, outputs.get(name), bound))
+                reader.daemon = True
+                readers.append(reader)
+                reader.start()
+
+        if proc.stdin is not None:
+            try:
+                if stdin:
+                    proc.stdin.write(stdin)
+                proc.stdin.close()
+            except IOError:
+                pass
+
+        proc.wait()
+        # the pipes might be held by the children of a terminated command
+        deadline = time.time() + _Watchdog.GRACE \
+            if watchdog is not None and watchdog.stop() else None
+        for reader in readers:
+            reader.join(max(deadline - time.time(), 0) if deadline else None)
+
+        # the partial outputs are returned if the readers are still blocked
+        return tuple([''.join(outputs[name]) if name in outputs else None
+                      for name in ('stdout', 'stderr')])
+
+    def stream(self, context=None, **kws):
+        """Starts the command and returns the iterable lines of its standard
+        output, which are read as they arrive with the bounded memory.
+
+        The context is entered before the command starts and exited once
+        the output is consumed."""
+        cli = [str(a) for a in self.args]
+
+        cwd = kws.get('cwd', self.cwd or os.getcwd())
+        if not os.path.exists(cwd):
+            cwd = os.getcwd()
+        tryrun = kws.get('tryrun', self.tryrun)
+        capture_stderr = kws.get('capture_stderr', self.capture_stderr)
+
+        Command._log_command(cli, cwd, tryrun, capture_stdout=True,
+                             capture_stderr=capture_stderr)
+
+        if tryrun:
+            cli = ['true']
+
+        if context is not None:
+            context.__enter__()
+
+        try:
+            proc = subprocess.Popen(
+                cli, cwd=cwd,
+                env=kws.get('env') or self.env,
+                bufsize=Command.BUFSIZE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE if capture_stderr else None)
+        except:
+            if context is not None:
+                context.__exit__(None, None, None)
+            raise
+
+        watchdog = None
+        if kws.get('timeout') or kws.get('stall_timeout'):
+            watchdog = _Watchdog(
+                proc, kws.get('timeout'), kws.get('stall_timeout'))
+
+        return _OutputStream(proc, context, watchdog=watchdog)
+
+    def submit(self, executor, context=None, policy=None, **kws):
+        """Submits the command to the executor and returns the pending
+        command, which holds the exit code and the output once completed.
+        The standard input is written from "stdin" if set.
+
+        The context is entered before the command is queued and exited once
+        it completes. The failed command is retried with the policy."""
+        cli = [str(a) for a in self.args]
+
+        cwd = kws.get('cwd', self.cwd or os.getcwd())
+        if not os.path.exists(cwd):
+            cwd = os.getcwd()
+        tryrun = kws.get('tryrun', self.tryrun)
+        timeout = kws.get('timeout')
+        stall = kws.get('stall_timeout')
+        # the output is watched for the stall
+        capture_stdout = kws.get('capture_stdout', self.capture_stdout) or \
+            bool(stall)
+        capture_stderr = kws.get('capture_stderr', self.capture_stderr) or \
+            bool(stall) or bool(kws.get('keep_error'))
+
+        Command._log_command(cli, cwd, tryrun, capture_stdout=capture_stdout,
+                             capture_stderr=capture_stderr)
+
+        if tryrun:
+            cli = ['true']
+
+        if context is not None:
+            context.__enter__()
+
+        return executor.submit(PendingCommand(
+            cli, cwd, dict(kws.get('env') or self.env),
+            capture_stdout, capture_stderr,
+            context, timeout, stall, policy, kws.get('name'),
+            kws.get('stdin')))
+
     @staticmethod
     def normalize(command):
         return command.replace('_', '-')
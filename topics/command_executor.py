@@ -0,0 +1,481 @@
+import collections
+import errno
+import fcntl
+import os
+import select
+import subprocess
+import threading
+import time
+
+from logger import Logger
+
+
+class PendingCommand(object):
+    """Holds a command submitted to the executor until it completes.
+
+    The standard input is written from the payload if set, or read from
+    /dev/null. The command is terminated if it runs over the timeout or
+    writes nothing for the stall seconds, and it's retried with the policy
+    like the blocking commands."""
+    def __init__(self, cli, cwd=None, env=None, capture_stdout=True,
+                 capture_stderr=True, context=None, timeout=None,
+                 stall=None, policy=None, name=None, stdin=None):
+        self.cli = cli
+        self.cwd = cwd
+        self.env = env
+        self.stdin = stdin
+        self.capture_stdout = capture_stdout
+        self.capture_stderr = capture_stderr
+        self.context = context
+        self.timeout = timeout
+        self.stall = stall
+        self.policy = policy
+        self.name = name or ' '.join(cli[:2])
+        self.attempt = 0
+        # logged with the name of the submitting thread
+        self.logger = Logger.get_logger().name
+
+        self.proc = None
+        self.returncode = None
+        self.stdout = ''
+        self.stderr = ''
+        # the count of the output pipes not closed yet
+        self.opened = 0
+        self.started = self.active = None
+        self.reason = None
+        self.terminated = None
+
+        self.callbacks = list()
+        self.event = threading.Event()
+
+    def add_done_callback(self, callback):
+        """Calls the callback with the command once completed."""
+        call = False
+        # the command may complete while adding the callback
+        with CommandExecutor.lock:
+            if self.callbacks is None:
+                call = True
+            else:
+                self.callbacks.append(callback)
+
+        if call:
+            callback(self)
+
+    def done(self):
+        return self.event.isSet()
+
+    def wait(self, timeout=None):
+        """Returns the exit code after the command completed."""
+        self.event.wait(timeout)
+
+        return self.returncode
+
+    def result(self):
+        """Returns the exit code and the standard output."""
+        return self.wait(), self.stdout
+
+    def get_output(self):
+        return self.stdout
+
+    def get_error(self):
+        return self.stderr.strip()
+
+    def _watch(self, now):
+        """Terminates the command over the limits, and kills it if it
+        doesn't exit in the grace seconds."""
+        if self.terminated is not None:
+            if now - self.terminated > CommandExecutor.GRACE and \
+                    self.proc.poll() is None:
+                try:
+                    self.proc.kill()
+                except OSError:
+                    pass
+
+            return
+
+        if self.timeout and now - self.started > self.timeout:
+            self.reason = 'timed out after %ds' % self.timeout
+        elif self.stall and now - self.active > self.stall:
+            self.reason = 'stalled without output for %ds' % self.stall
+        else:
+            return
+
+        self.terminated = now
+        try:
+            self.proc.terminate()
+        except OSError:
+            pass
+
+    def _retry(self, returncode):
+        """Returns the seconds to wait before retrying the failed command,
+        or None if it isn't retried."""
+        policy = self.policy
+        if returncode == 0 or policy is None or \
+                self.attempt >= policy.retries or \
+                not policy.retryable(
+                    returncode, self.get_error(), self.reason):
+            return None
+
+        self._log(returncode)
+        delay = policy.delay(self.attempt)
+        self.attempt += 1
+        Logger.get_logger(self.logger).warning(
+            '%s: exited with %d, retry %d/%d in %.1fs', self.name,
+            returncode, self.attempt, policy.retries, delay)
+
+        self.proc = None
+        self.stdout = self.stderr = ''
+        self.opened = 0
+        self.started = self.active = None
+        self.reason = self.terminated = None
+
+        return delay
+
+    def _log(self, returncode):
+        logger = Logger.get_logger(self.logger)
+        if self.reason:
+            logger.error('exec: %s', self.reason)
+
+        error = self.get_error()
+        if error:
+            if returncode:
+                logger.error('exec: %s', error)
+            else:
+                logger.info('stderr: %s', error)
+
+        return logger
+
+    def _complete(self, returncode):
+        self.returncode = returncode
+        if self.context is not None:
+            self.context.__exit__(None, None, None)
+            self.context = None
+
+        logger = self._log(returncode)
+
+        with CommandExecutor.lock:
+            callbacks, self.callbacks = self.callbacks, None
+
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception, e:  # pylint: disable=W0703
+                logger.exception(e)
+
+        # the waiters are woken up after the callbacks
+        self.event.set()
+
+
+class CommandExecutor(object):
+    """\
+Drives many commands concurrently in a single thread.
+
+The pipes of the running commands are multiplexed with poll() in one loop
+thread instead of a thread blocking on each command, and the commands over
+the limit of the jobs are queued. The loop thread starts with the first
+submitted command and exits once all commands complete. Only the tail of
+the standard error is kept like the streamed output.
+
+Only the commands with all output pipes closed are polled for the exit,
+and the timeouts are checked in the loop once per interval. The failed
+commands are queued again after the backoff of the policy, which keep
+their ssh sessions."""
+
+    # bytes read from or written to a pipe at once and kept of the standard
+    # error
+    CHUNK = 65536
+    ERROR_SIZE = 65536
+    # milliseconds to poll the commands with the closed pipes and to check
+    # the timeouts
+    REAP_INTERVAL = 50
+    WATCH_INTERVAL = 1000
+    # seconds to wait after terminating a command
+    GRACE = 5
+
+    JOBS = 64
+
+    lock = threading.Lock()
+
+    def __init__(self, jobs=None):
+        self.jobs = max(jobs or CommandExecutor.JOBS, 1)
+
+        self.queue = collections.deque()
+        # the commands to retry with the time
+        self.delayed = list()
+        self.running = set()
+        # the running commands with the timeouts and the ones with the closed
+        # output pipes to poll for the exit
+        self.watched = set()
+        self.exiting = set()
+        self.watch_time = None
+        self.thread = None
+        self.wakeup = None
+
+    def submit(self, pending):
+        """Queues the pending command to start in the loop."""
+        with CommandExecutor.lock:
+            self.queue.append(pending)
+            if self.thread is None:
+                self.wakeup = os.pipe()
+                for fd in self.wakeup:
+                    CommandExecutor._set_nonblock(fd)
+
+                self.thread = threading.Thread(target=self._loop)
+                self.thread.start()
+            else:
+                self._wakeup()
+
+        return pending
+
+    def wait(self, pendings=None):
+        """Waits for the commands, or all submitted ones, and returns the
+        count of the failed ones."""
+        if pendings is None:
+            with CommandExecutor.lock:
+                thread = self.thread
+
+            if thread is not None:
+                thread.join()
+
+            return 0
+
+        return len([pending for pending in pendings if pending.wait() != 0])
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup[1], '\0')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    @staticmethod
+    def _set_nonblock(fd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # the other commands mustn't hold the pipes not to delay the end
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    def _start(self, pending, poller, pipes):
+        try:
+            with open(os.devnull, 'r') as devnull:
+                pending.proc = subprocess.Popen(
+                    pending.cli, cwd=pending.cwd,
+                    env=pending.env,
+                    close_fds=True,
+                    stdin=devnull if pending.stdin is None
+                    else subprocess.PIPE,
+                    stdout=subprocess.PIPE if pending.capture_stdout
+                    else None,
+                    stderr=subprocess.PIPE if pending.capture_stderr
+                    else None)
+        except OSError, e:
+            pending.stderr = str(e)
+            pending._complete(-1)  # pylint: disable=W0212
+            return
+
+        pending.started = pending.active = time.time()
+        self.running.add(pending)
+        if pending.timeout or pending.stall:
+            self.watched.add(pending)
+
+        for name in ('stdout', 'stderr'):
+            pipe = getattr(pending.proc, name)
+            if pipe is not None:
+                CommandExecutor._set_nonblock(pipe.fileno())
+                poller.register(pipe.fileno(), select.POLLIN)
+                pipes[pipe.fileno()] = (pending, name, list())
+                pending.opened += 1
+
+        if pending.opened == 0:
+            self.exiting.add(pending)
+
+        pipe = pending.proc.stdin
+        if pipe is not None:
+            if pending.stdin:
+                CommandExecutor._set_nonblock(pipe.fileno())
+                poller.register(pipe.fileno(), select.POLLOUT)
+                # the offset of the payload written
+                pipes[pipe.fileno()] = (pending, 'stdin', [0])
+            else:
+                pipe.close()
+
+    @staticmethod
+    def _write(fd, pending, written):
+        """Writes the payload to the pipe and returns False once done."""
+        offset = written[0]
+        try:
+            offset += os.write(
+                fd, buffer(pending.stdin, offset, CommandExecutor.CHUNK))
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+
+            # the command exited without reading all
+            offset = len(pending.stdin)
+
+        written[0] = offset
+        if offset < len(pending.stdin):
+            return True
+
+        pending.proc.stdin.close()
+
+        return False
+
+    @staticmethod
+    def _read(fd, pending, name, chunks):
+        """Reads the pipe and returns False once it's closed."""
+        try:
+            data = os.read(fd, CommandExecutor.CHUNK)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+
+            data = ''
+
+        if data:
+            pending.active = time.time()
+            chunks.append(data)
+            if name == 'stderr':
+                # keep the tail of the standard error in the bounded memory
+                size = sum([len(chunk) for chunk in chunks])
+                while len(chunks) > 1 and \
+                        size - len(chunks[0]) >= CommandExecutor.ERROR_SIZE:
+                    size -= len(chunks.pop(0))
+
+            return True
+
+        setattr(pending, name, ''.join(chunks))
+        getattr(pending.proc, name).close()
+
+        return False
+
+    def _close(self, poller, pipes, pending):
+        # the pipes might be held by the children of a terminated command
+        for fd, (owner, name, chunks) in pipes.items():
+            if owner is pending:
+                poller.unregister(fd)
+                del pipes[fd]
+                if name != 'stdin':
+                    setattr(pending, name, ''.join(chunks))
+
+                getattr(pending.proc, name).close()
+
+        pending.opened = 0
+        self.exiting.add(pending)
+
+    def _reap(self, poller, pipes):
+        now = time.time()
+        if self.watched and \
+                (self.watch_time is None or now >= self.watch_time):
+            self.watch_time = now + CommandExecutor.WATCH_INTERVAL / 1000.0
+            for pending in list(self.watched):
+                pending._watch(now)  # pylint: disable=W0212
+                if pending.opened and pending.terminated is not None and \
+                        now - pending.terminated > CommandExecutor.GRACE and \
+                        pending.proc.poll() is not None:
+                    self._close(poller, pipes, pending)
+
+        for pending in list(self.exiting):
+            if pending.proc.poll() is None:
+                continue
+
+            pipe = pending.proc.stdin
+            # the command exited before reading all the standard input
+            if pipe is not None and not pipe.closed:
+                if pipe.fileno() in pipes:
+                    poller.unregister(pipe.fileno())
+                    del pipes[pipe.fileno()]
+
+                pipe.close()
+
+            self.exiting.discard(pending)
+            self.watched.discard(pending)
+            self.running.discard(pending)
+            delay = pending._retry(  # pylint: disable=W0212
+                pending.proc.returncode)
+            if delay is None:
+                pending._complete(  # pylint: disable=W0212
+                    pending.proc.returncode)
+            else:
+                with CommandExecutor.lock:
+                    self.delayed.append((now + delay, pending))
+
+    def _timeout(self):
+        """Returns the milliseconds to poll, or None to wait for the pipes."""
+        timeouts = list()
+        # the exited commands are only found by polling
+        if self.exiting:
+            timeouts.append(CommandExecutor.REAP_INTERVAL)
+        if self.watched:
+            timeouts.append(max(int(
+                (self.watch_time - time.time()) * 1000), 0))
+
+        with CommandExecutor.lock:
+            if self.delayed:
+                timeouts.append(max(int(
+                    (min(self.delayed)[0] - time.time()) * 1000), 0))
+
+        return min(timeouts) if timeouts else None
+
+    def _loop(self):
+        poller = select.poll()
+        poller.register(self.wakeup[0], select.POLLIN)
+        # the opened pipes with the commands and the read chunks
+        pipes = dict()
+
+        while True:
+            with CommandExecutor.lock:
+                now = time.time()
+                for item in [item for item in self.delayed if item[0] <= now]:
+                    self.delayed.remove(item)
+                    self.queue.append(item[1])
+
+                starting = list()
+                while self.queue and \
+                        len(self.running) + len(starting) < self.jobs:
+                    starting.append(self.queue.popleft())
+
+                if not starting and not self.running and not self.delayed:
+                    for fd in self.wakeup:
+                        os.close(fd)
+
+                    self.thread, self.wakeup = None, None
+                    return
+
+            for pending in starting:
+                self._start(pending, poller, pipes)
+
+            self._reap(poller, pipes)
+            if not self.running and not self.queue and not self.delayed:
+                continue
+
+            try:
+                events = poller.poll(self._timeout())
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+
+                raise
+
+            for fd, _ in events:
+                if fd == self.wakeup[0]:
+                    try:
+                        os.read(fd, CommandExecutor.CHUNK)
+                    except OSError:
+                        pass
+                elif fd in pipes:
+                    pending, name, chunks = pipes[fd]
+                    if name == 'stdin':
+                        if not CommandExecutor._write(fd, pending, chunks):
+                            poller.unregister(fd)
+                            del pipes[fd]
+                    elif not CommandExecutor._read(fd, pending, name, chunks):
+                        poller.unregister(fd)
+                        del pipes[fd]
+                        pending.opened -= 1
+                        if pending.opened == 0:
+                            self.exiting.add(pending)
+
+
+TOPIC_ENTRY = 'CommandExecutor, PendingCommand'
@@ -0,0 +1,176 @@
+import random
+import re
+import threading
+import time
+
+from error import ProcessingError
+from logger import Logger
+
+
+class CommandPolicy(object):
+    """\
+Limits the time of the remote commands and retries the failed ones.
+
+The policy is set per kind of the commands, "fetch", "push", "ls-remote" and
+"gerrit", with the option "--command-policy" or "command-policy" in
+~/.krepconfig like:
+
+  fetch:timeout=3600,stall=300,retries=3
+  gerrit:timeout=60,retries=2,backoff=5
+
+ timeout     - seconds of the wall clock to terminate the command
+ stall       - seconds without any output to terminate the command, which
+               watches the progress of git-fetch and git-push
+ retries     - count to retry the command terminated by the timeouts, or
+               exited with 128 by git or 255 by ssh for the network errors
+               like "Connection reset" in its standard error
+ backoff     - seconds to wait before the first retry, doubled for the next
+ max-backoff - seconds to wait at most before a retry
+ jitter      - fraction of the wait cut randomly not to retry together"""
+
+    KINDS = ('fetch', 'push', 'ls-remote', 'gerrit')
+    # the exit codes of the failures, which are retried only for the network
+    # errors, as git exits with 128 for any fatal error like the permission
+    EXIT_CODES = {'gerrit': (255,)}
+    GIT_EXIT_CODES = (128,)
+    NETWORK_ERRORS = re.compile(
+        r'Connection (refused|timed out|reset|closed)|'
+        r'Could not resolve host|early EOF|hung up unexpectedly|'
+        r'RPC failed|Network is unreachable|No route to host|'
+        r'transfer closed|Operation timed out', re.IGNORECASE)
+
+    _lock = threading.Lock()
+    _policies = dict()
+
+    def __init__(self, kind=None, timeout=None, stall=None, retries=0,
+                 backoff=2, max_backoff=60, jitter=0.5):
+        self.kind = kind
+        self.timeout = timeout
+        self.stall = stall
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--command-policy') or \
+            optparse.add_option_group('Command policy options')
+        options.add_option(
+            '--command-policy',
+            dest='command_policy', action='append', metavar='KIND:POLICY',
+            help='Set the timeout, the stall and the retries of "fetch", '
+                 '"push", "ls-remote" or "gerrit", like '
+                 '"fetch:stall=300,retries=3", which retries the commands '
+                 'terminated by the timeouts or failed by the network errors')
+
+    @staticmethod
+    def _parse(value):
+        kind, _, items = value.partition(':')
+        kind = kind.strip()
+        if kind not in CommandPolicy.KINDS:
+            raise ProcessingError(
+                'command policy "%s": unknown kind "%s"' % (value, kind))
+
+        policy = CommandPolicy(kind)
+        for item in items.split(','):
+            if not item.strip():
+                continue
+
+            name, _, val = item.partition('=')
+            name = name.strip().replace('-', '_')
+            if name not in ('timeout', 'stall', 'retries', 'backoff',
+                            'max_backoff', 'jitter'):
+                raise ProcessingError(
+                    'command policy "%s": unknown "%s"' % (value, name))
+
+            try:
+                setattr(policy, name, (
+                    int if name == 'retries' else float)(val.strip()))
+            except ValueError:
+                raise ProcessingError(
+                    'command policy "%s": invalid "%s"' % (value, item))
+
+        return policy
+
+    @staticmethod
+    def configure(values):
+        """Sets the policies of the values shared in the process."""
+        if isinstance(values, basestring):
+            values = [values]
+
+        policies = dict()
+        for value in values or list():
+            policy = CommandPolicy._parse(str(value))
+            policies[policy.kind] = policy
+
+        with CommandPolicy._lock:
+            CommandPolicy._policies = policies
+
+    @staticmethod
+    def get(kind):
+        """Returns the policy of the kind, which does nothing if not set."""
+        with CommandPolicy._lock:
+            return CommandPolicy._policies.get(kind) or CommandPolicy(kind)
+
+    def watch(self, kws):
+        """Returns the arguments with the timeouts for the command."""
+        kws = dict(kws)
+        if self.timeout:
+            kws.setdefault('timeout', self.timeout)
+        if self.stall:
+            kws.setdefault('stall_timeout', self.stall)
+        if self.retries:
+            # the network errors are found in the standard error
+            kws.setdefault('keep_error', True)
+
+        return kws
+
+    def progress(self, args):
+        """Returns the arguments to report the progress for the stall."""
+        args = list(args)
+        if self.stall and self.kind in ('fetch', 'push') and \
+                '--progress' not in args:
+            # the progress is only reported to a terminal by default
+            args.insert(1, '--progress')
+
+        return args
+
+    def retryable(self, ret, error='', reason=None):
+        """Returns if the failed command is retried with the exit code, the
+        standard error and the reason set by the watchdog."""
+        if reason:
+            return True
+        # the other signals like SIGINT aren't retried
+        elif ret not in CommandPolicy.EXIT_CODES.get(
+                self.kind, CommandPolicy.GIT_EXIT_CODES):
+            return False
+
+        return CommandPolicy.NETWORK_ERRORS.search(error or '') is not None
+
+    def delay(self, attempt):
+        """Returns the seconds to wait before the retry of the attempt."""
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+
+        return delay * (1 - self.jitter * random.random())
+
+    def run(self, func, name=None):
+        """Calls the function returning the exit code, the standard error
+        and the reason of the watchdog with the retries. Returns the exit
+        code."""
+        attempt = 0
+        while True:
+            ret, error, reason = func()
+            if ret == 0 or attempt >= self.retries or \
+                    not self.retryable(ret, error, reason):
+                return ret
+
+            delay = self.delay(attempt)
+            attempt += 1
+            Logger.get_logger().warning(
+                '%s: exited with %d, retry %d/%d in %.1fs',
+                name or self.kind, ret, attempt, self.retries, delay)
+            time.sleep(delay)
+
+
+TOPIC_ENTRY = 'CommandPolicy'
@@ -48,6 +48,8 @@ import os
 import re
 import xml.dom.minidom
 
+from collections import OrderedDict
+
 from error import ProcessingError
 from options import Values
 from pattern import PatternFile
@@ -77,7 +79,8 @@ class _ConfigFile(object):
     HOOK_PREFIX = "hook"
 
     def __init__(self, filename=None):
-        self.vals = dict()
+        # the names are listed in the order of the file
+        self.vals = OrderedDict()
         self.filename = os.path.realpath(filename)
 
     def _new_value(self, name, vals=None):
@@ -157,7 +160,10 @@ class _ConfigFile(object):
         sname = self._build_name(section, subsection)
 
         if section and subsection:
-            proposed = self.vals.get(sname)
+            proposed = list()
+            # the values can't be tested as booleans with __getattr__
+            if sname in self.vals:
+                proposed.append(self.vals[sname])
         elif section:
             proposed = list()
             for key, value in self.vals.items():
@@ -210,6 +216,7 @@ class _IniConfigFile(_ConfigFile):
             if m:
                 cfg = self._new_value(
                     '%s.%s' % (m.group('section'), m.group('subsection')))
+                continue
 
             # option = value
             m = re.match(r'^\s*(?P<name>[A-Za-z0-9\-_]+)\s*=\s*'
@@ -1,7 +1,9 @@
 
 from command import Command
+from command_policy import CommandPolicy
 from files.file_utils import FileUtils
 from logger import Logger
+from ssh_master import SshMaster
 from synchronize import synchronized
 
 
@@ -54,7 +56,9 @@ implicitly."""
         options.add_option(
             '--remote', '--server', '--gerrit-server',
             dest='remote', action='store',
-            help='Set gerrit url for the repository management')
+            help='Set gerrit url for the repository management. Several '
+                 'servers split with commas are pushed concurrently by the '
+                 'sub-commands "repo", "repo-mirror" and "git-clone"')
         options.add_option(
             '--repo-create',
             dest='repo_create', action='store_true', default=True,
@@ -76,6 +80,7 @@ implicitly."""
     def _execute(self, cmd, *args, **kws):
         cli = list()
         cli.append(self.ssh)
+        cli.extend(SshMaster.ssh_options())
         cli.append('-p')
         cli.append('29418')
         cli.append(self.server)
@@ -86,20 +91,36 @@ implicitly."""
             cli.extend(args)
 
         self.new_args(cli)
-        return self.wait(**kws)
+        policy = CommandPolicy.get('gerrit')
+        hosts = ['%s:29418' % self.server.split('@')[-1]]
+        if kws.get('stream'):
+            return self.stream(
+                context=SshMaster.sessions(hosts), **policy.watch(kws))
+
+        def _wait():
+            with SshMaster.sessions(hosts):
+                ret = self.wait(**policy.watch(kws))
+
+            return ret, self.get_error(), self.reason
+
+        return policy.run(_wait, 'gerrit %s' % cmd)
 
     @synchronized
     def ls_projects(self, force=False):
         if not self.enable:
             return list()
 
-        if (self.dirty or force) and self._execute(
-                'ls-projects', capture_stdout=True) == 0:
-            self.dirty = False
-            self.projects = list()
+        def _ls_projects():
+            output = self._execute('ls-projects', stream=True)
+            projects[:] = [line.strip() for line in output if line.strip()]
+
+            return output.returncode, output.get_error(), output.reason
 
-            for line in self.get_out_lines():
-                self.projects.append(line.strip())
+        projects = list()
+        if (self.dirty or force) and CommandPolicy.get('gerrit').run(
+                _ls_projects, 'gerrit ls-projects') == 0:
+            self.dirty = False
+            self.projects = projects
 
         return self.projects
 
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import threading
+
+from logger import Logger
+
+
+class BundleIndex(object):
+    """\
+Manages the git bundles of the projects in a transfer directory.
+
+The bundles are exported per project incrementally, which takes the pushed
+references of the remote as the prerequisites. The index file in the
+directory records the bundles in order with the contained references, and
+the importing side applies them one by one before pushing to the remote.
+
+The index file is written by save() once the stage completes rather than
+after each project."""
+
+    INDEX = 'index.json'
+
+    _lock = threading.Lock()
+    _indexes = dict()
+
+    def __init__(self, dirname):
+        self.dirname = os.path.realpath(dirname)
+        self.filename = os.path.join(self.dirname, BundleIndex.INDEX)
+        self.lock = threading.Lock()
+        self.projects = dict()
+        self.dirty = False
+
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as fp:
+                self.projects = json.load(fp).get('projects') or dict()
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--bundle-export') or \
+            optparse.add_option_group('Bundle options')
+        options.add_option(
+            '--bundle-export',
+            dest='bundle_export', action='store', metavar='DIR',
+            help='Export the projects as incremental git bundles into the '
+                 'directory instead of pushing to the remote')
+        options.add_option(
+            '--bundle-import',
+            dest='bundle_import', action='store', metavar='DIR',
+            help='Import the projects from the git bundles in the directory '
+                 'instead of downloading and push them to the remote')
+
+    @staticmethod
+    def load(dirname):
+        """Returns the index of the directory shared in the process."""
+        dirname = os.path.realpath(dirname)
+        with BundleIndex._lock:
+            if dirname not in BundleIndex._indexes:
+                BundleIndex._indexes[dirname] = BundleIndex(dirname)
+
+            return BundleIndex._indexes[dirname]
+
+    def names(self):
+        return sorted(self.projects.keys())
+
+    def get(self, name):
+        return self.projects.get(name) or dict()
+
+    def save(self):
+        """Writes the index file if any project changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+
+            if not os.path.exists(self.dirname):
+                os.makedirs(self.dirname)
+
+            tmpname = '%s.tmp' % self.filename
+            with open(tmpname, 'w') as fp:
+                json.dump({'projects': self.projects}, fp, indent=2,
+                          sort_keys=True)
+
+            os.rename(tmpname, self.filename)
+            self.dirty = False
+
+    def export(self, project, name, **kws):
+        """Exports the references of the project as a new bundle."""
+        logger = Logger.get_logger()
+
+        with self.lock:
+            bundles = self.get(name).get('bundles') or list()
+            bundle = '%s.%d.bundle' % (name, len(bundles) + 1)
+
+        filename = os.path.join(self.dirname, bundle)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        ret, refs, basis = project.export_bundle(filename, **kws)
+        if ret != 0 or not refs:
+            return ret
+
+        with self.lock:
+            entry = self.projects.setdefault(name, dict())
+            entry['path'] = project.path
+            # the projects of git-p have no source in the manifest
+            entry['source'] = project.source or name
+            entry['revision'] = project.revision
+            entry.setdefault('bundles', list()).append({
+                'bundle': bundle,
+                'refs': refs,
+                'prerequisites': basis})
+            self.dirty = True
+
+        logger.info('%s: exported to %s', name, bundle)
+        return ret
+
+    def apply(self, project, name, **kws):
+        """Applies the bundles of the project in order."""
+        logger = Logger.get_logger()
+
+        bundles = self.get(name).get('bundles')
+        if not bundles:
+            logger.error('%s: no bundle in %s', name, self.dirname)
+            return 1
+
+        for bundle in bundles:
+            ret = project.import_bundle(
+                os.path.join(self.dirname, bundle['bundle']), **kws)
+            if ret != 0:
+                logger.error('%s: failed to import %s', name, bundle['bundle'])
+                return ret
+
+        return 0
+
+
+class CloneBundles(BundleIndex):
+    """\
+Refreshes the clone.bundle of the mirrored projects in a directory.
+
+Each bundle is written as "<name>/clone.bundle" with all the heads and tags,
+which is fetched by git-repo from the url of the project before the initial
+sync. The bundle is only rewritten once the references of the project
+changed, and the index file lists the bundles with their references for the
+HTTP server in front of the directory, which is written by save() as well."""
+
+    BUNDLE = 'clone.bundle'
+
+    _lock = threading.Lock()
+    _indexes = dict()
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--bundle-export') or \
+            optparse.add_option_group('Bundle options')
+        options.add_option(
+            '--clone-bundle',
+            dest='clone_bundle', action='store', metavar='DIR',
+            help='Write or refresh the clone.bundle of the projects in the '
+                 'directory for the initial sync of git-repo')
+
+    @staticmethod
+    def load(dirname):
+        """Returns the index of the directory shared in the process."""
+        dirname = os.path.realpath(dirname)
+        with CloneBundles._lock:
+            if dirname not in CloneBundles._indexes:
+                CloneBundles._indexes[dirname] = CloneBundles(dirname)
+
+            return CloneBundles._indexes[dirname]
+
+    @staticmethod
+    def fingerprint(refs):
+        digest = hashlib.sha1()
+        for ref in sorted(refs):
+            digest.update('%s %s\n' % (refs[ref], ref))
+
+        return digest.hexdigest()
+
+    def refresh(self, project, name, **kws):
+        """Writes the bundle of the project if its references changed."""
+        logger = Logger.get_logger()
+
+        ret, local = project.get_local_refs(force=True)
+        if ret != 0:
+            return ret
+
+        refs = dict([(ref, sha1) for ref, sha1 in local.refs.items()
+                     if ref.startswith(('refs/heads/', 'refs/tags/')) and
+                     ref not in local.symrefs])
+        if not refs:
+            return 0
+
+        bundle = os.path.join(name, CloneBundles.BUNDLE)
+        filename = os.path.join(self.dirname, bundle)
+        fingerprint = CloneBundles.fingerprint(refs)
+        if self.get(name).get('fingerprint') == fingerprint and \
+                os.path.exists(filename):
+            logger.debug('%s: %s is up to date', name, bundle)
+            return 0
+
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        # the downloaders never see a partial bundle
+        tmpname = '%s.tmp' % filename
+        ret, _ = project.bundle(
+            'create', tmpname, '--stdin',
+            stdin='\n'.join(sorted(refs)) + '\n', **kws)
+        if ret != 0 or kws.get('tryrun'):
+            return ret
+
+        os.rename(tmpname, filename)
+        with self.lock:
+            self.projects[name] = {
+                'bundle': bundle,
+                'fingerprint': fingerprint,
+                'size': os.path.getsize(filename),
+                'refs': refs}
+            self.dirty = True
+
+        logger.info('%s: refreshed %s', name, bundle)
+        return ret
+
+
+TOPIC_ENTRY = 'BundleIndex, CloneBundles'
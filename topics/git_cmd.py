@@ -1,8 +1,93 @@
 
 import os
+import pipes
+import re
+import subprocess
+import threading
 
 from command import Command
+from command_policy import CommandPolicy
 from files.file_utils import FileUtils
+from ssh_master import SshMaster
+
+
+class GitCatFile(object):
+    """Resolves the revisions with a long-lived git cat-file co-process."""
+
+    # queries written before reading back not to block on the full pipes
+    BATCH = 256
+    FOUND = re.compile(r'^([0-9a-f]{40}|[0-9a-f]{64}) \S+ \d+$')
+
+    def __init__(self, git, gitdir, env=None):
+        self.git = git
+        self.gitdir = gitdir
+        self.env = env
+        self.proc = None
+        # not to respawn the co-process once the owner closed it
+        self.closed = False
+        # reentrant for closing the broken co-process while resolving
+        self.lock = threading.RLock()
+
+    def _start(self):
+        if self.closed:
+            return None
+        elif self.proc is None or self.proc.poll() is not None:
+            with open(os.devnull, 'w') as devnull:
+                self.proc = subprocess.Popen(
+                    [self.git, '--git-dir=%s' % self.gitdir,
+                     'cat-file', '--batch-check'],
+                    env=self.env,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=devnull)
+
+        return self.proc
+
+    def _stop(self):
+        proc, self.proc = self.proc, None
+        if proc is not None:
+            try:
+                proc.stdin.close()
+            except IOError:
+                pass
+
+            proc.wait()
+
+    def resolve_many(self, revs):
+        """Returns the resolved revisions, which leaves out the ones not
+        queried if the instance is closed meanwhile."""
+        results = dict()
+
+        revs = [rev for rev in revs if rev and '\n' not in rev]
+        with self.lock:
+            for k in range(0, len(revs), GitCatFile.BATCH):
+                chunk = revs[k:k + GitCatFile.BATCH]
+
+                proc = self._start()
+                if proc is None:
+                    break
+
+                try:
+                    proc.stdin.write(''.join(['%s\n' % rev for rev in chunk]))
+                    proc.stdin.flush()
+                except IOError:
+                    self._stop()
+                    continue
+
+                for rev in chunk:
+                    # the output is "<sha1> <type> <size>" for the object
+                    # and "<rev> missing" or "<rev> ambiguous" for others,
+                    # whose revision might contain the spaces
+                    mo = GitCatFile.FOUND.match(proc.stdout.readline())
+                    results[rev] = mo.group(1) if mo else None
+
+        return results
+
+    def close(self):
+        # not to stop the co-process while another thread is resolving
+        with self.lock:
+            self.closed = True
+            self._stop()
 
 
 class GitCommand(Command):
@@ -13,14 +98,17 @@ class GitCommand(Command):
         self.gitdir = gitdir
         self.worktree = worktree or os.getcwd()
         self.git = FileUtils.find_execute('git')
+        # the configurations of the transfer profile for fetch and push
+        self.transfer_configs = list()
 
     def _execute(self, *args, **kws):
         cli = list()
         cli.append(self.git)
 
-        gitdir = self.gitdir if self.gitdir else None
-        if not gitdir:
-            gitdir = FileUtils.ensure_path(self.worktree, '.git')
+        gitdir = self.get_gitdir()
+
+        for config in kws.get('configs') or list():
+            cli.extend(['-c', config])
 
         if not kws.get('notdir', False):
             if self.worktree:
@@ -28,11 +116,51 @@ class GitCommand(Command):
             if gitdir:
                 cli.append('--git-dir=%s' % gitdir)
 
+        executor = kws.pop('executor', None)
+        # the timeouts and the retries of the remote commands
+        policy = CommandPolicy.get(args[0] if args else None)
+
         if len(args):
-            cli.extend(args)
+            cli.extend(policy.progress(args))
+
+        if SshMaster.enabled():
+            # the environment of the command is kept to wrap its ssh again,
+            # and GIT_SSH is a path rather than a command of the shell
+            kws['env'] = dict(self.env)
+            kws['env']['GIT_SSH_COMMAND'] = SshMaster.ssh_command(
+                self.env.get('GIT_SSH_COMMAND') or
+                (self.env.get('GIT_SSH') and pipes.quote(self.env['GIT_SSH'])))
 
         self.new_args(cli)
-        return self.wait(**kws)
+        if executor is not None:
+            return self.submit(
+                executor,
+                context=SshMaster.sessions(SshMaster.hosts(args)),
+                policy=policy, name='git %s' % args[0] if args else None,
+                **policy.watch(kws))
+        elif kws.get('stream'):
+            # the sessions are held until the output is consumed
+            return self.stream(
+                context=SshMaster.sessions(SshMaster.hosts(args)),
+                **policy.watch(kws))
+
+        def _wait():
+            with SshMaster.sessions(SshMaster.hosts(args)):
+                ret = self.wait(**policy.watch(kws))
+
+            return ret, self.get_error(), self.reason
+
+        return policy.run(_wait, 'git %s' % args[0] if args else None)
+
+    def _transfer(self, kws):
+        if self.transfer_configs:
+            kws['configs'] = self.transfer_configs + list(
+                kws.get('configs') or list())
+
+        return kws
+
+    def get_gitdir(self):
+        return self.gitdir or FileUtils.ensure_path(self.worktree, '.git')
 
     def raw_command(self, *args, **kws):
         return self._execute(*args, **kws)
@@ -42,6 +170,13 @@ class GitCommand(Command):
 
         return res, self.get_output()
 
+    def raw_command_with_stream(self, *args, **kws):
+        return self._execute(stream=True, *args, **kws)
+
+    def raw_command_async(self, executor, *args, **kws):
+        kws.setdefault('capture_stdout', True)
+        return self._execute(executor=executor, *args, **kws)
+
     def set_path(self, gitdir=None, worktree=None):
         if gitdir:
             self.gitdir = gitdir
@@ -59,6 +194,9 @@ class GitCommand(Command):
 
         return self.raw_command('add', *args, **kws)
 
+    def bundle(self, *args, **kws):
+        return self.raw_command_with_output('bundle', *args, **kws)
+
     def branch(self, *args, **kws):
         return self.raw_command_with_output('branch', *args, **kws)
 
@@ -67,23 +205,71 @@ class GitCommand(Command):
 
     def clone(self, *args, **kws):
         return self.raw_command(
-            'clone', capture_stdout=False, capture_stderr=False, *args, **kws)
+            'clone', capture_stdout=False, capture_stderr=False, *args,
+            **self._transfer(kws))
 
     def commit(self, *args, **kws):
         return self.raw_command('commit', *args, **kws)
 
+    def commit_graph(self, *args, **kws):
+        return self.raw_command('commit-graph', *args, **kws)
+
     def config(self, *args, **kws):
         return self.raw_command_with_output('config', *args, **kws)
 
+    def count_objects(self, *args, **kws):
+        return self.raw_command_with_output('count-objects', *args, **kws)
+
     def fetch(self, *args, **kws):
         return self.raw_command(
-            'fetch', capture_stdout=False, capture_stderr=False, *args, **kws)
+            'fetch', capture_stdout=False, capture_stderr=False, *args,
+            **self._transfer(kws))
+
+    def fetch_async(self, executor, *args, **kws):
+        return self.raw_command_async(
+            executor, 'fetch', *args, **self._transfer(kws))
+
+    def for_each_ref(self, *args, **kws):
+        if kws.pop('stream', False):
+            return self.raw_command_with_stream('for-each-ref', *args, **kws)
+
+        return self.raw_command_with_output('for-each-ref', *args, **kws)
 
     def log(self, *args, **kws):
         return self.raw_command_with_output('log', *args, **kws)
 
+    @staticmethod
+    def _protocol_v2(kws):
+        # the server of protocol v2 only advertises the references under the
+        # prefixes of "--heads" and "--tags" instead of all like refs/changes,
+        # and the configs of the caller are applied later to override it
+        kws['configs'] = ['protocol.version=2'] + list(
+            kws.get('configs') or list())
+
+        return kws
+
     def ls_remote(self, *args, **kws):
-        return self.raw_command_with_output('ls-remote', notdir=True, *args, **kws)
+        self._protocol_v2(kws)
+        if kws.pop('stream', False):
+            return self.raw_command_with_stream(
+                'ls-remote', notdir=True, *args, **kws)
+
+        return self.raw_command_with_output(
+            'ls-remote', notdir=True, *args, **kws)
+
+    def ls_remote_async(self, executor, *args, **kws):
+        self._protocol_v2(kws)
+        return self.raw_command_async(
+            executor, 'ls-remote', notdir=True, *args, **kws)
+
+    def merge_base(self, *args, **kws):
+        return self.raw_command_with_output('merge-base', *args, **kws)
+
+    def multi_pack_index(self, *args, **kws):
+        return self.raw_command('multi-pack-index', *args, **kws)
+
+    def pack_refs(self, *args, **kws):
+        return self.raw_command('pack-refs', *args, **kws)
 
     def pull(self, *args, **kws):
         return self.raw_command(
@@ -91,7 +277,16 @@ class GitCommand(Command):
 
     def push(self, *args, **kws):
         return self.raw_command(
-            'push', capture_stdout=False, capture_stderr=False, *args, **kws)
+            'push', capture_stdout=False, capture_stderr=False, *args,
+            **self._transfer(kws))
+
+    def push_async(self, executor, *args, **kws):
+        return self.raw_command_async(
+            executor, 'push', *args, **self._transfer(kws))
+
+    def repack(self, *args, **kws):
+        return self.raw_command(
+            'repack', capture_stdout=False, capture_stderr=False, *args, **kws)
 
     def rev_list(self, *args, **kws):
         return self.raw_command_with_output('rev-list', *args, **kws)
@@ -104,3 +299,6 @@ class GitCommand(Command):
 
     def tag(self, *args, **kws):
         return self.raw_command_with_output('tag', *args, **kws)
+
+    def update_ref(self, *args, **kws):
+        return self.raw_command_with_output('update-ref', *args, **kws)
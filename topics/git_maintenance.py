@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import threading
+
+from contextlib import contextmanager
+from git_cmd import GitCommand
+from logger import Logger
+
+
+class GitMaintenance(object):
+    """\
+Defers the automatic gc of git and maintains the repositories in a stage.
+
+The automatic gc is turned off for all git commands started in the run with
+the configurations in the environment (git 2.31 or later), including the
+ones started by git-repo, and the environment is restored once the last of
+the parallel runs completes. The maintenance stage then repacks each repository
+with the reachability bitmaps, packs the references and writes the
+commit-graph and the multi-pack-index. The jobs are shared by the
+repositories maintained in parallel and the pack threads of each repack."""
+
+    # the configurations to turn off the automatic gc and maintenance
+    DEFERRED = (('gc.auto', '0'), ('maintenance.auto', 'false'))
+
+    _lock = threading.Lock()
+    # the count of the runs deferring the gc and the replaced environment
+    _deferred = 0
+    _environ = None
+
+    def __init__(self, jobs=None, tryrun=False):
+        self.jobs = max(jobs or multiprocessing.cpu_count(), 1)
+        self.tryrun = tryrun
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--maintenance') or \
+            optparse.add_option_group('Maintenance options')
+        options.add_option(
+            '--maintenance',
+            dest='maintenance', action='store_true',
+            help='Turn off the automatic gc during the run and maintain the '
+                 'repositories with bitmaps, commit-graph and '
+                 'multi-pack-index after the downloads and before the '
+                 'pushes')
+        options.add_option(
+            '--maintenance-jobs',
+            dest='maintenance_jobs', action='store', type='int',
+            metavar='JOBS',
+            help='Set the jobs shared by the parallel maintenance and the '
+                 'pack threads, default: the number of the cpus')
+
+    @staticmethod
+    def defer_gc():
+        """Turns off the automatic gc for the commands started later until
+        restore_gc() is called as many times."""
+        with GitMaintenance._lock:
+            GitMaintenance._deferred += 1
+            if GitMaintenance._deferred > 1:
+                return
+
+            count = int(os.environ.get('GIT_CONFIG_COUNT') or 0)
+            names = ['GIT_CONFIG_COUNT']
+            for k in range(len(GitMaintenance.DEFERRED)):
+                names.append('GIT_CONFIG_KEY_%d' % (count + k))
+                names.append('GIT_CONFIG_VALUE_%d' % (count + k))
+
+            GitMaintenance._environ = dict(
+                [(name, os.environ.get(name)) for name in names])
+
+            for name, value in GitMaintenance.DEFERRED:
+                os.environ['GIT_CONFIG_KEY_%d' % count] = name
+                os.environ['GIT_CONFIG_VALUE_%d' % count] = value
+                count += 1
+
+            os.environ['GIT_CONFIG_COUNT'] = str(count)
+
+    @staticmethod
+    def restore_gc():
+        """Restores the environment replaced by defer_gc()."""
+        with GitMaintenance._lock:
+            if GitMaintenance._deferred == 0:
+                return
+
+            GitMaintenance._deferred -= 1
+            if GitMaintenance._deferred > 0:
+                return
+
+            for name, value in GitMaintenance._environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+            GitMaintenance._environ = None
+
+    @staticmethod
+    @contextmanager
+    def deferred_gc(deferred=True):
+        """Defers the automatic gc in the context if deferred."""
+        if deferred:
+            GitMaintenance.defer_gc()
+
+        try:
+            yield
+        finally:
+            if deferred:
+                GitMaintenance.restore_gc()
+
+    def maintain(self, project, threads=1):
+        """Maintains the repository of the project like a full gc."""
+        logger = Logger.get_logger()
+
+        gitdir = project.get_gitdir()
+        git = GitCommand(gitdir, gitdir, tryrun=self.tryrun)
+        # keep the objects borrowed from the alternates like an object pool,
+        # for which git skips the bitmaps
+        ret = git.repack(
+            '-a', '-d', '-l', '-q', '--write-bitmap-index',
+            configs=['pack.threads=%d' % threads])
+        if ret == 0:
+            ret = git.pack_refs('--all', '--prune')
+        if ret == 0:
+            ret = git.commit_graph('write', '--reachable')
+        if ret == 0:
+            ret = git.multi_pack_index('write')
+
+        if ret != 0:
+            logger.error('%s: failed to maintain %s', project, gitdir)
+        else:
+            logger.info('%s: maintained', project)
+
+        return ret
+
+    def run(self, projects):
+        """Maintains the projects in parallel within the jobs."""
+        projects = list(projects)
+        if not projects:
+            return 0
+
+        parallel = min(self.jobs, len(projects))
+        threads = max(self.jobs / parallel, 1)
+
+        lock = threading.Lock()
+        pending = list(reversed(projects))
+        failures = list()
+
+        def _run():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+
+                    project = pending.pop()
+
+                if self.maintain(project, threads) != 0:
+                    with lock:
+                        failures.append(project)
+
+        workers = [threading.Thread(target=_run) for _ in range(parallel)]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        return 1 if failures else 0
+
+
+TOPIC_ENTRY = 'GitMaintenance'
@@ -1,12 +1,36 @@
 
+import hashlib
 import os
 import re
+import threading
 import urlparse
 
+from command_executor import CommandExecutor
+from command_policy import CommandPolicy
 from error import DownloadError, ProcessingError
-from git_cmd import GitCommand
+from git_cmd import GitCatFile, GitCommand
 from logger import Logger
+from object_store import ObjectStore
 from project import Project
+from push_journal import PushJournal
+from ref_store import RefStore
+
+
+# keep the command line of git-push far below the system limitation
+_MAX_REFSPECS_LENGTH = 32768
+
+# prefix of the temporary references to push the history in steps
+_STEP_REF_PREFIX = 'refs/krep/steps/'
+# prefix of the temporary references to verify the bundles with the remote
+_BUNDLE_REF_PREFIX = 'refs/krep/remote/'
+
+# count of the missing objects requested in a single git-fetch
+_MISSING_CHUNK_SIZE = 1000
+
+# git commands which never update the local references
+_READONLY_COMMANDS = (
+    'cat-file', 'config', 'count-objects', 'for-each-ref', 'log', 'ls-remote',
+    'merge-base', 'push', 'rev-list', 'rev-parse')
 
 
 def _sha1_equals(sha, shb):
@@ -17,7 +41,8 @@ def _sha1_equals(sha, shb):
 
 
 def _ensure_remote(url):
-    if url:
+    # keep the local path to clone with the hardlinks
+    if url and not os.path.isabs(url):
         ulp = urlparse.urlparse(url)
         if not ulp.scheme:
             url = 'git://' + url
@@ -25,6 +50,159 @@ def _ensure_remote(url):
     return url
 
 
+def _split_refspecs(refspecs, size=None, limit=None):
+    chunk, length = list(), 0
+    limit = limit or _MAX_REFSPECS_LENGTH
+    for refspec in refspecs:
+        if chunk and ((size and len(chunk) >= size) or
+                      length + len(refspec) > limit):
+            yield chunk
+            chunk, length = list(), 0
+
+        chunk.append(refspec)
+        length += len(refspec) + 1
+
+    if chunk:
+        yield chunk
+
+
+class _RemoteRefs(object):
+    """Caches the advertised references of the remotes for the process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = dict()
+        self.refs = dict()
+
+    def _lock(self, url):
+        with self.lock:
+            return self.locks.setdefault(url, threading.Lock())
+
+    def get(self, url, loader, force=False):
+        # only one thread lists the same remote and the others wait for it
+        with self._lock(url):
+            if force or url not in self.refs:
+                ret, refs = loader(url)
+                if ret != 0:
+                    return ret, dict()
+
+                try:
+                    self.refs[url] = RefStore(refs)
+                except ValueError, e:
+                    Logger.get_logger().error('%s: %s', url, e)
+                    return 1, dict()
+
+            return 0, self.refs[url]
+
+    def has(self, url):
+        with self._lock(url):
+            return url in self.refs
+
+    def put(self, url, refs):
+        with self._lock(url):
+            try:
+                self.refs[url] = RefStore(refs)
+            except ValueError, e:
+                # left to be listed again
+                Logger.get_logger().error('%s: %s', url, e)
+
+    def update(self, url, refs):
+        with self._lock(url):
+            if url in self.refs:
+                cached = dict(self.refs[url])
+                for ref, sha1 in refs.items():
+                    if sha1:
+                        cached[ref] = sha1
+                    else:
+                        cached.pop(ref, None)
+
+                try:
+                    self.refs[url] = RefStore(cached)
+                except ValueError:
+                    # listed again instead of mixing the hash algorithms
+                    self.refs.pop(url, None)
+
+    def invalidate(self, url):
+        with self._lock(url):
+            self.refs.pop(url, None)
+
+
+_remote_refs = _RemoteRefs()  # pylint: disable=C0103
+
+
+def _parse_remote_refs(lines):
+    refs, width = dict(), None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        items = re.split(r'\s+', line, maxsplit=1)
+        # the object names of a listing are all SHA-1 or SHA-256
+        if len(items) != 2 or \
+                not re.match('^([0-9a-f]{40}|[0-9a-f]{64})$', items[0]) or \
+                width not in (None, len(items[0])):
+            Logger.get_logger().warning(
+                'ignore the advertised reference "%s"', line)
+            continue
+
+        sha1, ref = items
+        width = len(sha1)
+        refs[ref] = sha1
+
+    return refs
+
+
+class _LocalRefs(object):
+    """Holds the references of the repository read with for-each-ref."""
+    FORMAT = '%(refname)%00%(objectname)%00%(*objectname)%00' \
+             '%(HEAD)%00%(symref)'
+
+    def __init__(self, lines=None):
+        self.peeled = dict()
+        self.symrefs = dict()
+        self.head = None
+
+        refs = dict()
+        for line in lines or list():
+            items = line.split('\0')
+            if len(items) != 5:
+                continue
+
+            ref, sha1, peeled, head, symref = items
+            refs[ref] = sha1
+            if peeled:
+                self.peeled[ref] = peeled
+            if symref:
+                self.symrefs[ref] = symref
+            if head.strip() == '*':
+                self.head = ref
+
+        self.refs = RefStore(refs)
+
+    def _filter(self, prefix):
+        return dict([(ref[len(prefix):], sha1)
+                     for ref, sha1 in self.refs.prefixed(prefix)
+                     if ref not in self.symrefs])
+
+    def heads(self):
+        return self._filter('refs/heads/')
+
+    def remotes(self):
+        return self._filter('refs/remotes/')
+
+    def tags(self):
+        return self._filter('refs/tags/')
+
+    def get(self, ref, peeled=False):
+        if peeled and ref in self.peeled:
+            return self.peeled[ref]
+
+        return self.refs.get(ref)
+
+    def has(self, ref):
+        return ref in self.refs
+
+
 def _secure_head_name(head):
     heads = head.split('/')
     while len(heads) > 1 and heads[0] in ('remotes', 'origin'):
@@ -33,8 +211,42 @@ def _secure_head_name(head):
     return '/'.join(heads)
 
 
+class _PushPlan(object):  # pylint: disable=R0903
+    """Holds the references to push, which is independent of the remotes.
+
+    Each item maps the remote reference to the local reference, the SHA-1
+    and the kind deciding whether it's up-to-date with the remote."""
+    HEAD = 'head'
+    TAG = 'tag'
+    SHA1TAG = 'sha1tag'
+
+    def __init__(self, name, fingerprint, wildcard=None, refs=None):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.wildcard = wildcard
+        self.refs = refs or dict()
+        self.items = dict()
+        # count of commits and size in MB to push the heads in steps
+        self.steps = None
+        self.step_size = None
+
+    def heads(self):
+        if self.wildcard:
+            return dict(self.refs)
+
+        return dict([(ref, item[1]) for ref, item in self.items.items()
+                     if item[2] == _PushPlan.HEAD])
+
+    def add(self, remote_ref, local_ref, sha1, kind=HEAD):
+        self.items[remote_ref] = (local_ref, sha1, kind)
+
+
 class GitProject(Project, GitCommand):
     """Manages the git repository as a project"""
+    # git-rev-list supports "--disk-usage" since 2.31
+    _disk_usage_lock = threading.Lock()
+    _disk_usage_supported = True
+
     def __init__(self, uri, worktree=None, gitdir=None, revision='master',
                  remote=None, pattern=None, bare=False, *args, **kws):
         self.bare = bare
@@ -54,7 +266,122 @@ class GitProject(Project, GitCommand):
             self, uri, worktree, revision, _ensure_remote(remote),
             pattern, *args, **kws)
 
+        self._local_refs = None
+        self._cat_file = None
+        self._store = None
+        # the promisor remote read once, '' for a full repository
+        self._promisor = None
+        self._lock = threading.RLock()
+        self.push_results = dict()
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--filter') or \
+            optparse.add_option_group('Git download options')
+        options.add_option(
+            '--filter',
+            dest='filter', action='store', metavar='FILTER_SPEC',
+            help='Clone and fetch the repository partially with the filter '
+                 'like "blob:none" or "tree:0". The missing objects are '
+                 'fetched in batches only before pushing them')
+        options.add_option(
+            '--force-fetch',
+            dest='force_fetch', action='store_true',
+            help='Fetch the existing repository even if the references of '
+                 'the upstream are unchanged since the last fetch')
+
+        options = optparse.get_option_group('--atomic') or \
+            optparse.add_option_group('Git push options')
+        options.add_option(
+            '--atomic', '--push-atomic',
+            dest='atomic', action='store_true',
+            help='Push the references atomically. Once the references are '
+                 'split into chunks, each chunk is handled atomically')
+        options.add_option(
+            '--push-chunk', '--push-chunk-size',
+            dest='push_chunk', action='store', type='int', metavar='N',
+            help='Set the maximum count of references in a single git-push. '
+                 'The references are also split once the command line '
+                 'gets too long')
+        options.add_option(
+            '--push-jobs',
+            dest='push_jobs', action='store', type='int', metavar='N',
+            help='Set the count of concurrent git-push streams of a '
+                 'repository to push the tags in chunks')
+        options.add_option(
+            '--verify-remote',
+            dest='verify_remote', action='store_true',
+            help='List the references of the remote even if the local '
+                 'references are unchanged since the last successful push')
+        options.add_option(
+            '--push-steps',
+            dest='push_steps', action='store', type='int', metavar='N',
+            help='Push the new history of a head in steps of N first-parent '
+                 'commits to a temporary reference, which resumes from the '
+                 'last step once failed')
+        options.add_option(
+            '--push-step-size',
+            dest='push_step_size', action='store', type='int', metavar='MB',
+            help='Limit the disk usage of the objects pushed in a step. It '
+                 'works with or without the option "--push-steps"')
+
+    def _execute(self, *args, **kws):
+        # the pushes to the remotes run concurrently with the shared project
+        with self._lock:
+            # drop the reference snapshot once the references might be
+            # changed
+            if args and args[0] not in _READONLY_COMMANDS:
+                self._local_refs = None
+                self.close()
+
+            return GitCommand._execute(self, *args, **kws)
+
+    def raw_command_with_output(self, *args, **kws):
+        with self._lock:
+            return GitCommand.raw_command_with_output(self, *args, **kws)
+
+    def raw_command_with_stream(self, *args, **kws):
+        # the lock is only held to start the command and the output is read
+        # by the caller
+        with self._lock:
+            return GitCommand.raw_command_with_stream(self, *args, **kws)
+
+    def fetch_async(self, executor, *args, **kws):
+        def _done(_):
+            with self._lock:
+                self._local_refs = None
+                self.close()
+
+        pending = self._new_command().fetch_async(executor, *args, **kws)
+        # drop the reference snapshot once the fetch changed the references
+        pending.add_done_callback(_done)
+
+        return pending
+
+    def _new_command(self):
+        # the concurrent commands mustn't share the arguments and the output
+        cmd = GitCommand(self.gitdir, self.worktree, tryrun=self.tryrun)
+        cmd.set_env(self.env)
+        cmd.transfer_configs = self.transfer_configs
+
+        return cmd
+
+    def close(self):
+        """Stops the co-process to resolve the revisions."""
+        # the other threads might be resolving with the dropped ones
+        with self._lock:
+            cat_file, self._cat_file = self._cat_file, None
+            # the packs could be removed by the commands
+            store, self._store = self._store, None
+
+        if cat_file is not None:
+            cat_file.close()
+        if store is not None:
+            store.close()
+
     def init(self, bare=False, *args, **kws):
+        self._promisor = None
+
         cli = list()
         if bare:
             cli.append('--bare')
@@ -64,8 +391,11 @@ class GitProject(Project, GitCommand):
 
         return GitCommand.init(self, notdir=True, *cli, **kws)
 
-    def clone(self, url=None, mirror=None, bare=False,
-              revision=None, single_branch=False, *args, **kws):
+    def clone(self, url=None, mirror=None, bare=False, revision=None,
+              single_branch=False, filter_spec=None, tags=True,
+              *args, **kws):
+        self._promisor = None
+
         cli = list()
         cli.append(url or self.remote)
 
@@ -85,6 +415,10 @@ class GitProject(Project, GitCommand):
             cli.append('--reference=%s' % mirror)
         if single_branch:
             cli.append('--single-branch')
+        if filter_spec:
+            cli.append('--filter=%s' % filter_spec)
+        if not tags:
+            cli.append('--no-tags')
 
         if bare:
             cli.append('--bare')
@@ -99,8 +433,22 @@ class GitProject(Project, GitCommand):
 
         return GitCommand.clone(self, notdir=True, *cli, **kws)
 
-    def download(self, url=None, mirror=False, bare=False,
-                 revision=None, single_branch=False, *args, **kws):
+    def download(self, url=None, mirror=False, bare=False, revision=None,
+                 single_branch=False, filter_spec=None, pool=None,
+                 force_fetch=False, cache=None, *args, **kws):
+        """Clones or fetches the repository.
+
+        Only the heads and tags matching the patterns are fetched if the
+        patterns are set. An existing repository isn't fetched again if
+        neither the upstream references nor the local ones changed since the
+        last fetch. With the clone cache, a new clone is made from the
+        mirror of the upstream in the cache. With the object pool, a new
+        clone references the pool holding the advertised heads and then
+        shares its objects into it."""
+        self._promisor = None
+
+        logger = Logger.get_logger()
+
         if self.gitdir and os.path.isdir(self.gitdir) \
                 and os.listdir(self.gitdir):
             ret, get_url = self.ls_remote('--get-url')
@@ -109,121 +457,531 @@ class GitProject(Project, GitCommand):
                     '%s: different url "%s" with existed git "%s"',
                     self.uri, url, get_url)
 
-            cli = list()
-            cli.append('origin')
-            cli.append('--progress')
-            if self.bare:
-                cli.append('--update-head-ok')
-            cli.append('--tags')
-            cli.append('+refs/heads/*:refs/heads/*')
-            cli.extend(args)
-            ret = self.fetch(*cli, **kws)
+            upstream = get_url.strip() if ret == 0 else None
+            upstream = upstream or _ensure_remote(url)
+
+            fingerprint, refs = None, dict()
+            if upstream:
+                res, refs = self.get_remote_refs(upstream)
+                if res == 0 and refs and not kws.get('tryrun', self.tryrun):
+                    fingerprint = self._fingerprint(
+                        'fetch', sorted(refs.items()))
+
+            journal = self.get_journal(upstream)
+            if fingerprint and not force_fetch and \
+                    journal.fingerprint('fetch') == fingerprint:
+                logger.info('%s: upstream unchanged, skip fetching', self)
+                self.revision = revision
+                return 0
+
+            ret = self._fetch_narrowed(
+                self._narrowed_refspecs(refs) if refs else None,
+                filter_spec, *args, **kws)
+            if ret == 0 and fingerprint:
+                journal.record('fetch', self._fingerprint(
+                    'fetch', sorted(refs.items())), dict())
         else:
             if url is None:
                 url = self.remote
+            if cache is not None:
+                return cache.download(
+                    self, _ensure_remote(url), mirror=mirror, bare=bare,
+                    revision=revision, single_branch=single_branch,
+                    filter_spec=filter_spec, pool=pool)
+
+            if pool and not mirror:
+                mirror = pool.reference(self, _ensure_remote(url))
+
+            refspecs = None
+            if self.pattern.exists('r,rev,revision,t,tag', name=self.uri):
+                res, refs = self.get_remote_refs(_ensure_remote(url))
+                if res == 0 and refs:
+                    refspecs = self._narrowed_refspecs(refs)
+
+            # clone the initial revision only and then fetch the matched
+            # references instead of cloning all of them
             ret = self.clone(
                 _ensure_remote(url), mirror=mirror, bare=bare,
-                revision=revision, single_branch=single_branch, *args, **kws)
+                revision=revision,
+                single_branch=single_branch or refspecs is not None,
+                filter_spec=filter_spec, tags=refspecs is None,
+                *args, **kws)
+            if ret == 0 and refspecs:
+                ret = self._fetch_narrowed(
+                    refspecs, filter_spec, *args, **kws)
+            if ret == 0 and pool:
+                ret = pool.share(self)
 
         if ret == 0:
             self.revision = revision
 
         return ret
 
+    def _pattern_matched(self, categories, name):
+        # the full name or the base name of a reference is matched to push
+        return self.pattern.match(categories, name, name=self.uri) or \
+            self.pattern.match(
+                categories, os.path.basename(name), name=self.uri)
+
+    def _narrowed_refspecs(self, refs):
+        """Returns the refspecs of the upstream references not discarded by
+        the patterns, or None if no pattern is set to narrow them."""
+        if not self.pattern.exists('r,rev,revision,t,tag', name=self.uri):
+            return None
+
+        refspecs = list()
+        for ref in sorted(refs):
+            if ref.endswith('^{}'):
+                continue
+            elif ref.startswith('refs/heads/'):
+                if self._pattern_matched(
+                        'r,rev,revision', ref[len('refs/heads/'):]):
+                    refspecs.append('+%s:%s' % (ref, self._fetched_ref(ref)))
+            elif ref.startswith('refs/tags/'):
+                if self._pattern_matched(
+                        't,tag,revision', ref[len('refs/tags/'):]):
+                    refspecs.append('+%s:%s' % (ref, ref))
+
+        return refspecs
+
+    def _fetched_ref(self, head):
+        """Returns the local reference to fetch the upstream head into, which
+        follows git-clone for both narrowed and full fetches."""
+        if self.bare:
+            return head
+
+        return 'refs/remotes/origin/%s' % head[len('refs/heads/'):]
+
+    def _fetch_narrowed(self, refspecs, filter_spec=None, *args, **kws):
+        """Fetches the narrowed refspecs, or all heads and tags if None."""
+        if refspecs is not None and not refspecs:
+            return 0
+
+        cli = list()
+        cli.append('origin')
+        cli.append('--progress')
+        if self.bare:
+            cli.append('--update-head-ok')
+        if filter_spec:
+            cli.append('--filter=%s' % filter_spec)
+
+        if refspecs is None:
+            # the heads of a non-bare repository are fetched into
+            # refs/remotes/origin/* like git-clone, where get_local_heads()
+            # reads them, but not into refs/heads/*
+            cli.append('--tags')
+            cli.append('+refs/heads/*:%s' % self._fetched_ref('refs/heads/*'))
+        else:
+            # read from the standard input not to exceed the limitation of
+            # the command line
+            cli.extend(['--no-tags', '--stdin'])
+            kws['stdin'] = '\n'.join(refspecs) + '\n'
+
+        cli.extend(args)
+        return self.fetch(*cli, **kws)
+
+    def get_remote_refs(self, remote=None, force=False):
+        """Returns the heads and tags of the remote shared in the process."""
+        def _ls_remote(url):
+            refs = dict()
+
+            def _list():
+                output = self.ls_remote('--heads', '--tags', url, stream=True)
+                refs.clear()
+                refs.update(_parse_remote_refs(output))
+
+                return output.returncode, output.get_error(), output.reason
+
+            ret = CommandPolicy.get('ls-remote').run(
+                _list, 'git ls-remote %s' % url)
+
+            return ret, refs
+
+        return _remote_refs.get(remote or self.remote, _ls_remote, force)
+
+    def get_remote_refs_async(self, executor, remote=None, force=False):
+        """Lists the heads and tags of the remote with the executor into the
+        references shared in the process. Returns the pending command, or
+        None if the references have been listed."""
+        url = remote or self.remote
+        if not force and _remote_refs.has(url):
+            return None
+
+        def _done(pending):
+            if pending.returncode == 0:
+                _remote_refs.put(
+                    url, _parse_remote_refs(pending.stdout.split('\n')))
+
+        pending = self._new_command().ls_remote_async(
+            executor, '--heads', '--tags', url)
+        pending.add_done_callback(_done)
+
+        return pending
+
     def get_remote_tags(self, remote=None):
-        tags = dict()
-        ret, result = self.ls_remote('--tags', remote or self.remote)
-        if ret == 0 and result:
-            for line in result.split('\n'):
-                sha1, tag = re.split(r'\s+', line, maxsplit=1)
-                tags[tag] = sha1
+        ret, refs = self.get_remote_refs(remote)
+        tags = dict(refs.prefixed('refs/tags/')) if refs else dict()
 
         return ret, tags
 
     def get_remote_heads(self, remote=None):
-        heads = dict()
+        ret, refs = self.get_remote_refs(remote)
+        heads = dict(refs.prefixed('refs/heads/')) if refs else dict()
 
-        ret, result = self.ls_remote('--heads', remote or self.remote)
-        if ret == 0 and result:
-            for line in result.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
+        return ret, heads
 
-                sha1, head = re.split(r'\s+', line, maxsplit=1)
-                heads[head] = sha1
+    def get_local_refs(self, force=False):
+        """Returns the snapshot of the local references."""
+        ret = 0
+        if force or self._local_refs is None:
+            output = self.for_each_ref(
+                '--format=%s' % _LocalRefs.FORMAT, stream=True)
+            refs = _LocalRefs(output)
+            ret = output.returncode
+            if ret != 0:
+                refs = _LocalRefs()
+                return ret, refs
 
-        return ret, heads
+            self._local_refs = refs
+
+        return ret, self._local_refs
 
     def get_local_heads(self, local=False):
         heads = dict()
-        ret, lines = self.branch('-lva')
+
+        ret, refs = self.get_local_refs()
         if ret == 0:
-            for line in lines.split('\n'):
-                line = line.strip()
-                if line.startswith('*'):
-                    if self.bare or local:
-                        line = line[1:].lstrip()
-                    else:
-                        continue
-                elif not line:
+            for head, sha1 in refs.heads().items():
+                if refs.head == 'refs/heads/%s' % head and not (
+                        self.bare or local):
                     continue
 
-                if line.startswith('(no branch)'):
-                    continue
+                heads[_secure_head_name(head)] = sha1
+                heads[head] = sha1
 
-                head = re.split(r'[\s]+', line, maxsplit=2)
-                if head[1] != '->':
-                    heads[_secure_head_name(head[0])] = head[1]
-                    heads[head[0]] = head[1]
+            for head, sha1 in refs.remotes().items():
+                head = 'remotes/%s' % head
+                heads[_secure_head_name(head)] = sha1
+                heads[head] = sha1
 
         return ret, heads
 
     def get_local_tags(self):
-        tags = list()
-        ret, lines = self.tag('--list')
-        if ret == 0:
-            for line in lines.split('\n'):
-                tags.append(line.strip())
+        ret, refs = self.get_local_refs()
 
-        return ret, tags
+        return ret, sorted(refs.tags().keys())
 
     @staticmethod
     def is_sha1(sha1):
         return re.match('^[0-9a-f]{6,40}$', sha1)
 
+    def get_object_store(self):
+        """Returns the reader of the objects and the references without
+        executing git."""
+        with self._lock:
+            if self._store is None:
+                self._store = ObjectStore(self.get_gitdir(), self.env)
+
+            return self._store
+
     def rev_existed(self, rev):
-        ret, _ = self.rev_parse(rev, capture_stderr=False)
+        if rev.startswith('refs/'):
+            _, refs = self.get_local_refs()
+            return refs.has(rev)
+
+        store = self.get_object_store()
+        if re.match('^([0-9a-f]{40}|[0-9a-f]{64})$', rev):
+            # the store answers the names of its own object format
+            existed = store.has_object(rev)
+        elif self.is_sha1(rev):
+            existed = None
+        else:
+            # git resolves more names like "git describe" outputs
+            existed = store.has_ref(rev) or None
+
+        if existed is not None:
+            return existed
+
+        return self.resolve_many([rev]).get(rev) is not None
+
+    def resolve_many(self, revs):
+        """Resolves the revisions to the SHA-1s, or None if not existed."""
+        results = dict()
+        while True:
+            with self._lock:
+                if self._cat_file is None:
+                    self._cat_file = GitCatFile(
+                        self.git, self.get_gitdir(), self.env)
+
+                cat_file = self._cat_file
+
+            results.update(cat_file.resolve_many(
+                [rev for rev in revs if rev not in results]))
+            # resolve the rest again if the project closed it meanwhile
+            if not cat_file.closed:
+                return results
+
+    def get_promisor(self):
+        """Returns the promisor remote if the repository is a partial clone,
+        which is read once until the repository is cloned again."""
+        if self._promisor is None:
+            self._promisor = self._read_promisor() or ''
+
+        return self._promisor or None
+
+    def _read_promisor(self):
+        ret, promisor = self.config('--get', 'extensions.partialClone')
+        if ret == 0 and promisor.strip():
+            return promisor.strip()
+
+        # newer git marks the remote instead of setting the extension
+        ret, output = self.config(
+            '--bool', '--get-regexp', r'^remote\..*\.promisor$')
+        for line in output.split('\n') if ret == 0 else list():
+            items = line.split()
+            if len(items) == 2 and items[1] == 'true':
+                return items[0][len('remote.'):-len('.promisor')]
+
+        return None
+
+    def fetch_missing(self, revs, exclude=None, jobs=None, *args, **kws):
+        """Fetches the objects missing in the partial clone in batches.
+
+        The objects reachable from the revisions but not from the excluded
+        ones are listed without fetching them one by one, and then requested
+        from the promisor remote in chunks until nothing is missing. The
+        chunks are fetched concurrently with the jobs, which only add packs
+        without updating the references."""
+        logger = Logger.get_logger()
+
+        promisor = self.get_promisor()
+        if not promisor or not revs:
+            return 0
 
-        return ret == 0
+        query = list(revs)
+        query.extend(['^%s' % sha1 for sha1 in exclude or list()])
 
-    def push_heads(self, branch=None, refs=None, push_all=False,  # pylint: disable=R0915
-                   fullname=False, force=False, sha1tag=None, *args, **kws):
+        missed = None
+        while True:
+            ret, output = self.rev_list(
+                '--objects', '--missing=print', '--stdin',
+                stdin='\n'.join(query) + '\n')
+            if ret != 0:
+                return ret
+
+            missing = set([line[1:].strip() for line in output.split('\n')
+                           if line.startswith('?')])
+            # the trees fetched in the last round might miss more objects
+            if not missing or missing == missed:
+                break
+
+            missed = missing
+            logger.info(
+                '%s: fetch %d missing object(s) from %s', self,
+                len(missing), promisor)
+            cli = [promisor, '--no-tags', '--no-write-fetch-head',
+                   '--recurse-submodules=no', '--stdin']
+            cli.extend(args)
+
+            chunks = list(
+                _split_refspecs(sorted(missing), _MISSING_CHUNK_SIZE))
+            if jobs and jobs > 1 and len(chunks) > 1:
+                executor = CommandExecutor(jobs)
+                pendings = [self.fetch_async(
+                    executor, stdin='\n'.join(sha1s) + '\n', *cli, **kws)
+                    for sha1s in chunks]
+                if executor.wait(pendings):
+                    return 1
+            else:
+                for sha1s in chunks:
+                    ret = self.fetch(
+                        stdin='\n'.join(sha1s) + '\n', *cli, **kws)
+                    if ret != 0:
+                        return ret
+
+        return 0
+
+    def _fetch_missing_objects(self, remote, refspecs, jobs=None):
+        if not self.get_promisor():
+            return 0
+
+        _, local_refs = self.get_local_refs()
+
+        revs = set()
+        for refspec in refspecs:
+            src = refspec.lstrip('+').split(':', 1)[0]
+            if '*' in src:
+                prefix = src[:src.index('*')]
+                revs.update([ref for ref in local_refs.refs
+                             if ref.startswith(prefix)])
+            elif src:
+                revs.add(src)
+
+        # the objects of the remote needn't be sent with the push
+        _, remote_refs = self.get_remote_refs(remote)
+        resolved = self.resolve_many(sorted(set(remote_refs.values())))
+
+        return self.fetch_missing(
+            sorted(revs), [sha1 for sha1 in sorted(resolved)
+                           if resolved[sha1]], jobs)
+
+    def push_refspecs(self, refspecs, remote=None, atomic=False,
+                      chunk=None, jobs=None, *args, **kws):
         logger = Logger.get_logger()
 
+        remote = remote or self.remote
+        if not kws.get('tryrun', self.tryrun):
+            ret = self._fetch_missing_objects(remote, refspecs, jobs)
+            if ret != 0:
+                logger.error('%s: failed to fetch the missing objects', self)
+                return ret
+
+        chunks = list(_split_refspecs(refspecs, chunk))
+        results = [0] * len(chunks)
+
+        def _cli(index):
+            cli = list()
+            if atomic:
+                cli.append('--atomic')
+
+            cli.append(remote)
+            cli.extend(chunks[index])
+            cli.extend(args)
+
+            return cli
+
+        def _done(index, res):
+            results[index] = res
+            if len(chunks) > 1:
+                logger.info(
+                    'batch %d/%d of %d reference(s) to %s: %s',
+                    index + 1, len(chunks), len(chunks[index]), remote,
+                    'failed' if res else 'done')
+
+        if jobs and jobs > 1 and len(chunks) > 1:
+            # the batches are pushed concurrently in the loop of the executor
+            executor = CommandExecutor(jobs)
+            pendings = [self._new_command().push_async(
+                executor, *_cli(index), **kws) for index in range(len(chunks))]
+
+            for index, pending in enumerate(pendings):
+                _done(index, pending.wait())
+        else:
+            cmd = self._new_command()
+            for index in range(len(chunks)):
+                _done(index, cmd.push(*_cli(index), **kws))
+
+        ret = 0
+        pushed = list()
+        for index, res in enumerate(results):
+            if res != 0:
+                logger.error(
+                    'error to push %d reference(s) to %s',
+                    len(chunks[index]), remote)
+                ret = res
+            else:
+                pushed.extend(chunks[index])
+
+        if pushed and not kws.get('tryrun', self.tryrun):
+            self._update_remote_refs(remote, pushed)
+
+        return ret
+
+    def _update_remote_refs(self, remote, refspecs):
+        updates = dict()
+        for refspec in refspecs:
+            src, dst = refspec.lstrip('+').split(':', 1)
+            if '*' in refspec:
+                _remote_refs.invalidate(remote)
+                return
+
+            updates[dst] = src
+
+        _, refs = self.get_local_refs()
+
+        resolved = dict()
+        for src in updates.values():
+            if refs.has(src):
+                resolved[src] = refs.get(src)
+            elif re.match('^[0-9a-f]{40}$', src):
+                resolved[src] = src
+
+        srcs = [src for src in updates.values()
+                if src and src not in resolved]
+        if srcs:
+            resolved.update(self.resolve_many(srcs))
+            if None in resolved.values():
+                _remote_refs.invalidate(remote)
+                return
+
+        for dst, src in updates.items():
+            updates[dst] = resolved.get(src)
+            # the peeled value would be advertised again by the remote
+            updates['%s^{}' % dst] = None
+
+        _remote_refs.update(remote, updates)
+
+    def get_journal(self, remote=None):
+        """Returns the journal of the references synchronized with the
+        remote."""
+        return PushJournal(self.get_gitdir(), remote or self.remote)
+
+    def _fingerprint(self, *args):
+        _, refs = self.get_local_refs()
+
+        digest = hashlib.sha1()
+        for ref in sorted(refs.refs):
+            digest.update('%s %s\n' % (refs.refs[ref], ref))
+
+        digest.update(repr(args))
+        digest.update(str(self.pattern))
+
+        return digest.hexdigest()
+
+    def _wildcard_heads(self, heads, fullname=False):
+        """Checks if the heads can be pushed with a wildcard refspec."""
+        if not self.bare:
+            return False
+        elif self.pattern.exists('r,rev,revision', name=self.uri):
+            return False
+
+        for head in heads:
+            if self.is_sha1(os.path.basename(head)):
+                return False
+            elif not fullname and '/' in head:
+                return False
+
+        return True
+
+    def plan_heads(self, branch=None, refs=None, push_all=False,
+                   fullname=False, force=False, sha1tag=None):
+        """Maps the local heads to the remote ones with the patterns."""
+        logger = Logger.get_logger()
+
+        fingerprint = self._fingerprint(
+            'heads', branch, refs, push_all, fullname, force, sha1tag)
+
         refs = refs and '%s/' % refs.rstrip('/')
         ret, local_heads = self.get_local_heads(local=True)
-        ret, remote_heads = self.get_remote_heads()
-        ret, remote_tags = self.get_remote_tags()
+        if push_all and self._wildcard_heads(local_heads, fullname):
+            logger.debug('push all heads with the wildcard refspec')
+            _, local_refs = self.get_local_refs()
+            return _PushPlan(
+                'heads', fingerprint,
+                wildcard='%srefs/heads/*:refs/heads/%s*' % (
+                    '+' if force else '', refs or ''),
+                refs=dict([('refs/heads/%s%s' % (refs or '', head), sha1)
+                           for head, sha1 in local_refs.heads().items()]))
 
         if not push_all:
             local_heads = {
                 branch or '': branch if self.is_sha1(branch) \
                     else local_heads.get(branch)}
 
+        plan = _PushPlan('heads', fingerprint)
         for origin in local_heads:
-            head = _secure_head_name(origin)
-            if not fullname:
-                head = os.path.basename(head)
-            if not head:
-                continue
-
-            if not self.pattern.match(
-                    'r,rev,revision', origin, name=self.uri):
-                logger.debug('"%s" do not match revision pattern', origin)
-                continue
-            elif not self.pattern.match('r,rev,revision', head, name=self.uri):
-                logger.debug('"%s" do not match revision pattern', head)
+            # filtered before resolving the local reference
+            if not self.map_head(origin, refs, fullname):
                 continue
 
             if self.is_sha1(origin) and self.rev_existed(origin):
@@ -241,121 +999,449 @@ class GitProject(Project, GitCommand):
                     logger.error('"%s" has no matched rev', origin)
                     continue
 
-            if not self.pattern.match(
-                    'r,rev,revision', local_ref, name=self.uri):
-                logger.debug('"%s" do not match revision pattern', local_ref)
+            remote_ref = self.map_head(origin, refs, fullname, local_ref)
+            if not remote_ref:
                 continue
 
-            rhead = self.pattern.replace(
-                'r,rev,revision', '%s' % head, name=self.uri)
-            if rhead != head:
-                rhead = '%s%s' % (refs or '', rhead)
-            else:
-                rhead = self.pattern.replace(
-                    'r,rev,revision', '%s%s' % (refs or '', head),
-                    name=self.uri)
-
-            skip = False
             sha1 = local_heads[origin]
-            remote_ref = 'refs/heads/%s' % rhead
             if os.path.basename(remote_ref) == sha1:
                 logger.warning(
                     "remote branch %s equals to an existed SHA-1, which "
                     "isn't normal. Ignoring ...", remote_ref)
-                skip = True
-            elif _sha1_equals(remote_heads.get(remote_ref), sha1):
-                logger.info('%s has been up-to-dated', remote_ref)
-                skip = True
-
-            ret = 0
-            if not skip:
-                ret = self.push(
-                    self.remote,
-                    '%s%s:%s' % (
-                        '+' if force else '', local_ref, remote_ref),
-                    *args, **kws)
-
-            if ret == 0 and not push_all and (
-                    sha1tag and self.is_sha1(origin)):
-                equals = False
-                if sha1tag in remote_tags:
-                    sha1 = remote_tags[sha1tag]
-                    equals = _sha1_equals(sha1, origin)
-
-                if not equals or force:
-                    ret = self.push(
-                        self.remote,
-                        '%s%s:refs/tags/%s' % (
-                            '+' if force else '', local_ref, sha1tag),
-                        *args, **kws)
+            else:
+                if remote_ref in plan.items:
+                    logger.debug(
+                        '%s is overridden with "%s"', remote_ref, local_ref)
 
-            if ret != 0:
-                logger.error('error to execute git push to %s', self.remote)
+                plan.add(remote_ref, local_ref, sha1)
 
-        return ret
+            if not push_all and (sha1tag and self.is_sha1(origin)):
+                plan.add(
+                    'refs/tags/%s' % sha1tag, local_ref, origin,
+                    _PushPlan.SHA1TAG)
 
-    def push_tags(self, tags=None, refs=None, force=False, fullname=False,
-                  *args, **kws):
-        logger = Logger.get_logger()
+        return plan
 
-        refs = refs and '%s/' % refs.rstrip('/')
-        ret, remote_tags = self.get_remote_tags()
+    def plan_tags(self, tags=None, refs=None, force=False, fullname=False):
+        """Maps the local tags to the remote ones with the patterns."""
+        fingerprint = self._fingerprint('tags', tags, refs, force, fullname)
 
         local_tags = list()
         if not tags:
-            ret, local_tags = self.get_local_tags()
+            _, local_tags = self.get_local_tags()
         elif isinstance(tags, (list, tuple)):
             local_tags.extend(tags)
         else:
             local_tags.append(tags)
 
+        _, local_refs = self.get_local_refs()
+
+        plan = _PushPlan('tags', fingerprint)
         for origin in local_tags:
-            tag = origin
-            if not fullname:
-                tag = os.path.basename(tag)
-            if not tag:
-                continue
+            remote_ref = self.map_tag(origin, refs, fullname)
+            if remote_ref:
+                plan.add(
+                    remote_ref, 'refs/tags/%s' % origin,
+                    local_refs.get('refs/tags/%s' % origin), _PushPlan.TAG)
 
-            if not self.pattern.match('t,tag,revision', origin, name=self.uri):
-                logger.debug('%s: "%s" not match tag pattern', origin, origin)
-                continue
-            elif not self.pattern.match('t,tag,revision', tag, name=self.uri):
-                logger.debug('%s: "%s" not match tag pattern', origin, tag)
-                continue
+        return plan
+
+    def map_head(self, origin, refs=None, fullname=False, local_ref=None):
+        """Returns the remote head of the local one with the prefix and the
+        patterns of the pushes, or None if it's filtered out."""
+        logger = Logger.get_logger()
+
+        head = _secure_head_name(origin)
+        if not fullname:
+            head = os.path.basename(head)
+        if not head:
+            return None
+
+        for name in (origin, head, local_ref):
+            if name and not self.pattern.match(
+                    'r,rev,revision', name, name=self.uri):
+                logger.debug('"%s" do not match revision pattern', name)
+                return None
+
+        refs = refs and '%s/' % refs.rstrip('/')
+        rhead = self.pattern.replace(
+            'r,rev,revision', '%s' % head, name=self.uri)
+        if rhead != head:
+            rhead = '%s%s' % (refs or '', rhead)
+        else:
+            rhead = self.pattern.replace(
+                'r,rev,revision', '%s%s' % (refs or '', head),
+                name=self.uri)
+
+        return 'refs/heads/%s' % rhead
+
+    def map_tag(self, origin, refs=None, fullname=False):
+        """Returns the remote tag of the local one with the prefix and the
+        patterns of the pushes, or None if it's filtered out."""
+        logger = Logger.get_logger()
 
+        tag = origin
+        if not fullname:
+            tag = os.path.basename(tag)
+        if not tag:
+            return None
+
+        for name in (origin, tag):
+            if not self.pattern.match('t,tag,revision', name, name=self.uri):
+                logger.debug('%s: "%s" not match tag pattern', origin, name)
+                return None
+
+        refs = refs and '%s/' % refs.rstrip('/')
+        rtag = self.pattern.replace(
+            't,tag,revision', '%s' % tag, name=self.uri)
+        if rtag != tag:
+            rtag = '%s%s' % (refs or '', rtag)
+        else:
             rtag = self.pattern.replace(
-                't,tag,revision', '%s' % tag, name=self.uri)
-            if rtag != tag:
-                rtag = '%s%s' % (refs or '', rtag)
-            else:
-                rtag = self.pattern.replace(
-                    't,tag,revision', '%s%s' % (refs or '', tag),
-                    name=self.uri)
-
-            remote_tag = 'refs/tags/%s' % rtag
-            if remote_tag in remote_tags:
-                equals = True
-                if force:
-                    sha1 = remote_tags[remote_tag]
-                    ret, lsha1 = self.rev_parse(origin)
-                    equals = _sha1_equals(sha1, lsha1)
-
-                if equals:
-                    logger.info('%s is up-to-date', remote_tag)
+                't,tag,revision', '%s%s' % (refs or '', tag),
+                name=self.uri)
+
+        return 'refs/tags/%s' % rtag
+
+    def _disk_usage(self, rev, exclude):
+        """Returns the disk usage of the objects, or None if it fails."""
+        ret, output = self.rev_list(
+            '--objects', '--disk-usage', '--stdin',
+            stdin='\n'.join([rev] + ['^%s' % sha1 for sha1 in exclude]) + '\n')
+        if ret != 0:
+            return None
+
+        try:
+            return int(output.strip() or 0)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _disable_step_size():
+        with GitProject._disk_usage_lock:
+            if GitProject._disk_usage_supported:
+                GitProject._disk_usage_supported = False
+                Logger.get_logger().warning(
+                    'git rev-list --disk-usage failed, the steps are split '
+                    'without the size (--push-step-size)')
+
+    def _step_commits(self, sha1, exclude, steps=None, step_size=None):
+        """Returns the first-parent commits to push in turn before the
+        head, which are at most steps commits or step_size MB apart."""
+        ret, output = self.rev_list(
+            '--first-parent', '--reverse', '--stdin',
+            stdin='\n'.join([sha1] + ['^%s' % s for s in exclude]) + '\n')
+        commits = output.split() if ret == 0 else list()
+
+        limit = step_size * 1024 * 1024 \
+            if step_size and GitProject._disk_usage_supported else None
+        stops = list()
+        start = 0
+        while start < len(commits) - 1:
+            end = min(start + steps, len(commits)) - 1 if steps \
+                else len(commits) - 1
+            if limit:
+                base = list(exclude) + stops[-1:]
+                # the longest step in the limitation but one commit at least
+                low, high = start, end
+                while low < high:
+                    middle = (low + high + 1) / 2
+                    usage = self._disk_usage(commits[middle], base)
+                    if usage is None:
+                        # fall back to the steps of the commit count
+                        GitProject._disable_step_size()
+                        limit, low = None, end
+                        break
+                    elif usage <= limit:
+                        low = middle
+                    else:
+                        high = middle - 1
+
+                end = low
+
+            if end >= len(commits) - 1:
+                break
+
+            stops.append(commits[end])
+            start = end + 1
+
+        return stops
+
+    def _push_steps(self, plan, remote, journal, remote_refs, *args, **kws):
+        """Pushes the new history of the heads in steps to the temporary
+        references, and records the last step to resume from it."""
+        logger = Logger.get_logger()
+
+        resolved = self.resolve_many(sorted(set(remote_refs.values())))
+        exclude = [sha1 for sha1 in sorted(resolved) if resolved[sha1]]
+
+        cmd = self._new_command()
+        for remote_ref, sha1 in sorted(plan.heads().items()):
+            if not sha1 or _sha1_equals(remote_refs.get(remote_ref), sha1):
+                continue
+
+            name = 'step:%s' % remote_ref
+            tmpref = '%s%s' % (_STEP_REF_PREFIX, remote_ref[len('refs/'):])
+
+            done = journal.refs(name).get(tmpref)
+            if journal.fingerprint(name) != sha1 or \
+                    not self.rev_existed(done):
+                done = None
+
+            stops = self._step_commits(
+                sha1, exclude + ([done] if done else list()),
+                plan.steps, plan.step_size)
+            for k, stop in enumerate(stops):
+                ret = cmd.push(remote, '+%s:%s' % (stop, tmpref), *args, **kws)
+                logger.info(
+                    'step %d/%d of %s to %s: %s', k + 1, len(stops),
+                    remote_ref, remote, 'failed' if ret else 'done')
+                if ret != 0:
+                    return ret
+
+                if not kws.get('tryrun', self.tryrun):
+                    journal.record(name, sha1, {tmpref: stop})
+
+        return 0
+
+    def _clean_steps(self, plan, remote, journal, *args, **kws):
+        tmprefs = list()
+        for remote_ref in sorted(plan.heads()):
+            name = 'step:%s' % remote_ref
+            if journal.fingerprint(name):
+                tmprefs.extend(journal.refs(name).keys())
+                journal.discard(name)
+
+        if tmprefs:
+            ret = self._new_command().push(
+                remote, *([':%s' % ref for ref in tmprefs] + list(args)),
+                **kws)
+            if ret != 0:
+                Logger.get_logger().warning(
+                    'failed to remove the temporary references from %s',
+                    remote)
+
+    def _push_plan_to(self, plan, remote, force=False, atomic=False,
+                      chunk=None, jobs=None, verify=False, *args, **kws):
+        logger = Logger.get_logger()
+
+        journal = self.get_journal(remote)
+        if not verify and journal.fingerprint(plan.name) == plan.fingerprint:
+            logger.info(
+                '%s unchanged since the last push to %s, skipped',
+                plan.name, remote)
+            return 0
+
+        stepped = plan.steps or plan.step_size
+        if stepped:
+            _, remote_refs = self.get_remote_refs(remote)
+            ret = self._push_steps(
+                plan, remote, journal, remote_refs, *args, **kws)
+            if ret != 0:
+                logger.error(
+                    '%s: failed to push in steps, retry to resume', remote)
+                return ret
+
+        if plan.wildcard:
+            pushed = plan.refs
+            ret = self.push_refspecs(
+                [plan.wildcard], remote, atomic, chunk, jobs, *args, **kws)
+        else:
+            _, remote_refs = self.get_remote_refs(remote)
+
+            # compare the full SHA-1s with the remote in a single pass, and
+            # the abbreviated or absent ones one by one
+            full = dict([(ref, item[1]) for ref, item in plan.items.items()
+                         if item[1] and len(item[1]) == 40])
+            absent, changed = RefStore(full).diff(remote_refs)
+            absent, changed = set(absent), set(changed)
+
+            pushed = dict()
+            refspecs = list()
+            for remote_ref in sorted(plan.items):
+                local_ref, sha1, kind = plan.items[remote_ref]
+                pushed[remote_ref] = sha1
+
+                if remote_ref in full:
+                    existed = remote_ref not in absent
+                    equal = existed and remote_ref not in changed
+                else:
+                    current = remote_refs.get(remote_ref)
+                    existed = current is not None
+                    equal = _sha1_equals(current, sha1)
+
+                if kind == _PushPlan.TAG:
+                    # the existed tag isn't updated without the force
+                    uptodate = existed and (not force or equal)
+                elif kind == _PushPlan.SHA1TAG:
+                    uptodate = not force and equal
+                else:
+                    uptodate = equal
+
+                if uptodate:
+                    logger.info('%s is up-to-date', remote_ref)
                     continue
 
-            ret = self.push(
-                self.remote,
-                '%srefs/tags/%s:%s' % (
-                    '+' if force else '', origin, remote_tag),
+                refspecs.append('%s%s:%s' % (
+                    '+' if force else '', local_ref, remote_ref))
+
+            ret = self.push_refspecs(
+                refspecs, remote, atomic, chunk, jobs, *args, **kws)
+
+        if ret == 0 and not kws.get('tryrun', self.tryrun):
+            journal.record(plan.name, plan.fingerprint, pushed)
+            if stepped:
+                self._clean_steps(plan, remote, journal, *args, **kws)
+
+        return ret
+
+    def push_plan(self, plan, remotes=None, force=False, atomic=False,
+                  chunk=None, jobs=None, verify=False, *args, **kws):
+        """Pushes the planned references to the remotes concurrently.
+
+        The result of each remote is kept in push_results."""
+        logger = Logger.get_logger()
+
+        remotes = remotes or [self.remote]
+        results = dict()
+
+        def _push(remote):
+            Logger.get_logger(logger.name)
+            results[remote] = self._push_plan_to(
+                plan, remote, force, atomic, chunk, jobs, verify,
                 *args, **kws)
 
+        if len(remotes) > 1:
+            threads = list()
+            for remote in remotes:
+                thread = threading.Thread(target=_push, args=(remote,))
+                threads.append(thread)
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+        else:
+            _push(remotes[0])
+
+        ret = 0
+        for remote in remotes:
+            # the thread might be broken with an exception
+            res = results.get(remote, 1)
+            self.push_results.setdefault(remote, dict())[plan.name] = res
+            if res != 0:
+                logger.error('%s: cannot push %s', remote, plan.name)
+                ret = res
+
+        return ret
+
+    def push_summary(self):
+        """Returns the lines of the push results per remote."""
+        lines = list()
+        for remote in sorted(self.push_results):
+            results = self.push_results[remote]
+            lines.append('%s: %s' % (remote, ', '.join(
+                ['%s %s' % (name, 'failed' if results[name] else 'done')
+                 for name in sorted(results)])))
+
+        return lines
+
+    def push_heads(self, branch=None, refs=None, push_all=False,
+                   fullname=False, force=False, sha1tag=None, atomic=False,
+                   chunk=None, verify=False, remotes=None, steps=None,
+                   step_size=None, *args, **kws):
+        plan = self.plan_heads(
+            branch, refs, push_all, fullname, force, sha1tag)
+        plan.steps = steps
+        plan.step_size = step_size
+
+        return self.push_plan(
+            plan, remotes, force, atomic, chunk, None, verify, *args, **kws)
+
+    def push_tags(self, tags=None, refs=None, force=False, fullname=False,
+                  chunk=None, jobs=None, verify=False, remotes=None,
+                  *args, **kws):
+        plan = self.plan_tags(tags, refs, force, fullname)
+
+        return self.push_plan(
+            plan, remotes, force, False, chunk, jobs, verify, *args, **kws)
+
+    def export_bundle(self, filename, *args, **kws):
+        """Writes the references not pushed to the remote into the bundle.
+
+        It returns the result, the exported references and the SHA-1s taken
+        as the prerequisites of the bundle."""
+        logger = Logger.get_logger()
+
+        _, refs = self.get_local_refs()
+        exported = dict()
+        for ref, sha1 in refs.refs.items():
+            if ref in refs.symrefs:
+                continue
+            elif ref.startswith(('refs/heads/', 'refs/remotes/',
+                                 'refs/tags/')):
+                exported[ref] = sha1
+
+        journal = self.get_journal()
+        # the pushed SHA-1s may be absent after the history is rewritten
+        resolved = self.resolve_many(sorted(set(journal.refs().values())))
+        basis = sorted([sha1 for sha1 in resolved if resolved[sha1]])
+        if not set(exported.values()) - set(basis):
+            logger.info('no new references to export')
+            return 0, dict(), basis
+
+        revs = sorted(exported.keys())
+        revs.extend(['^%s' % sha1 for sha1 in basis])
+        ret, _ = self.bundle(
+            'create', filename, '--stdin', stdin='\n'.join(revs) + '\n',
+            *args, **kws)
+        if ret == 0 and not kws.get('tryrun', self.tryrun):
+            journal.record('bundle', self._fingerprint('bundle'), exported)
+
+        return ret, exported, basis
+
+    def import_bundle(self, filename, *args, **kws):
+        """Fetches the references from the bundle into the repository."""
+        gitdir = self.get_gitdir()
+        if not gitdir or not os.path.exists(os.path.join(gitdir, 'HEAD')):
+            ret = self.init(self.bare, self.gitdir if self.bare
+                            else self.worktree)
             if ret != 0:
-                logger.error(
-                    '%s: cannot push tag "%s"', self.remote, remote_tag)
+                return ret
+
+        try:
+            ret, _ = self.bundle('verify', filename)
+            if ret != 0 and self.remote:
+                # the prerequisites have been pushed to the remote previously
+                self.fetch(
+                    self.remote, '--no-tags',
+                    '+refs/heads/*:%sheads/*' % _BUNDLE_REF_PREFIX,
+                    '+refs/tags/*:%stags/*' % _BUNDLE_REF_PREFIX)
+                ret, _ = self.bundle('verify', filename)
+
+            if ret == 0:
+                ret = self.fetch(
+                    filename, '--update-head-ok', '--no-tags',
+                    '+refs/heads/*:refs/heads/*',
+                    '+refs/remotes/*:refs/remotes/*',
+                    '+refs/tags/*:refs/tags/*', *args, **kws)
+        finally:
+            self._clean_bundle_refs()
 
         return ret
 
+    def _clean_bundle_refs(self):
+        # the fetched remote references only serve as the prerequisites
+        _, refs = self.get_local_refs(force=True)
+        tmprefs = sorted(
+            [ref for ref, _ in refs.refs.prefixed(_BUNDLE_REF_PREFIX)])
+        if tmprefs:
+            ret, _ = self.update_ref(
+                '--stdin', stdin=''.join(
+                    ['delete %s\n' % ref for ref in tmprefs]))
+            if ret != 0:
+                Logger.get_logger().warning(
+                    'failed to remove the temporary references of the bundle')
+
     def init_or_download(self, revision='master', single_branch=True,
                          offsite=False):
         logger = Logger.get_logger()
@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+from git_cmd import GitCatFile, GitCommand
+from logger import Logger
+
+
+class ObjectPool(object):
+    """\
+Shares the objects of the related repositories in a pool directory.
+
+Each pool is a bare repository named with a root commit of the histories it
+holds. A repository takes the pool holding the most of its heads, or the pool
+of its root commits if none holds them. The repositories borrow the objects
+with git alternates, and keep their references in the pool under
+"refs/krep/<id>/" so that the borrowed objects are never dropped when the pool
+is repacked."""
+
+    # days between the full repacks of a pool by default
+    REPACK_DAYS = 7
+    STAMP = 'krep-repack.stamp'
+
+    _lock = threading.Lock()
+    _locks = dict()
+
+    def __init__(self, dirname, repack_days=None):
+        self.dirname = os.path.realpath(dirname)
+        self.repack_days = ObjectPool.REPACK_DAYS \
+            if repack_days is None else repack_days
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--object-pool') or \
+            optparse.add_option_group('Object pool options')
+        options.add_option(
+            '--object-pool',
+            dest='object_pool', action='store', metavar='DIR',
+            help='Set the directory of the object pools. The new clones '
+                 'borrow the objects from the pool with the same root '
+                 'commits and share their objects into it')
+        options.add_option(
+            '--object-pool-repack',
+            dest='object_pool_repack', action='store', type='int',
+            metavar='DAYS',
+            help='Set the days between the full repacks of a pool, '
+                 'default: %d' % ObjectPool.REPACK_DAYS)
+
+    def _thread_lock(self, gitdir):
+        with ObjectPool._lock:
+            return ObjectPool._locks.setdefault(gitdir, threading.Lock())
+
+    def _run_locked(self, gitdir, func, *args):
+        # both the threads and the other krep processes share the pools
+        with self._thread_lock(gitdir):
+            with open(os.path.join(gitdir, 'krep-pool.lock'), 'a') as fp:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+                try:
+                    return func(*args)
+                finally:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def pools(self):
+        pools = list()
+        if os.path.isdir(self.dirname):
+            for name in sorted(os.listdir(self.dirname)):
+                gitdir = os.path.join(self.dirname, name)
+                if name.endswith('.git') and \
+                        os.path.exists(os.path.join(gitdir, 'HEAD')):
+                    pools.append(gitdir)
+
+        return pools
+
+    def _select(self, project, sha1s):
+        """Returns the pool holding the most of the SHA-1s."""
+        if not sha1s:
+            return None
+
+        best, count = None, 0
+        for gitdir in self.pools():
+            cat_file = GitCatFile(project.git, gitdir, project.env)
+            try:
+                resolved = cat_file.resolve_many(sha1s)
+            finally:
+                cat_file.close()
+
+            hits = len([sha1 for sha1 in sha1s if resolved.get(sha1)])
+            if hits > count:
+                best, count = gitdir, hits
+
+        return best
+
+    def reference(self, project, url=None):
+        """Returns the pool holding the most advertised heads of the url."""
+        _, refs = project.get_remote_refs(url)
+
+        return self._select(project, sorted(set(refs.values())))
+
+    def _roots(self, project):
+        ret, output = project.rev_list('--max-parents=0', '--all')
+        if ret != 0:
+            return list()
+
+        return sorted([line.strip() for line in output.split('\n')
+                       if line.strip()])
+
+    def _init(self, gitdir):
+        if not os.path.exists(os.path.join(gitdir, 'HEAD')):
+            if not os.path.exists(self.dirname):
+                os.makedirs(self.dirname)
+
+            GitCommand(gitdir, gitdir).init('--bare', gitdir, notdir=True)
+
+    def share(self, project):
+        """Moves the objects of the project into the pool holding the most
+        of its heads like reference(), or the pool of its roots."""
+        logger = Logger.get_logger()
+
+        roots = self._roots(project)
+        if not roots:
+            return 0
+
+        # the pool referenced by the clone is selected again not to borrow
+        # the objects from two pools
+        _, local = project.get_local_refs(force=True)
+        sha1s = set()
+        for ref, sha1 in local.refs.items():
+            if ref not in local.symrefs and ref.startswith(
+                    ('refs/heads/', 'refs/remotes/', 'refs/tags/')):
+                sha1s.add(sha1)
+                if ref in local.peeled:
+                    sha1s.add(local.peeled[ref])
+
+        gitdir = self._select(project, sorted(sha1s))
+        if gitdir is None:
+            for root in roots:
+                gitdir = os.path.join(self.dirname, '%s.git' % root)
+                if os.path.exists(os.path.join(gitdir, 'HEAD')):
+                    break
+            else:
+                gitdir = os.path.join(self.dirname, '%s.git' % roots[0])
+                self._init(gitdir)
+
+        pdir = os.path.realpath(project.get_gitdir())
+        pid = hashlib.sha1(pdir).hexdigest()[:16]
+
+        def _fetch():
+            pool = GitCommand(gitdir, gitdir)
+            return pool.fetch(
+                pdir, '--no-tags', '--quiet',
+                '+refs/*:refs/krep/%s/*' % pid)
+
+        ret = self._run_locked(gitdir, _fetch)
+        if ret != 0:
+            logger.error('%s: failed to share into %s', project, gitdir)
+            return ret
+
+        objects = os.path.join(gitdir, 'objects')
+        alternates = os.path.join(pdir, 'objects', 'info', 'alternates')
+        existed = list()
+        if os.path.exists(alternates):
+            with open(alternates, 'r') as fp:
+                existed = [line.strip() for line in fp if line.strip()]
+
+        if objects not in existed:
+            if not os.path.exists(os.path.dirname(alternates)):
+                os.makedirs(os.path.dirname(alternates))
+
+            with open(alternates, 'a') as fp:
+                fp.write('%s\n' % objects)
+
+        # drop the local objects which could be borrowed from the pool
+        ret = project.repack('-a', '-d', '-l', '-q')
+        if ret == 0:
+            logger.info('%s: borrowed objects from %s', project, gitdir)
+            self.repack(gitdir)
+
+        return ret
+
+    def repack(self, gitdir, force=False):
+        """Repacks the pool if the last full repack is out of date."""
+        stamp = os.path.join(gitdir, ObjectPool.STAMP)
+        if not force and os.path.exists(stamp) and \
+                time.time() - os.path.getmtime(stamp) < \
+                self.repack_days * 86400:
+            return 0
+
+        def _repack():
+            ret = GitCommand(gitdir, gitdir).repack('-a', '-d', '-q')
+            if ret == 0:
+                with open(stamp, 'w') as fp:
+                    fp.write('%d\n' % time.time())
+
+            return ret
+
+        return self._run_locked(gitdir, _repack)
+
+
+TOPIC_ENTRY = 'ObjectPool'
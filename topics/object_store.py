@@ -0,0 +1,295 @@
+import binascii
+import mmap
+import os
+import struct
+import threading
+
+
+class _PackIndex(object):
+    """Looks up the object names in a pack index of version 2."""
+    MAGIC = '\377tOc'
+
+    def __init__(self, filename, rawsize=20):
+        self.filename = filename
+        self.rawsize = rawsize
+        self.data = None
+        self.fanout = None
+
+        with open(filename, 'rb') as fp:
+            # mmap fails with an empty file, which is invalid anyway
+            if os.fstat(fp.fileno()).st_size >= 8 + 256 * 4:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data is not None and self.data[:4] == _PackIndex.MAGIC and \
+                struct.unpack('>I', self.data[4:8])[0] == 2:
+            self.fanout = struct.unpack('>256I', self.data[8:8 + 256 * 4])
+
+    def valid(self):
+        return self.fanout is not None
+
+    def has(self, binsha):
+        first = ord(binsha[0])
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+
+        offset = 8 + 256 * 4
+        while low < high:
+            middle = (low + high) / 2
+            start = offset + middle * self.rawsize
+            value = self.data[start:start + self.rawsize]
+            if value < binsha:
+                low = middle + 1
+            elif value > binsha:
+                high = middle
+            else:
+                return True
+
+        return False
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+class _Objects(object):
+    """Finds the objects in an object directory and its alternates."""
+    def __init__(self, objdir, rawsize=20, depth=0):
+        self.objdir = objdir
+        self.rawsize = rawsize
+        self.packdir = os.path.join(objdir, 'pack')
+        self.indexes = dict()
+        self.mtime = None
+        self.alternates = list()
+        self.supported = True
+
+        alternates = os.path.join(objdir, 'info', 'alternates')
+        if os.path.exists(alternates):
+            with open(alternates, 'r') as fp:
+                for line in fp:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    # the quoted path isn't parsed but left to git
+                    elif line.startswith('"') or depth >= 5:
+                        self.supported = False
+                        continue
+
+                    path = os.path.normpath(os.path.join(objdir, line))
+                    self.alternates.append(
+                        _Objects(path, rawsize, depth + 1))
+
+        for alternate in self.alternates:
+            self.supported &= alternate.supported
+
+    def _scan(self):
+        try:
+            mtime = os.path.getmtime(self.packdir)
+        except OSError:
+            return False
+
+        if mtime == self.mtime:
+            return False
+
+        names = set([name for name in os.listdir(self.packdir)
+                     if name.endswith('.idx')])
+        for name in list(self.indexes.keys()):
+            if name not in names:
+                self.indexes.pop(name).close()
+
+        for name in names:
+            if name not in self.indexes:
+                index = _PackIndex(
+                    os.path.join(self.packdir, name), self.rawsize)
+                if not index.valid():
+                    self.supported = False
+
+                self.indexes[name] = index
+
+        self.mtime = mtime
+        return True
+
+    def _find(self, sha1, binsha):
+        if os.path.exists(os.path.join(self.objdir, sha1[:2], sha1[2:])):
+            return True
+
+        for index in self.indexes.values():
+            if index.valid() and index.has(binsha):
+                return True
+
+        return False
+
+    def has(self, sha1, binsha):
+        if self.mtime is None:
+            self._scan()
+
+        if self._find(sha1, binsha):
+            return True
+        # the objects might be packed since the last scan
+        elif self._scan() and self._find(sha1, binsha):
+            return True
+
+        for alternate in self.alternates:
+            if alternate.has(sha1, binsha):
+                return True
+
+        # a pack installed within the same mtime of the directory might be
+        # missed by the scan, so only the found object is certain
+        return None
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
+
+        self.indexes = dict()
+        self.mtime = None
+        for alternate in self.alternates:
+            alternate.close()
+
+
+class ObjectStore(object):
+    """\
+Reads the objects and the references of a repository without git.
+
+It checks the loose objects, the pack indexes of version 2 with the
+alternates, the loose references and packed-refs of a SHA-1 or SHA-256
+repository. None is returned for the questions it cannot answer for sure,
+like a repository with reftable, an old pack index, an unknown object format
+or the objects directory overridden in the environment, and the caller asks
+git instead."""
+
+    # the sizes of the binary object names
+    FORMATS = {'sha1': 20, 'sha256': 32}
+
+    # the prefixes to resolve a short reference name like git
+    DWIM = ('%s', 'refs/%s', 'refs/tags/%s', 'refs/heads/%s',
+            'refs/remotes/%s', 'refs/remotes/%s/HEAD')
+
+    def __init__(self, gitdir, env=None):
+        self.gitdir = gitdir
+        self.lock = threading.Lock()
+        self.packed = None
+        self.packed_mtime = None
+
+        env = env if env is not None else os.environ
+        self.supported = bool(gitdir) and os.path.isdir(gitdir) and \
+            not os.path.exists(os.path.join(gitdir, 'commondir')) and \
+            not env.get('GIT_OBJECT_DIRECTORY') and \
+            not env.get('GIT_ALTERNATE_OBJECT_DIRECTORIES')
+        self.rawsize = ObjectStore.FORMATS.get(
+            ObjectStore._object_format(gitdir)) if self.supported else None
+        self.supported = self.supported and self.rawsize is not None
+        self.refs_supported = self.supported and \
+            not os.path.exists(os.path.join(gitdir, 'reftable'))
+
+        self.objects = None
+        if self.supported:
+            self.objects = _Objects(
+                os.path.join(gitdir, 'objects'), self.rawsize)
+
+    @staticmethod
+    def _object_format(gitdir):
+        """Returns extensions.objectFormat of the config, "sha1" if unset,
+        or None if the config cannot be read."""
+        filename = os.path.join(gitdir, 'config')
+        if not os.path.isfile(filename):
+            return None
+
+        section, value = None, 'sha1'
+        with open(filename, 'r') as fp:
+            for line in fp:
+                line = line.split('#')[0].split(';')[0].strip()
+                if line.startswith('['):
+                    section = line.strip('[]').strip().lower()
+                elif section == 'extensions' and '=' in line:
+                    key, val = line.split('=', 1)
+                    if key.strip().lower() == 'objectformat':
+                        value = val.strip().strip('"').lower()
+
+        return value
+
+    def has_object(self, sha1):
+        """Returns True if the object of the full name exists, or None if
+        it isn't found and git is asked instead."""
+        if not self.supported or not self.objects.supported:
+            return None
+
+        sha1 = sha1.lower()
+        try:
+            binsha = binascii.unhexlify(sha1)
+        except TypeError:
+            return None
+
+        if len(binsha) != self.rawsize:
+            return None
+
+        with self.lock:
+            return self.objects.has(sha1, binsha)
+
+    def _packed_refs(self):
+        filename = os.path.join(self.gitdir, 'packed-refs')
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return dict()
+
+        if mtime != self.packed_mtime:
+            packed = dict()
+            with open(filename, 'r') as fp:
+                for line in fp:
+                    if line.startswith('#') or line.startswith('^'):
+                        continue
+
+                    items = line.split()
+                    if len(items) == 2:
+                        packed[items[1]] = items[0]
+
+            self.packed, self.packed_mtime = packed, mtime
+
+        return self.packed
+
+    def read_ref(self, ref, depth=0):
+        """Returns the SHA-1 of the full reference name, '' if it doesn't
+        exist, or None if unknown."""
+        if not self.refs_supported or depth > 5:
+            return None
+
+        filename = os.path.join(self.gitdir, ref)
+        if os.path.isfile(filename):
+            with open(filename, 'r') as fp:
+                content = fp.read().strip()
+
+            if content.startswith('ref:'):
+                return self.read_ref(content[4:].strip(), depth + 1)
+            elif len(content) == self.rawsize * 2:
+                return content
+            else:
+                return None
+        elif os.path.isdir(filename):
+            return ''
+
+        with self.lock:
+            return self._packed_refs().get(ref, '')
+
+    def has_ref(self, name):
+        """Returns if the short or full reference name exists, or None."""
+        if not self.refs_supported or not name or \
+                [c for c in '^~:?*[\\@ ' if c in name]:
+            return None
+
+        for pattern in ObjectStore.DWIM:
+            sha1 = self.read_ref(pattern % name)
+            if sha1 is None:
+                return None
+            elif sha1:
+                return True
+
+        return False
+
+    def close(self):
+        if self.objects is not None:
+            with self.lock:
+                self.objects.close()
+
+
+TOPIC_ENTRY = 'ObjectStore'
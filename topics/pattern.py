@@ -302,6 +302,13 @@ matching.
     def __len__(self):
         return len(self.categories)
 
+    def __str__(self):
+        items = list()
+        for category in self.categories.values():
+            items.extend([str(item) for item in category.values()])
+
+        return '\n'.join(sorted(items))
+
     @staticmethod
     def options(optparse):
         options = optparse.get_option_group('--job') or \
@@ -382,6 +389,13 @@ matching.
     def get(self):
         return self.categories
 
+    def exists(self, categories, name=None):
+        for category in categories.split(','):
+            if self._ensure_item(category, name):
+                return True
+
+        return False
+
     def match(self, categories, value, name=None):
         ret = False
         existed = False
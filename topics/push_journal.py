@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+
+class PushJournal(object):
+    """Records the references pushed to a remote successfully.
+
+The journal is saved in the git directory per remote. Each entry with a name
+like "heads" or "tags" holds the fingerprint of the local references and the
+pushed references with their SHA-1s."""
+
+    def __init__(self, gitdir, remote):
+        self.remote = remote
+        self.entries = None
+        if gitdir and remote:
+            self.filename = os.path.join(
+                gitdir, 'krep', 'journal',
+                '%s.json' % hashlib.sha1(remote).hexdigest())
+        else:
+            self.filename = None
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = dict()
+            if self.filename and os.path.exists(self.filename):
+                try:
+                    with open(self.filename, 'r') as fp:
+                        vals = json.load(fp)
+
+                    if vals.get('remote') == self.remote:
+                        self.entries = vals.get('entries') or dict()
+                except (IOError, ValueError):
+                    pass
+
+        return self.entries
+
+    def fingerprint(self, name):
+        return (self._load().get(name) or dict()).get('fingerprint')
+
+    def refs(self, name=None):
+        refs = dict()
+        for key, entry in self._load().items():
+            if name is None or key == name:
+                refs.update(entry.get('refs') or dict())
+
+        return refs
+
+    def record(self, name, fingerprint, refs):
+        entries = self._load()
+        entries[name] = {'fingerprint': fingerprint, 'refs': refs}
+
+        self._save(entries)
+
+    def discard(self, name):
+        entries = self._load()
+        if entries.pop(name, None) is not None:
+            self._save(entries)
+
+    def _save(self, entries):
+        if not self.filename:
+            return
+
+        dirname = os.path.dirname(self.filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # write to a temporary file first not to leave a broken journal
+        tmpname = '%s.tmp' % self.filename
+        with open(tmpname, 'w') as fp:
+            json.dump({'remote': self.remote, 'entries': entries}, fp,
+                      indent=2, sort_keys=True)
+
+        os.rename(tmpname, self.filename)
+
+
+TOPIC_ENTRY = 'PushJournal'
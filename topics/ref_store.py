@@ -0,0 +1,108 @@
+import binascii
+import bisect
+
+
+class RefStore(object):
+    """\
+Holds the references compactly in the sorted parallel arrays.
+
+The names are interned and kept sorted in a list, and the SHA-1s are packed
+as the binary values of the same order in a single string. It's read like a
+dict, and two stores are compared in a single merge pass."""
+
+    __slots__ = ('names', 'sha1s', 'width')
+
+    def __init__(self, refs=None):
+        items = sorted((refs or dict()).items())
+
+        self.names = [intern(str(name)) for name, _ in items]
+        self.width = len(items[0][1]) / 2 if items else 20
+        for name, sha1 in items:
+            if len(sha1) != self.width * 2:
+                raise ValueError('%s: invalid object name "%s"' % (name, sha1))
+
+        self.sha1s = binascii.unhexlify(''.join([sha1 for _, sha1 in items]))
+
+    def _index(self, name):
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return index
+
+        return -1
+
+    def _binsha(self, index):
+        return self.sha1s[index * self.width:(index + 1) * self.width]
+
+    def _sha1(self, index):
+        return binascii.hexlify(self._binsha(index))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return self._index(name) >= 0
+
+    def __getitem__(self, name):
+        index = self._index(name)
+        if index < 0:
+            raise KeyError(name)
+
+        return self._sha1(index)
+
+    def get(self, name, default=None):
+        index = self._index(name)
+        return self._sha1(index) if index >= 0 else default
+
+    def keys(self):
+        return list(self.names)
+
+    def values(self):
+        return [self._sha1(k) for k in range(len(self.names))]
+
+    def items(self):
+        return [(name, self._sha1(k)) for k, name in enumerate(self.names)]
+
+    def prefixed(self, prefix):
+        """Returns the items of the names with the prefix."""
+        start = bisect.bisect_left(self.names, prefix)
+        items = list()
+        for k in range(start, len(self.names)):
+            if not self.names[k].startswith(prefix):
+                break
+
+            items.append((self.names[k], self._sha1(k)))
+
+        return items
+
+    def diff(self, other):
+        """Returns the names absent in the other store and the ones with
+        the different SHA-1s, which is merged in a single pass."""
+        if not isinstance(other, RefStore):
+            other = RefStore(other)
+
+        absent, changed = list(), list()
+        # the stores of the different hash algorithms never match
+        same = self.width == other.width
+
+        i, j = 0, 0
+        while i < len(self.names):
+            if j >= len(other.names) or self.names[i] < other.names[j]:
+                absent.append(self.names[i])
+                i += 1
+            elif self.names[i] > other.names[j]:
+                j += 1
+            else:
+                binsha = other._binsha(j)  # pylint: disable=W0212
+                if not same or self._binsha(i) != binsha:
+                    changed.append(self.names[i])
+
+                i += 1
+                j += 1
+
+        return absent, changed
+
+
+TOPIC_ENTRY = 'RefStore'
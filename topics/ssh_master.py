@@ -0,0 +1,147 @@
+import atexit
+import os
+import pipes
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import urlparse
+
+from contextlib import contextmanager
+
+from files.file_utils import FileUtils
+
+
+class SshMaster(object):
+    """\
+Shares an ssh connection per host with the ssh ControlMaster.
+
+Once enabled, the git commands run with GIT_SSH_COMMAND and the Gerrit
+commands with the ssh options to connect through the master of the host,
+which is started by the first session and kept for a while after the last
+one. The concurrent sessions per host are limited not to exceed MaxSessions
+of sshd, and the masters are stopped when the process exits."""
+
+    # sshd accepts 10 sessions per connection by default
+    SESSIONS = 8
+    # seconds to keep an idle master if the process is killed
+    PERSIST = 60
+
+    _lock = threading.Lock()
+    _dirname = None
+    _sessions = SESSIONS
+    _semaphores = dict()
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--ssh-multiplex') or \
+            optparse.add_option_group('Ssh options')
+        options.add_option(
+            '--ssh-multiplex',
+            dest='ssh_multiplex', action='store_true',
+            help='Share an ssh connection per host for git and Gerrit')
+        options.add_option(
+            '--ssh-sessions',
+            dest='ssh_sessions', action='store', type='int',
+            metavar='COUNT',
+            help='Set the concurrent sessions of a shared connection, '
+                 'default: %d' % SshMaster.SESSIONS)
+
+    @staticmethod
+    def enable(sessions=None):
+        with SshMaster._lock:
+            if sessions:
+                SshMaster._sessions = sessions
+
+            if SshMaster._dirname is None:
+                # keep the socket path short for the limitation of unix
+                SshMaster._dirname = tempfile.mkdtemp(prefix='krep-ssh-')
+                atexit.register(SshMaster.cleanup)
+
+    @staticmethod
+    def enabled():
+        return SshMaster._dirname is not None
+
+    @staticmethod
+    def ssh_options():
+        if not SshMaster.enabled():
+            return list()
+
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s' % os.path.join(
+                    SshMaster._dirname, '%C'),
+                '-o', 'ControlPersist=%d' % SshMaster.PERSIST]
+
+    @staticmethod
+    def ssh_command(command=None):
+        """Returns the command of GIT_SSH_COMMAND with the master, which is
+        run by the shell with the quoted options."""
+        return ' '.join([command or 'ssh'] + [
+            pipes.quote(option) for option in SshMaster.ssh_options()])
+
+    @staticmethod
+    def hosts(args):
+        """Returns the ssh hosts of the urls in the arguments."""
+        hosts = set()
+        for arg in args:
+            arg = str(arg)
+            if arg.startswith('ssh://') or arg.startswith('git+ssh://'):
+                ulp = urlparse.urlparse(arg)
+                hosts.add('%s:%s' % (ulp.hostname, ulp.port or 22))
+            else:
+                # the scp-like syntax, which needs a user not to be confused
+                # with the refspecs
+                mo = re.match(r'^[\w.\-]+@(?P<host>[\w.\-]+):', arg)
+                if mo:
+                    hosts.add('%s:22' % mo.group('host'))
+
+        return sorted(hosts)
+
+    @staticmethod
+    def _semaphore(host):
+        with SshMaster._lock:
+            return SshMaster._semaphores.setdefault(
+                host, threading.BoundedSemaphore(SshMaster._sessions))
+
+    @staticmethod
+    @contextmanager
+    def sessions(hosts):
+        """Holds a session of each host during the command."""
+        semaphores = list()
+        if SshMaster.enabled():
+            # acquired in order not to deadlock with the multiple hosts
+            semaphores = [SshMaster._semaphore(host) for host in hosts]
+
+        for semaphore in semaphores:
+            semaphore.acquire()
+
+        try:
+            yield
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+
+    @staticmethod
+    def cleanup():
+        """Stops the masters and removes the sockets."""
+        with SshMaster._lock:
+            dirname, SshMaster._dirname = SshMaster._dirname, None
+
+        if dirname is None or not os.path.isdir(dirname):
+            return
+
+        ssh = FileUtils.find_execute('ssh', exception=False)
+        if ssh:
+            with open(os.devnull, 'w') as devnull:
+                for name in os.listdir(dirname):
+                    # the host is ignored with the socket path itself
+                    subprocess.call(
+                        [ssh, '-o', 'ControlPath=%s' % os.path.join(
+                            dirname, name), '-O', 'exit', 'localhost'],
+                        stdout=devnull, stderr=devnull)
+
+        shutil.rmtree(dirname, ignore_errors=True)
+
+
+TOPIC_ENTRY = 'SshMaster'
@@ -4,7 +4,9 @@ import threading
 import types
 
 from command import Command
+from command_policy import CommandPolicy
 from logger import Logger
+from ssh_master import SshMaster
 
 
 class SubCommand(object):
@@ -79,6 +81,9 @@ class SubCommand(object):
             help='keep current head or tag name without new refs as the '
                  'last part')
 
+        SshMaster.options(optparse)
+        CommandPolicy.options(optparse)
+
         return options
 
     def options_import(self, optparse):
@@ -256,6 +261,12 @@ class SubCommand(object):
         # set the logger name at the beggining
         self.get_logger(self.get_name(options), level=1)
 
+        if options.ssh_multiplex:
+            SshMaster.enable(options.ssh_sessions)
+
+        if options.command_policy:
+            CommandPolicy.configure(options.command_policy)
+
         return True
 
 
@@ -0,0 +1,182 @@
+import os
+import re
+import threading
+
+from config_file import ConfigFile
+from error import ProcessingError
+from logger import Logger
+
+
+class TransferProfile(object):
+    """\
+Tunes the fetch and the push of a project with a named transfer profile.
+
+The profiles are defined in a config file as the sections "profile" with the
+git configurations passed as "-c" to git-clone, git-fetch and git-push:
+
+  [profile "huge"]
+  min-size = 2048
+  config = pack.threads=8
+  config = pack.windowMemory=256m
+  config = core.compression=1
+
+  [profile "small"]
+  max-size = 64
+  pattern = ^platform/prebuilts/
+  config = pack.depth=10
+
+The first profile in the file with a pattern matching the project name is
+selected, or the one of the largest "min-size" in MB within the size of the
+local objects, which isn't selected by the size before the project is cloned.
+The file could be set with "transfer-profiles" in ~/.krepconfig as well."""
+
+    SECTION = 'profile'
+
+    _lock = threading.Lock()
+    _profiles = dict()
+
+    def __init__(self, name, configs=None, patterns=None, min_size=None,
+                 max_size=None):
+        self.name = name
+        self.configs = configs or list()
+        self.patterns = [re.compile(pattern) for pattern in patterns or list()]
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def options(optparse):
+        options = optparse.get_option_group('--transfer-profiles') or \
+            optparse.add_option_group('Transfer profile options')
+        options.add_option(
+            '--transfer-profiles',
+            dest='transfer_profiles', action='store', metavar='FILE',
+            help='Set the config file of the transfer profiles to tune the '
+                 'fetch and the push per project')
+        options.add_option(
+            '--transfer-profile',
+            dest='transfer_profile', action='store', metavar='NAME',
+            help='Use the named transfer profile instead of selecting with '
+                 'the patterns and the sizes')
+
+    @staticmethod
+    def _list(value):
+        if value is None:
+            return list()
+        elif isinstance(value, list):
+            return [str(val) for val in value]
+        else:
+            return [str(value)]
+
+    @staticmethod
+    def load(filename):
+        """Returns the profiles in the file shared in the process."""
+        filename = os.path.realpath(os.path.expanduser(filename))
+        with TransferProfile._lock:
+            if filename in TransferProfile._profiles:
+                return TransferProfile._profiles[filename]
+
+            conf = ConfigFile(filename)
+
+            profiles = list()
+            # the patterns are matched in the order of the file
+            for name in conf.get_names(TransferProfile.SECTION):
+                pname = conf.get_subsection_name(name)
+                if conf.get_section_name(name) != TransferProfile.SECTION or \
+                        not pname:
+                    continue
+
+                vals = conf.get_values(TransferProfile.SECTION, pname)[-1]
+                configs = TransferProfile._list(vals.config)
+                for config in configs:
+                    if '=' not in config:
+                        raise ProcessingError(
+                            'profile "%s": config "%s" isn\'t like '
+                            '"name=value"' % (pname, config))
+
+                profiles.append(TransferProfile(
+                    pname, configs, TransferProfile._list(vals.pattern),
+                    int(vals.min_size) if vals.min_size else None,
+                    int(vals.max_size) if vals.max_size else None))
+
+            TransferProfile._profiles[filename] = profiles
+
+        return profiles
+
+    @staticmethod
+    def _size(project):
+        # unknown before the project is cloned
+        gitdir = project.get_gitdir()
+        if not gitdir or not os.path.isdir(gitdir):
+            return None
+
+        # in MB with both the loose objects and the packs
+        ret, output = project.count_objects('-v')
+        if ret != 0 or not output:
+            return 0
+
+        size = 0
+        for line in output.split('\n'):
+            name, _, value = line.partition(':')
+            if name.strip() in ('size', 'size-pack'):
+                size += int(value.strip() or 0)
+
+        return size / 1024
+
+    @staticmethod
+    def select(profiles, project, name=None, project_name=None):
+        """Returns the profile of the name or matched with the project, whose
+        name is the uri of the project by default."""
+        if name:
+            for profile in profiles:
+                if profile.name == name:
+                    return profile
+
+            raise ProcessingError('transfer profile "%s" not found' % name)
+
+        for profile in profiles:
+            for pattern in profile.patterns:
+                if pattern.search(project_name or project.uri):
+                    return profile
+
+        size, selected = None, None
+        for profile in profiles:
+            if profile.patterns or \
+                    profile.min_size is None and profile.max_size is None:
+                continue
+
+            if size is None:
+                size = TransferProfile._size(project)
+                if size is None:
+                    break
+
+            if (profile.min_size or 0) <= size and \
+                    (profile.max_size is None or size < profile.max_size) and \
+                    (selected is None or
+                     (profile.min_size or 0) > (selected.min_size or 0)):
+                selected = profile
+
+        return selected
+
+    @staticmethod
+    def apply(options, project, project_name=None):
+        """Sets the configurations of the selected profile to the project."""
+        if not options.transfer_profiles:
+            return None
+
+        profile = TransferProfile.select(
+            TransferProfile.load(options.transfer_profiles), project,
+            options.transfer_profile, project_name)
+
+        project.transfer_configs = list(profile.configs) if profile \
+            else list()
+        if profile:
+            Logger.get_logger().info(
+                '%s: transfer with profile "%s"', project, profile)
+
+        return profile
+
+
+TOPIC_ENTRY = 'TransferProfile'